@@ -0,0 +1,205 @@
+"""End-to-end throughput benchmark for the acquisition pipeline.
+
+Simulated shots are pushed through ExperimentWorker -> ComputationWorker ->
+MainWindow.update_plots for a range of record lengths. Every component runs on
+the main thread with direct signal connections so that each shot's latency is the
+total processing time from the moment its curves were transferred until the plots
+have been redrawn.
+
+Usage
+-----
+    python benchmarks/pipeline.py --output results.json
+    python benchmarks/pipeline.py --output new.json --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide2.QtCore import QMutex  # noqa: E402
+from PySide2.QtWidgets import QApplication  # noqa: E402
+from ns_trcd import common  # noqa: E402
+from ns_trcd.common import SimulationSettings, UiSettings  # noqa: E402
+from ns_trcd.comp_worker import ComputationWorker  # noqa: E402
+from ns_trcd.exp_worker import ExperimentWorker  # noqa: E402
+from ns_trcd.timing import StageTimings  # noqa: E402
+from ns_trcd.ui import MainWindow  # noqa: E402
+
+
+RECORD_LENGTHS = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+
+
+class ShotTimer:
+    """Records the time between a shot leaving the oscilloscope and being drawn.
+    """
+
+    def __init__(self, app):
+        self._app = app
+        self._start = None
+        self.latencies = []
+
+    def shot_computing(self, data):
+        """Remember when the shot that's about to be computed was acquired.
+
+        Shots can wait in the shot queue, so the time comes from the shot itself
+        rather than from when the queue was signalled.
+        """
+        self._start = data.acquired_at
+
+    def shot_displayed(self, sequence):
+        self._app.processEvents()
+        self.latencies.append(perf_counter() - self._start)
+
+
+class TimedComputationWorker(ComputationWorker):
+    """A computation worker that tells a timer about each shot before computing it.
+    """
+
+    def __init__(self, timer, *args):
+        super(TimedComputationWorker, self).__init__(*args)
+        self._timer = timer
+
+    def compute_signals(self, data):
+        self._timer.shot_computing(data)
+        super(TimedComputationWorker, self).compute_signals(data)
+
+
+def run_case(app, window, points, measurements, sim_settings):
+    """Run the pipeline for a single record length and summarize the results.
+    """
+    sim_settings.record_length = points
+    settings = UiSettings(
+        start_pt=1,
+        stop_pt=points,
+        instr_name="sim",
+        num_measurements=measurements,
+        simulation=sim_settings,
+    )
+    mutex = QMutex()
+    tracemalloc.start()
+    window.timings = StageTimings()
+    timer = ShotTimer(app)
+    comp_worker = TimedComputationWorker(timer, mutex, settings, window.timings)
+    exp_worker = ExperimentWorker(mutex, settings, window.timings)
+    comp_worker.attach(exp_worker.shots)
+    exp_worker.signals.shots_ready.connect(comp_worker.process_shots)
+    comp_worker.signals.time_axis.connect(window.set_time_axis)
+    # Every shot is drawn, bypassing the render scheduler's frame rate limit
+    comp_worker.signals.frame_ready.connect(
+        lambda sequence: window.update_plots(*comp_worker.frames.take())
+    )
+    comp_worker.signals.frame_ready.connect(timer.shot_displayed)
+    start = perf_counter()
+    exp_worker.measure()
+    elapsed = perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    common.SHOULD_STOP = False
+    latencies = np.array(timer.latencies) * 1e3
+    return {
+        "points": points,
+        "shots": len(latencies),
+        "shots_per_second": len(latencies) / elapsed,
+        "latency_ms": {
+            "p50": float(np.percentile(latencies, 50)),
+            "p90": float(np.percentile(latencies, 90)),
+            "p99": float(np.percentile(latencies, 99)),
+            "max": float(latencies.max()),
+        },
+        "peak_memory_mb": peak_memory / 1e6,
+        "stage_p50_ms": {
+            stage: stats["p50"] * 1e3
+            for stage, stats in window.timings.summary().items()
+        },
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print the change in throughput relative to a baseline run.
+
+    Returns
+    -------
+    bool
+        True if any record length regressed by more than `tolerance`.
+    """
+    regressed = False
+    previous = {case["points"]: case for case in baseline["cases"]}
+    for case in results["cases"]:
+        old = previous.get(case["points"])
+        if old is None:
+            continue
+        ratio = case["shots_per_second"] / old["shots_per_second"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{case['points']:>10} points: {ratio:6.2f}x shots/s{flag}")
+    return regressed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", default=None, help="a previous results file")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--measurements", type=int, default=20)
+    parser.add_argument(
+        "--record-lengths", type=int, nargs="+", default=RECORD_LENGTHS
+    )
+    parser.add_argument("--trigger-rate", type=float, default=10_000.0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, default=1e12)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    app = QApplication(sys.argv)
+    window = MainWindow()
+    window.show()
+    sim_settings = SimulationSettings(
+        trigger_rate=args.trigger_rate,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        seed=0,
+    )
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "simulation": {
+            "trigger_rate": args.trigger_rate,
+            "latency": args.latency,
+            "bandwidth": args.bandwidth,
+        },
+        "cases": [],
+    }
+    for points in args.record_lengths:
+        case = run_case(app, window, points, args.measurements, sim_settings)
+        results["cases"].append(case)
+        print(
+            f"{points:>10} points: {case['shots_per_second']:8.1f} shots/s, "
+            f"p50 {case['latency_ms']['p50']:8.2f} ms, "
+            f"p99 {case['latency_ms']['p99']:8.2f} ms, "
+            f"peak {case['peak_memory_mb']:8.1f} MB"
+        )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,37 @@
+from argparse import ArgumentParser
 from PySide2.QtWidgets import QApplication
 import sys
+from .logs import DEFAULT_LOG_FILE, LEVELS, configure_logging, shutdown_logging
 from .ui import MainWindow
 
 
-app = QApplication(sys.argv)
+parser = ArgumentParser(prog="ns_trcd")
+parser.add_argument(
+    "--log-file", default=str(DEFAULT_LOG_FILE), help="where to write the log"
+)
+parser.add_argument(
+    "--log-level", default="info", choices=list(LEVELS), help="what to log"
+)
+parser.add_argument(
+    "--log-sample",
+    nargs=2,
+    action="append",
+    default=[],
+    metavar=("ACTION", "RATE"),
+    help="only log a fraction of an action, e.g. --log-sample update_plots 0.01",
+)
+args, qt_args = parser.parse_known_args()
+configure_logging(
+    args.log_file,
+    args.log_level,
+    {action: float(rate) for action, rate in args.log_sample},
+)
+
+app = QApplication(sys.argv[:1] + qt_args)
 
 window = MainWindow()
 window.show()
 
-sys.exit(app.exec_())
+exit_code = app.exec_()
+shutdown_logging()
+sys.exit(exit_code)
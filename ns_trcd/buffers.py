@@ -0,0 +1,174 @@
+import numpy as np
+from threading import Lock
+
+
+class PooledBuffers:
+    """A set of arrays that can be reused once nothing refers to them anymore.
+
+    Notes
+    -----
+    Each holder of a set of buffers (the computation worker, the GUI, etc) owns one
+    reference to it. A holder that passes the buffers on to another holder must
+    `retain` them on behalf of the new holder first, and every holder must `release`
+    them once it's done with the data. The buffers only return to their pool, where
+    they can be overwritten, once every reference has been released.
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.refs = 0
+        self.pool = None
+
+    @property
+    def nbytes(self):
+        """The memory used by the arrays.
+        """
+        return sum(v.nbytes for v in vars(self).values() if isinstance(v, np.ndarray))
+
+    def retain(self):
+        self.pool.retain(self)
+
+    def release(self):
+        self.pool.release(self)
+
+
+class TraceBuffers(PooledBuffers):
+    """Scaled oscilloscope traces from a single acquisition.
+    """
+
+    def __init__(self, points):
+        super(TraceBuffers, self).__init__(points)
+        self.par = np.empty(points)
+        self.perp = np.empty(points)
+        self.ref = np.empty(points)
+
+
+class BufferPool:
+    """A pool of preallocated buffers that are handed out and reused.
+
+    Parameters
+    ----------
+    kind : type
+        The subclass of `PooledBuffers` to create.
+    points : int
+        The length of each array in the buffers.
+    size : int
+        The number of buffers to preallocate.
+
+    Notes
+    -----
+    The pool never blocks. If every buffer is still in use a new one is allocated
+    and the pool grows, so buffers that are in use are never overwritten. The
+    number of buffers that have been allocated is stored in `allocations`.
+    """
+
+    def __init__(self, kind, points, size):
+        self.kind = kind
+        self.points = points
+        self.allocations = 0
+        self._lock = Lock()
+        self._free = [self._allocate() for _ in range(size)]
+
+    def _allocate(self):
+        buffers = self.kind(self.points)
+        buffers.pool = self
+        self.allocations += 1
+        return buffers
+
+    def acquire(self):
+        """Take a set of buffers from the pool, owning its only reference.
+        """
+        with self._lock:
+            buffers = self._free.pop() if self._free else None
+        if buffers is None:
+            buffers = self._allocate()
+        buffers.refs = 1
+        return buffers
+
+    def retain(self, buffers):
+        with self._lock:
+            buffers.refs += 1
+
+    def release(self, buffers):
+        with self._lock:
+            buffers.refs -= 1
+            if buffers.refs == 0:
+                self._free.append(buffers)
+
+    def free_count(self):
+        with self._lock:
+            return len(self._free)
+
+
+class FrameExchange:
+    """Hands the newest data from the computation thread to the GUI thread.
+
+    The computation worker fills pooled buffers (the back buffers) and publishes
+    them here, replacing any data that the GUI hasn't taken yet, and the GUI takes
+    the newest data when it draws a frame (the front buffers). Data that's replaced
+    before it's taken is released straight back to its pool, so the memory used
+    doesn't depend on how far the GUI falls behind.
+
+    Notes
+    -----
+    Since not every `PlotData` contains dA signals, the newest traces and the
+    newest dA signals are kept separately so that data without dA never replaces
+    data with it. Whoever takes the data owns the references to its buffers, see
+    `PlotData.release`.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._traces = None
+        self._da = None
+        self._notified = False
+        self.sequence = 0
+        self.dropped = 0
+
+    def publish(self, data):
+        """Make data available to the GUI, taking over the references to its buffers.
+
+        Returns
+        -------
+        bool
+            True if the GUI should be notified. The GUI is only notified once until
+            it takes the data, so notifications never pile up.
+        """
+        with self._lock:
+            if self._traces is not None:
+                self._traces.release(da=False)
+                self.dropped += 1
+            self._traces = data
+            if data.da_par is not None:
+                if self._da is not None:
+                    self._da.release(traces=False)
+                self._da = data
+            self.sequence += 1
+            notify = not self._notified
+            self._notified = True
+        return notify
+
+    def take(self):
+        """Take the newest data that hasn't been taken yet.
+
+        Returns
+        -------
+        traces, da : PlotData or None
+            The data whose traces should be drawn and the data whose dA signals
+            should be drawn.
+        """
+        with self._lock:
+            traces, da = self._traces, self._da
+            self._traces = None
+            self._da = None
+            self._notified = False
+        return traces, da
+
+    def clear(self):
+        """Release any data that hasn't been taken.
+        """
+        traces, da = self.take()
+        if traces is not None:
+            traces.release(da=False)
+        if da is not None:
+            da.release(traces=False)
@@ -1,6 +1,6 @@
 import numpy as np
 from dataclasses import dataclass
-from typing import Union
+from typing import Any, Tuple, Union
 
 
 POINTS = 1_000
@@ -15,7 +15,16 @@ class PlotData:
     Notes
     -----
     The data in the da_* and avg_da_* fields are not always new since it takes
-    two acquisitions to calculate those signals.
+    two acquisitions to calculate those signals. The err_da_* fields contain the
+    per-point standard error of the avg_da_* fields.
+
+    The raw traces and dA signals are stored in pooled buffers (`trace_buffers` and
+    `da_buffers`). The receiver owns a reference to them and must call `release`
+    once the arrays are no longer being displayed so that they can be reused.
+
+    When the signals have been decimated for display they aren't pooled, and each
+    plot has its own time axis in `display_time` and error band edges in
+    `display_bands`, keyed by the name of the plot.
     """
 
     par: np.array
@@ -27,6 +36,34 @@ class PlotData:
     avg_da_par: Union[np.array, None]
     avg_da_perp: Union[np.array, None]
     avg_da_cd: Union[np.array, None]
+    err_da_par: Union[np.array, None] = None
+    err_da_perp: Union[np.array, None] = None
+    err_da_cd: Union[np.array, None] = None
+    trace_buffers: Any = None
+    da_buffers: Any = None
+    display_time: Any = None
+    display_bands: Any = None
+
+    def release(self, traces=True, da=True):
+        """Release the pooled buffers backing the arrays once they aren't needed.
+
+        Until this is called the arrays are guaranteed not to be overwritten.
+        """
+        if traces and (self.trace_buffers is not None):
+            self.trace_buffers.release()
+            self.trace_buffers = None
+        if da and (self.da_buffers is not None):
+            self.da_buffers.release()
+            self.da_buffers = None
+
+
+@dataclass
+class TriggerWait:
+    """How long it took for the oscilloscope to reach a trigger state.
+    """
+
+    polls: int
+    wait_time: float
 
 
 @dataclass
@@ -38,6 +75,8 @@ class RawData:
     perp: np.ndarray
     ref: np.ndarray
     has_pump: bool
+    trigger_wait: Union[TriggerWait, None] = None
+    acquired_at: Union[float, None] = None
 
 
 @dataclass
@@ -55,6 +94,20 @@ class Preamble:
     points: int
 
 
+@dataclass
+class SimulationSettings:
+    """Settings for the simulated oscilloscope and shutter.
+    """
+
+    trigger_rate: float = 20.0
+    record_length: int = 10_000
+    t_res: float = 4e-9
+    latency: float = 1e-3
+    bandwidth: float = 20e6
+    noise: float = 1e-3
+    seed: Union[int, None] = None
+
+
 @dataclass
 class UiSettings:
     """Settings provided by the user via the UI.
@@ -68,3 +121,25 @@ class UiSettings:
     num_measurements: int = 5
     save: bool = False
     save_loc: Union[str, None] = None
+    keep_runs: Union[int, None] = None
+    max_run_age_days: Union[float, None] = None
+    binary_transfer: bool = True
+    max_poll_rate: float = 1_000.0
+    preamble_check_interval: float = 1.0
+    resync_settings: bool = True
+    shutter_port: str = "COM4"
+    simulation: Union[SimulationSettings, None] = None
+    target_cd_error: Union[float, None] = None
+    cd_error_window: Union[Tuple[float, float], None] = None
+    convergence_min_measurements: int = 10
+    preallocate_run_file: bool = False
+    save_raw_codes: bool = False
+    compress_run_file: bool = False
+    compression_codec: str = "zlib"
+    max_fps: float = 30.0
+    decimate_display: bool = True
+    writer_queue_size: int = 64
+    writer_queue_bytes: int = 1_000_000_000
+    writer_policy: str = "block"
+    shot_queue_size: int = 8
+    shot_queue_policy: str = "block"
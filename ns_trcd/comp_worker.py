@@ -1,16 +1,60 @@
-import shutil
 import numpy as np
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
+from threading import Thread
+from time import perf_counter
 from pathlib import Path
 from eliot import start_action, Message, Action
-from PySide2.QtCore import QObject, Signal, Slot
+from PySide2.QtCore import QObject, QTimer, Signal, Slot
 from . import common
+from .buffers import BufferPool, FrameExchange, PooledBuffers, TraceBuffers
 from .common import PlotData, RawData, Preamble, POINTS
+from .decimate import band_envelope, envelope_bins, envelope_time, minmax_envelope
+from .stats import RunningStats
+from .timing import StageTimings
+from .storage import (
+    DATASETS,
+    RUN_FILE_NAME,
+    BackgroundWriter,
+    CompressedRunWriter,
+    RunStore,
+    RunWriter,
+    append_preamble,
+    create_run_dir,
+    read_preambles,
+    remove_old_runs,
+)
 
 
 np.seterr(invalid="raise", divide="raise")
 
 
+# Factor for converting the change in the perp/par ratio into CD
+CD_FACTOR = 4 / 2.3
+# Number of buffers preallocated for each pool. Two sets of traces are held while
+# waiting for a with/without pump pair, and one set of dA signals is being computed.
+# The display is decimated by default, which releases the full-resolution buffers
+# as soon as they're published. Otherwise the frame exchange and the GUI hold more
+# sets and the pools grow to fit them, since each set can be gigabytes long.
+TRACE_POOL_SIZE = 2
+DA_POOL_SIZE = 1
+# The plots that are sent decimated signals, and the PlotData field each one shows
+DISPLAY_SIGNALS = {
+    "live_par": "par",
+    "live_perp": "perp",
+    "live_ref": "ref",
+    "live_da_par": "da_par",
+    "live_da_perp": "da_perp",
+    "live_da_cd": "da_cd",
+    "avg_da_par": "avg_da_par",
+    "avg_da_perp": "avg_da_perp",
+    "avg_da_cd": "avg_da_cd",
+}
+# Number of bins used for plots whose width hasn't been reported
+DEFAULT_DISPLAY_WIDTH = 2_000
+# The datasets saved when only the raw digitizer codes are kept
+RAW_DATASETS = DATASETS[:6]
+
+
 @dataclass
 class MeasurementData:
     par: np.array
@@ -18,19 +62,219 @@ class MeasurementData:
     ref: np.array
 
 
+class DaBuffers(PooledBuffers):
+    """The dA signals from a single measurement and a snapshot of the averages.
+    """
+
+    def __init__(self, points):
+        super(DaBuffers, self).__init__(points)
+        self.da_par = np.empty(points)
+        self.da_perp = np.empty(points)
+        self.da_cd = np.empty(points)
+        self.avg_da_par = np.empty(points)
+        self.avg_da_perp = np.empty(points)
+        self.avg_da_cd = np.empty(points)
+        self.err_da_par = np.empty(points)
+        self.err_da_perp = np.empty(points)
+        self.err_da_cd = np.empty(points)
+
+
+class DaScratch:
+    """Intermediate results used by `compute_da_into`.
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.ref_term = np.empty(points)
+        self.scratch = np.empty(points)
+        self.valid = np.empty(points, dtype=bool)
+        self.valid_cd = np.empty(points, dtype=bool)
+
+
+def release_buffers(buffers):
+    """Release buffers that came from a pool, ignoring anything else.
+    """
+    if isinstance(buffers, PooledBuffers):
+        buffers.release()
+
+
+def scale_trace_into(raw, scale, offset, dark_curr, out):
+    """Convert a raw trace to volts and subtract the dark current, in place.
+    """
+    if dark_curr is not None:
+        offset = offset - dark_curr
+    np.multiply(raw, scale, out=out)
+    np.add(out, offset, out=out)
+
+
+def compute_da_into(with_pump, without_pump, buffers, scratch, fill=0.0):
+    """Compute dA and CD without allocating any temporary arrays.
+
+    dA is computed as a difference of logs, using the fact that
+    -log10((Ip/Rp)/(In/Rn)) = log10(In/Ip) + log10(Rp/Rn), where I and R are the
+    detector and reference intensities with (p) and without (n) the pump. The
+    reference term is shared between the par and perp signals, so only three
+    logarithms are taken per point instead of six divisions and two logarithms of
+    the reference implementation.
+
+    Parameters
+    ----------
+    with_pump : MeasurementData
+        The signals measured with the pump.
+    without_pump : MeasurementData
+        The signals measured without the pump.
+    buffers : DaBuffers
+        The buffers that the results are written into.
+    scratch : DaScratch
+        Buffers for intermediate results.
+    fill : float
+        The value used for points where the intensities a signal depends on aren't
+        all positive, since the signal isn't defined there. The points where each
+        signal is valid are left in `scratch.valid` for dA and `scratch.valid_cd`
+        for CD, which doesn't depend on the reference.
+
+    Returns
+    -------
+    int
+        The number of points where dA was filled because they weren't valid.
+    """
+    valid = scratch.valid
+    valid_cd = scratch.valid_cd
+    ref_term = scratch.ref_term
+    scratch = scratch.scratch
+    # CD is valid where every detector intensity is positive, and dA also needs
+    # the reference intensities to be positive
+    np.minimum(with_pump.par, with_pump.perp, out=scratch)
+    np.minimum(scratch, without_pump.par, out=scratch)
+    np.minimum(scratch, without_pump.perp, out=scratch)
+    np.greater(scratch, 0, out=valid_cd)
+    np.minimum(scratch, with_pump.ref, out=scratch)
+    np.minimum(scratch, without_pump.ref, out=scratch)
+    np.greater(scratch, 0, out=valid)
+    for out in (buffers.da_par, buffers.da_perp, buffers.da_cd):
+        out.fill(fill)
+    np.divide(with_pump.ref, without_pump.ref, out=ref_term, where=valid)
+    np.log10(ref_term, out=ref_term, where=valid)
+    np.divide(without_pump.par, with_pump.par, out=scratch, where=valid)
+    np.log10(scratch, out=scratch, where=valid)
+    np.add(scratch, ref_term, out=buffers.da_par, where=valid)
+    np.divide(without_pump.perp, with_pump.perp, out=scratch, where=valid)
+    np.log10(scratch, out=scratch, where=valid)
+    np.add(scratch, ref_term, out=buffers.da_perp, where=valid)
+    np.divide(with_pump.perp, with_pump.par, out=scratch, where=valid_cd)
+    np.divide(without_pump.perp, without_pump.par, out=buffers.da_cd, where=valid_cd)
+    np.subtract(scratch, buffers.da_cd, out=buffers.da_cd, where=valid_cd)
+    np.multiply(buffers.da_cd, CD_FACTOR, out=buffers.da_cd, where=valid_cd)
+    return valid.size - np.count_nonzero(valid)
+
+
+def measurement_numbers(run):
+    """The measurement number of each row in a run file.
+
+    Measurements are numbered from one, and measurements that were dropped
+    instead of saved don't have a row.
+    """
+    dropped = run.metadata.get("dropped_measurements", [])
+    numbers = np.arange(1, len(run) + len(dropped) + 1)
+    return np.setdiff1d(numbers, dropped)
+
+
+def load_volts(run, name, shots=slice(None)):
+    """Load traces from a run file in volts with the dark current subtracted.
+
+    Parameters
+    ----------
+    run : RunReader or CompressedRunReader
+        The run file.
+    name : str
+        The trace to load e.g. "with_pump_par".
+    shots : slice or int or array of int
+        The measurements to load.
+
+    Notes
+    -----
+    Runs that were saved as raw digitizer codes are converted using the preamble
+    that was in effect for each measurement.
+    """
+    if not run.metadata.get("raw_codes", False):
+        return run.read(name, shots)
+    preambles = read_preambles(run)
+    if not preambles:
+        raise ValueError("the run file doesn't contain a preamble")
+    channel = name.rsplit("_", 1)[1]
+    starts = [p["from_measurement"] for p in preambles]
+    scales = np.array([p[f"v_scale_{channel}"] for p in preambles])
+    offsets = np.array([p[f"v_offset_{channel}"] for p in preambles])
+    rows = np.searchsorted(starts, measurement_numbers(run)[shots], side="right") - 1
+    codes = run.read(name, shots)
+    out = np.empty(codes.shape)
+    scale_trace_into(
+        codes,
+        scales[rows, np.newaxis],
+        offsets[rows, np.newaxis],
+        run.metadata["settings"][f"dark_curr_{channel}"],
+        out,
+    )
+    return out
+
+
+def load_da(run, shots=slice(None)):
+    """Load the dA signals of measurements in a run file.
+
+    Parameters
+    ----------
+    run : RunReader or CompressedRunReader
+        The run file.
+    shots : slice or int or array of int
+        The measurements to load.
+
+    Returns
+    -------
+    tuple of np.ndarray
+        The parallel, perpendicular, and CD signals, with one row per measurement.
+
+    Notes
+    -----
+    Runs that were saved as raw digitizer codes are computed from the traces with
+    one vectorized call for all of the measurements.
+    """
+    if not run.metadata.get("raw_codes", False):
+        return tuple(run.read(name, shots) for name in ("da_par", "da_perp", "da_cd"))
+    with_pump = MeasurementData(
+        *(load_volts(run, f"with_pump_{c}", shots) for c in ("par", "perp", "ref"))
+    )
+    without_pump = MeasurementData(
+        *(load_volts(run, f"without_pump_{c}", shots) for c in ("par", "perp", "ref"))
+    )
+    shape = with_pump.par.shape
+    buffers = DaBuffers(shape)
+    compute_da_into(with_pump, without_pump, buffers, DaScratch(shape))
+    return buffers.da_par, buffers.da_perp, buffers.da_cd
+
+
 class ComputationSignals(QObject):
     """Signals produced by the computation worker
 
-    data : PlotData
-        Emitted when new data is ready.
+    frame_ready : int
+        Emitted with the frame's sequence number when new data has been published to
+        the worker's `FrameExchange`. It isn't emitted again until the data has been
+        taken.
     stop_measuring : empty
         Emitted when the last measurement has been collected
+    writer_queue : int, int
+        Emitted when a measurement is saved, with the number of items waiting to be
+        written and the number of measurements dropped because the queue was full.
+    shot_queue : int, int
+        Emitted when a shot is taken from the shot queue, with the number of shots
+        still waiting to be computed and the number of shots dropped so far.
     """
 
-    new_data = Signal(PlotData)
+    frame_ready = Signal(int)
     time_axis = Signal(np.ndarray)
     meas_num = Signal(int)
     stop_measuring = Signal()
+    writer_queue = Signal(int, int)
+    shot_queue = Signal(int, int)
 
 
 class ComputationWorker(QObject):
@@ -44,25 +288,37 @@ class ComputationWorker(QObject):
     -----
     Currently only performs dummy calculations with dummy data sent from the experiment
     worker.
+
+    The time spent on each stage of the computation is recorded in `timings`, which
+    may be shared with other workers.
     """
 
-    def __init__(self, mutex, ui_settings):
+    def __init__(self, mutex, ui_settings, timings=None):
         super(ComputationWorker, self).__init__()
         self.mutex = mutex
         self.signals = ComputationSignals()
+        self.frames = FrameExchange()
+        self.timings = StageTimings() if timings is None else timings
+        self.shots = None
+        self.ui_settings = ui_settings
         self.save = ui_settings.save
+        self._cleanup_thread = None
         if self.save:
-            self.save_dir = Path(ui_settings.save_loc)
-            self._clear_save_dir()
+            self.save_dir = create_run_dir(ui_settings.save_loc)
+            self._remove_old_runs(ui_settings)
         else:
             self.save_dir = None
         self.count = 0
         self.average_count = 0
         self.should_reset_averages = False
         self.max_measurements = ui_settings.num_measurements
-        self.avg_da_par = np.zeros(POINTS)
-        self.avg_da_perp = np.zeros(POINTS)
-        self.avg_da_cd = np.zeros(POINTS)
+        self.target_cd_error = ui_settings.target_cd_error
+        self.cd_error_window = ui_settings.cd_error_window
+        self.convergence_min_measurements = ui_settings.convergence_min_measurements
+        self.cd_error = None
+        self.converged = False
+        self._cd_error_points = (None, None)
+        self._create_stats(POINTS)
         self.with_pump = None
         self.without_pump = None
         self.t_res = None
@@ -77,6 +333,57 @@ class ComputationWorker(QObject):
         self.dark_curr_par = ui_settings.dark_curr_par
         self.dark_curr_perp = ui_settings.dark_curr_perp
         self.dark_curr_ref = ui_settings.dark_curr_ref
+        self.invalid_points = 0
+        self.da_buffers = None
+        self._trace_pool = None
+        self._da_pool = None
+        self._da_scratch = None
+        self.preamble = None
+        self.run_writer = None
+        self.preallocate_run_file = ui_settings.preallocate_run_file
+        self.compress_run_file = ui_settings.compress_run_file
+        self.compression_codec = ui_settings.compression_codec
+        self.save_raw_codes = ui_settings.save_raw_codes
+        self._raw_with_pump = None
+        self._raw_without_pump = None
+        self.decimate_display = ui_settings.decimate_display
+        self._display_ranges = dict()
+        self._display_bins = dict()
+        self._display_points = None
+        self._band_scratch = None
+        self._last_display = None
+        self._last_display_da = None
+        self.writer_queue_size = ui_settings.writer_queue_size
+        self.writer_queue_bytes = ui_settings.writer_queue_bytes
+        self.writer_policy = ui_settings.writer_policy
+        self._preambles_saved = 0
+        self._dropped_measurements = []
+
+    def attach(self, shots):
+        """Take the shots to compute from an experiment worker's `ShotQueue`.
+        """
+        self.shots = shots
+
+    @Slot()
+    def process_shots(self):
+        """Compute the oldest shot, or apply the oldest preamble, in the shot queue.
+
+        Notes
+        -----
+        Only one item is taken per call so that other events, like changes to the
+        display range, aren't held up while the queue is full. The call is
+        repeated through the event loop until the queue is empty.
+        """
+        item, more = self.shots.get()
+        if isinstance(item, Preamble):
+            self.store_preamble(item)
+        elif item is not None:
+            if item.acquired_at is not None:
+                self.timings.record("shot_queue", perf_counter() - item.acquired_at)
+            self.compute_signals(item)
+            self.signals.shot_queue.emit(self.shots.depth(), self.shots.dropped)
+        if more:
+            QTimer.singleShot(0, self.process_shots)
 
     @Slot(Preamble)
     def store_preamble(self, preamble):
@@ -96,9 +403,104 @@ class ComputationWorker(QObject):
         self.v_scale_perp = preamble.v_scale_perp
         self.v_scale_ref = preamble.v_scale_ref
         self.points = preamble.points
+        self.preamble = preamble
+        if self.run_writer is not None:
+            self._record_preamble()
+        self._ensure_pools(self.points)
+        self._cd_error_points = self._window_points(self.cd_error_window)
         time_values = self.t_res * np.arange(self.points)
         self.signals.time_axis.emit(time_values)
 
+    def _window_points(self, window):
+        """The points of the trace within a window in seconds, as (start, stop).
+
+        The window is clipped to the trace. A missing window, or one that doesn't
+        overlap the trace, covers the whole trace.
+        """
+        if window is None:
+            return None, None
+        start = max(int(round(window[0] / self.t_res)), 0)
+        stop = min(int(round(window[1] / self.t_res)) + 1, self.points)
+        if start >= stop:
+            Message.log(
+                message_type="cd_error_window_outside_trace",
+                window=window,
+                trace_length=self.points * self.t_res,
+            )
+            return None, None
+        return start, stop
+
+    def _ensure_pools(self, points):
+        """Preallocate the buffers for traces with the given number of points.
+
+        The pools are kept if they already have buffers of the right length, since
+        the preamble is resent whenever the vertical scale or offset changes.
+        """
+        if (self._trace_pool is not None) and (self._trace_pool.points == points):
+            return
+        self._trace_pool = BufferPool(TraceBuffers, points, TRACE_POOL_SIZE)
+        self._da_pool = BufferPool(DaBuffers, points, DA_POOL_SIZE)
+        self._da_scratch = DaScratch(points)
+
+    def _create_stats(self, points):
+        """Create empty running statistics for signals with the given number of points.
+
+        The avg_da_* attributes refer to the running means, which are updated in
+        place.
+        """
+        self.stats_da_par = RunningStats(points)
+        self.stats_da_perp = RunningStats(points)
+        self.stats_da_cd = RunningStats(points)
+        self.avg_da_par = self.stats_da_par.mean
+        self.avg_da_perp = self.stats_da_perp.mean
+        self.avg_da_cd = self.stats_da_cd.mean
+
+    def _scale_traces(self, data):
+        """Scale the raw traces to volts and subtract the dark current in place.
+
+        Returns
+        -------
+        TraceBuffers
+            Buffers from the pool holding the scaled traces. The caller owns the
+            only reference to them.
+        """
+        self._ensure_pools(len(data.par))
+        buffers = self._trace_pool.acquire()
+        scale_trace_into(
+            data.par,
+            self.v_scale_par,
+            self.v_offset_par,
+            self.dark_curr_par,
+            buffers.par,
+        )
+        scale_trace_into(
+            data.perp,
+            self.v_scale_perp,
+            self.v_offset_perp,
+            self.dark_curr_perp,
+            buffers.perp,
+        )
+        scale_trace_into(
+            data.ref,
+            self.v_scale_ref,
+            self.v_offset_ref,
+            self.dark_curr_ref,
+            buffers.ref,
+        )
+        return buffers
+
+    def _release_measurements(self):
+        """Give up the references held to the stored traces and dA signals.
+        """
+        release_buffers(self.with_pump)
+        release_buffers(self.without_pump)
+        release_buffers(self.da_buffers)
+        self.with_pump = None
+        self.without_pump = None
+        self.da_buffers = None
+        self._raw_with_pump = None
+        self._raw_without_pump = None
+
     @Slot(RawData)
     def compute_signals(self, data):
         """Compute dA from the oscilloscope traces.
@@ -111,33 +513,53 @@ class ComputationWorker(QObject):
 
         Emits
         -----
-        PlotData
+        int
+            The sequence number of the new data in `frames`.
 
         Notes
         -----
         New dA traces are only generated on every other acquisition since you
         need measurements with and without the pump in order to calculate dA.
+
+        The traces and dA signals are published to `frames` without being copied,
+        and whoever takes them owns a reference to their buffers, see
+        `PlotData.release`.
+
+        Shots that arrive once the run has converged or collected every measurement,
+        e.g. ones that were still queued when it stopped, are ignored.
         """
-        par = data.par * self.v_scale_par + self.v_offset_par
-        perp = data.perp * self.v_scale_perp + self.v_offset_perp
-        ref = data.ref * self.v_scale_ref + self.v_offset_ref
-        if self.dark_curr_par is not None:
-            par -= self.dark_curr_par
-        if self.dark_curr_perp is not None:
-            perp -= self.dark_curr_perp
-        if self.dark_curr_ref is not None:
-            ref -= self.dark_curr_ref
+        if self.converged or (self.count >= self.max_measurements):
+            return
+        with self.timings.time("scale"):
+            traces = self._scale_traces(data)
+        par, perp, ref = traces.par, traces.perp, traces.ref
         if data.has_pump:
-            self.with_pump = MeasurementData(par, perp, ref)
+            release_buffers(self.with_pump)
+            self.with_pump = traces
+            self._raw_with_pump = data
         else:
-            self.without_pump = MeasurementData(par, perp, ref)
+            release_buffers(self.without_pump)
+            self.without_pump = traces
+            self._raw_without_pump = data
+        traces.retain()
         # Compute the dA signals if we have both required sets of data
         if (self.with_pump is not None) and (self.without_pump is not None):
             self.count += 1
             self.average_count += 1
             self.signals.meas_num.emit(self.count)
-            da_par, da_perp, da_cd = self.compute_da()
-            self.update_averages(da_par, da_perp, da_cd)
+            with self.timings.time("compute_da"):
+                da_par, da_perp, da_cd = self.compute_da()
+            da_buffers = self.da_buffers
+            with self.timings.time("update_averages"):
+                self.update_averages(
+                    da_par,
+                    da_perp,
+                    da_cd,
+                    self._da_scratch.valid,
+                    self._da_scratch.valid_cd,
+                )
+                self._snapshot_averages(da_buffers)
+            da_buffers.retain()
             plot_data = PlotData(
                 par,
                 perp,
@@ -145,25 +567,184 @@ class ComputationWorker(QObject):
                 da_par,
                 da_perp,
                 da_cd,
-                self.avg_da_par,
-                self.avg_da_perp,
-                self.avg_da_cd,
+                da_buffers.avg_da_par,
+                da_buffers.avg_da_perp,
+                da_buffers.avg_da_cd,
+                err_da_par=da_buffers.err_da_par,
+                err_da_perp=da_buffers.err_da_perp,
+                err_da_cd=da_buffers.err_da_cd,
+                trace_buffers=traces,
+                da_buffers=da_buffers,
             )
-            self.signals.new_data.emit(plot_data)
+            self._publish(self._for_display(plot_data))
             if self.save:
-                self._save_measurement(da_par, da_perp, da_cd)
-            self.with_pump = None
-            self.without_pump = None
-            if self.count >= self.max_measurements:
+                with self.timings.time("save_queue"):
+                    self._save_measurement(da_par, da_perp, da_cd)
+            self._release_measurements()
+            self.converged = self._has_converged()
+            if self.converged or (self.count >= self.max_measurements):
                 self.mutex.lock()
                 common.SHOULD_STOP = True
                 self.mutex.unlock()
         else:
-            plot_data = PlotData(par, perp, ref, None, None, None, None, None, None)
-            self.signals.new_data.emit(plot_data)
+            plot_data = PlotData(
+                par, perp, ref, None, None, None, None, None, None, trace_buffers=traces
+            )
+            self._publish(self._for_display(plot_data))
+
+    def _publish(self, data):
+        """Hand the data off to the GUI, only signalling it if it's caught up.
+        """
+        if self.frames.publish(data):
+            self.signals.frame_ready.emit(self.frames.sequence)
+
+    @Slot(str, int, float, float)
+    def set_display_range(self, plot, width, start, stop):
+        """Set the part of a signal that's visible and how many pixels it spans.
+
+        Parameters
+        ----------
+        plot : str
+            One of the plots in `DISPLAY_SIGNALS`.
+        width : int
+            The width of the plot in pixels.
+        start : float
+            The earliest visible time in seconds, or NaN to show the whole signal.
+        stop : float
+            The latest visible time in seconds, or NaN to show the whole signal.
+        """
+        if np.isnan(start) or np.isnan(stop):
+            start, stop = None, None
+        display_range = (max(width, 1), start, stop)
+        if self._display_ranges.get(plot) == display_range:
+            return
+        self._display_ranges[plot] = display_range
+        self._display_bins.pop(plot, None)
+        if DISPLAY_SIGNALS.get(plot, "").startswith("avg"):
+            self._republish_averages()
+
+    def _bins_for(self, plot, points):
+        """The decimation bins for a plot, which are cached until its range changes.
+        """
+        if points != self._display_points:
+            self._display_bins = dict()
+            self._display_points = points
+        bins = self._display_bins.get(plot)
+        if bins is None:
+            width, start, stop = self._display_ranges.get(
+                plot, (DEFAULT_DISPLAY_WIDTH, None, None)
+            )
+            if start is not None:
+                start = int(np.floor(start / self.t_res))
+                stop = int(np.ceil(stop / self.t_res)) + 1
+            bins = envelope_bins(points, width, start, stop)
+            self._display_bins[plot] = bins
+        return bins
+
+    def _for_display(self, data):
+        """Decimate the signals for display if the plots have reported their size.
+
+        The decimated signals are min/max envelopes with a bin per pixel in the
+        visible part of each plot, so they look the same as the full signals but
+        are small enough to draw quickly. The full-resolution data is released
+        since it's only needed for saving.
+        """
+        if (not self.decimate_display) or (not self._display_ranges):
+            return data
+        signals = dict()
+        times = dict()
+        bands = dict()
+        for plot, field in DISPLAY_SIGNALS.items():
+            y = getattr(data, field)
+            if y is None:
+                signals[field] = None
+                continue
+            err = None
+            if field.startswith("avg") and (data.err_da_par is not None):
+                err = getattr(data, field.replace("avg", "err"))
+            signals[field], times[plot], band = self._decimate(plot, y, err)
+            if band is not None:
+                bands[plot] = band
+        data.release()
+        display = PlotData(**signals, display_time=times, display_bands=bands)
+        # Kept so the averages can be redrawn for a new range without a new shot
+        self._last_display = display
+        if display.avg_da_par is not None:
+            self._last_display_da = display
+        return display
+
+    def _decimate(self, plot, y, err=None):
+        """The envelope of a signal for a plot, its time axis, and its error band.
+
+        The error band is None if there's no error.
+        """
+        points = len(y)
+        bins = self._bins_for(plot, points)
+        band = None
+        if err is not None:
+            if (self._band_scratch is None) or (len(self._band_scratch) != points):
+                self._band_scratch = np.empty(points)
+            band = band_envelope(y, err, bins, self._band_scratch)
+        return minmax_envelope(y, bins), envelope_time(bins, self.t_res), band
+
+    def _republish_averages(self):
+        """Decimate the running averages for the current display ranges again.
+
+        Only the newest full-resolution averages are kept, in the running
+        statistics, so this lets the average plots show full detail when zoomed in
+        even once the run has stopped. The other plots keep their last signals.
+        """
+        frame, da = self._last_display, self._last_display_da
+        if (frame is None) or (da is None) or (self.average_count == 0):
+            return
+        # A preamble with a new record length has arrived since the last average
+        if self._da_pool.points != self.stats_da_cd.points:
+            return
+        buffers = self._da_pool.acquire()
+        self._snapshot_averages(buffers)
+        signals = {f: getattr(frame, f) for f in ("par", "perp", "ref")}
+        signals.update({f: getattr(da, f) for f in ("da_par", "da_perp", "da_cd")})
+        times = {**da.display_time, **frame.display_time}
+        bands = dict()
+        for plot, field in DISPLAY_SIGNALS.items():
+            if field.startswith("avg"):
+                signals[field], times[plot], bands[plot] = self._decimate(
+                    plot,
+                    getattr(buffers, field),
+                    getattr(buffers, field.replace("avg", "err")),
+                )
+        buffers.release()
+        display = PlotData(**signals, display_time=times, display_bands=bands)
+        self._last_display = display
+        self._last_display_da = display
+        self._publish(display)
 
     def compute_da(self):
         """Compute the dA signals from the raw detector signals.
+
+        Notes
+        -----
+        The results are written into buffers from a pool, which are stored in
+        `da_buffers` until the measurement has been handed off. Points where any
+        intensity that a signal depends on is zero or negative are set to zero, and
+        the number of such points in dA is stored in `invalid_points`.
+        """
+        points = len(self.with_pump.par)
+        if (self._da_pool is None) or (self._da_pool.points != points):
+            self._da_pool = BufferPool(DaBuffers, points, DA_POOL_SIZE)
+            self._da_scratch = DaScratch(points)
+        release_buffers(self.da_buffers)
+        buffers = self._da_pool.acquire()
+        self.da_buffers = buffers
+        self.invalid_points = compute_da_into(
+            self.with_pump, self.without_pump, buffers, self._da_scratch
+        )
+        return buffers.da_par, buffers.da_perp, buffers.da_cd
+
+    def compute_da_reference(self):
+        """Compute the dA signals with the original, allocating implementation.
+
+        This is kept to check the results of `compute_da`.
         """
         with np.errstate(all="raise"):
             try:
@@ -200,29 +781,61 @@ class ComputationWorker(QObject):
         )
         return da_par, da_perp, da_cd
 
-    def update_averages(self, par, perp, cd):
+    def update_averages(self, par, perp, cd, valid=None, valid_cd=None):
         """Update averages in place with new data.
+
+        Parameters
+        ----------
+        par, perp, cd : np.ndarray
+            The signals of a single measurement.
+        valid, valid_cd : np.ndarray of bool, optional
+            The points where dA and CD are valid. The other points are left out of
+            the averages. Every point is valid by default.
+
+        Notes
+        -----
+        The running statistics also track the per-point variance of each signal,
+        see `RunningStats`.
         """
-        if self.count == 1:
-            self.avg_da_par = par
-            self.avg_da_perp = perp
-            self.avg_da_cd = cd
-        elif self.should_reset_averages:
-            self.avg_da_par = par
-            self.avg_da_perp = perp
-            self.avg_da_cd = cd
+        if self.stats_da_par.points != len(par):
+            self._create_stats(len(par))
+        if (self.count == 1) or self.should_reset_averages:
+            self.stats_da_par.reset()
+            self.stats_da_perp.reset()
+            self.stats_da_cd.reset()
             self.average_count = 1
             self.should_reset_averages = False
-        else:
-            self.avg_da_par = (self.average_count - 1) / (
-                self.average_count
-            ) * self.avg_da_par + 1 / self.average_count * par
-            self.avg_da_perp = (self.average_count - 1) / (
-                self.average_count
-            ) * self.avg_da_perp + 1 / self.average_count * perp
-            self.avg_da_cd = (self.average_count - 1) / (
-                self.average_count
-            ) * self.avg_da_cd + 1 / self.average_count * cd
+        self.stats_da_par.update(par, valid)
+        self.stats_da_perp.update(perp, valid)
+        self.stats_da_cd.update(cd, valid_cd)
+
+    def _snapshot_averages(self, buffers):
+        """Copy the averages and their standard errors into buffers for display.
+
+        The running averages change in place with every measurement, so they can't be
+        handed to another thread directly.
+        """
+        np.copyto(buffers.avg_da_par, self.avg_da_par)
+        np.copyto(buffers.avg_da_perp, self.avg_da_perp)
+        np.copyto(buffers.avg_da_cd, self.avg_da_cd)
+        self.stats_da_par.standard_error(out=buffers.err_da_par)
+        self.stats_da_perp.standard_error(out=buffers.err_da_perp)
+        self.stats_da_cd.standard_error(out=buffers.err_da_cd)
+
+    def _has_converged(self):
+        """Determine whether the average CD signal is known precisely enough.
+
+        The run has converged once the RMS standard error of `avg_da_cd` over
+        `cd_error_window` (in seconds, the whole trace by default) falls below
+        `target_cd_error`. Convergence is never checked when there's no target or
+        before `convergence_min_measurements` measurements have been averaged.
+        """
+        if self.target_cd_error is None:
+            return False
+        self.cd_error = self.stats_da_cd.window_standard_error(*self._cd_error_points)
+        if self.average_count < self.convergence_min_measurements:
+            return False
+        return self.cd_error <= self.target_cd_error
 
     @Slot()
     def reset_averages(self):
@@ -230,35 +843,152 @@ class ComputationWorker(QObject):
         """
         self.should_reset_averages = True
 
-    def _clear_save_dir(self):
-        """Delete the contents of the save directory.
+    def _remove_old_runs(self, ui_settings):
+        """Delete the runs that are past the retention policy in the background.
         """
-        for item in Path(self.save_dir).iterdir():
-            if item.is_dir():
-                shutil.rmtree(item)
-            else:
-                item.unlink()
+        if (ui_settings.keep_runs is None) and (ui_settings.max_run_age_days is None):
+            return
+        self._cleanup_thread = Thread(
+            target=remove_old_runs,
+            args=(Path(ui_settings.save_loc),),
+            kwargs={
+                "keep_runs": ui_settings.keep_runs,
+                "max_age_days": ui_settings.max_run_age_days,
+                "exclude": [self.save_dir],
+            },
+            name="remove-old-runs",
+            daemon=True,
+        )
+        self._cleanup_thread.start()
+
+    def _save_convergence(self):
+        """Record why the run stopped and how precise the average CD signal was.
+        """
+        self.run_writer.update_metadata(
+            convergence={
+                "measurements": self.count,
+                "averaged_measurements": self.average_count,
+                "converged": self.converged,
+                "cd_error": self.cd_error,
+                "target_cd_error": self.target_cd_error,
+                "cd_error_window": self.cd_error_window,
+            }
+        )
+
+    def _record_preamble(self):
+        """Add the current preamble to the ones saved next to the run file.
+
+        The preamble applies from the next measurement onwards, so the preamble
+        for any measurement is the last one recorded at or before it.
+        """
+        # The file is opened while the first measurement is being saved
+        start = self.count + 1 if self._preambles_saved else 1
+        append_preamble(
+            self.save_dir, {"from_measurement": start, **asdict(self.preamble)}
+        )
+        self._preambles_saved += 1
+
+    def _open_run_file(self, points):
+        """Create the file that every measurement in this run is saved to.
+
+        The measurements are written by a background thread, either into chunks
+        that are compressed on their own pool of threads when `compress_run_file`
+        is on, into a file that's preallocated for the maximum number of
+        measurements when `preallocate_run_file` is on, or appended to a file that
+        grows.
+        """
+        path = self.save_dir / RUN_FILE_NAME
+        metadata = {"settings": asdict(self.ui_settings), "raw_codes": False}
+        datasets = None
+        if self.save_raw_codes:
+            metadata["raw_codes"] = True
+            dtype = self._raw_with_pump.par.dtype
+            # Traces transferred as ASCII are integer codes stored as floats
+            if not np.issubdtype(dtype, np.integer):
+                dtype = np.dtype("<i2")
+            datasets = [(name, dtype) for name in RAW_DATASETS]
+        if self.compress_run_file:
+            writer = CompressedRunWriter(
+                path, points, datasets, metadata, codec=self.compression_codec
+            )
+        elif self.preallocate_run_file:
+            writer = RunStore(path, points, self.max_measurements, datasets, metadata)
+        else:
+            writer = RunWriter(path, points, datasets, metadata)
+        self.run_writer = BackgroundWriter(
+            writer,
+            self.writer_queue_size,
+            self.writer_policy,
+            self.writer_queue_bytes,
+            self.timings,
+        )
+        if self.preamble is not None:
+            self._record_preamble()
 
     def _save_measurement(self, da_par, da_perp, da_cd):
-        """Save the signals for a single measurement in NumPy binary format.
+        """Save the signals for a single measurement to the run file.
+        """
+        if self.run_writer is None:
+            self._open_run_file(len(da_par))
+        if self.save_raw_codes:
+            self._save_raw_codes()
+            return
+        arrays = {
+            "with_pump_par": self.with_pump.par,
+            "with_pump_perp": self.with_pump.perp,
+            "with_pump_ref": self.with_pump.ref,
+            "without_pump_par": self.without_pump.par,
+            "without_pump_perp": self.without_pump.perp,
+            "without_pump_ref": self.without_pump.ref,
+            "da_par": da_par,
+            "da_perp": da_perp,
+            "da_cd": da_cd,
+        }
+        buffers = [self.with_pump, self.without_pump, self.da_buffers]
+        if not self.run_writer.submit(arrays, buffers):
+            self._dropped_measurements.append(self.count)
+        self._report_writer_queue()
+
+    def _save_raw_codes(self):
+        """Save the digitizer codes that the traces in a measurement came from.
+
+        The raw data isn't pooled, so it's never overwritten while it's queued.
         """
-        meas_dir = self.save_dir / f"{self.count}"
-        meas_dir.mkdir()
-        with_pump_par_file = meas_dir / "with_pump_par.npy"
-        with_pump_perp_file = meas_dir / "with_pump_perp.npy"
-        with_pump_ref_file = meas_dir / "with_pump_ref.npy"
-        without_pump_par_file = meas_dir / "without_pump_par.npy"
-        without_pump_perp_file = meas_dir / "without_pump_perp.npy"
-        without_pump_ref_file = meas_dir / "without_pump_ref.npy"
-        da_par_file = meas_dir / "da_par.npy"
-        da_perp_file = meas_dir / "da_perp.npy"
-        da_cd_file = meas_dir / "da_cd.npy"
-        np.save(with_pump_par_file, self.with_pump.par)
-        np.save(with_pump_perp_file, self.with_pump.perp)
-        np.save(with_pump_ref_file, self.with_pump.ref)
-        np.save(without_pump_par_file, self.without_pump.par)
-        np.save(without_pump_perp_file, self.without_pump.perp)
-        np.save(without_pump_ref_file, self.without_pump.ref)
-        np.save(da_par_file, da_par)
-        np.save(da_perp_file, da_perp)
-        np.save(da_cd_file, da_cd)
+        arrays = dict()
+        for prefix, raw in (
+            ("with_pump", self._raw_with_pump),
+            ("without_pump", self._raw_without_pump),
+        ):
+            arrays[f"{prefix}_par"] = raw.par
+            arrays[f"{prefix}_perp"] = raw.perp
+            arrays[f"{prefix}_ref"] = raw.ref
+        if not self.run_writer.submit(arrays):
+            self._dropped_measurements.append(self.count)
+        self._report_writer_queue()
+
+    def _report_writer_queue(self):
+        self.signals.writer_queue.emit(self.run_writer.depth(), self.run_writer.dropped)
+
+    def close_run_file(self):
+        """Finish writing any queued measurements and close the run file.
+
+        Notes
+        -----
+        This blocks until the queue is empty, so it should only be called once
+        measurements are no longer being computed.
+        """
+        if self.run_writer is None:
+            return
+        with start_action(action_type="close_run_file"):
+            self._save_convergence()
+            if self._dropped_measurements:
+                self.run_writer.update_metadata(
+                    dropped_measurements=self._dropped_measurements
+                )
+            self.run_writer.close()
+            Message.log(
+                dropped=self.run_writer.dropped, error=repr(self.run_writer.error)
+            )
+            if self.compress_run_file:
+                Message.log(**self.run_writer.writer.stats())
+            self.run_writer = None
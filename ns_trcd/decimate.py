@@ -0,0 +1,98 @@
+import numpy as np
+
+
+# Number of bins used for the parts of a signal outside of the visible range, so
+# that the whole signal is still drawn when the view is reset
+OUTSIDE_BINS = 64
+
+
+def envelope_bins(points, width, start=None, stop=None, outside_bins=OUTSIDE_BINS):
+    """The first index of each bin when decimating a signal for display.
+
+    Parameters
+    ----------
+    points : int
+        The number of points in the signal.
+    width : int
+        The number of bins in the visible range, normally the width of the plot in
+        pixels.
+    start : int, optional
+        The first visible point. Defaults to the start of the signal.
+    stop : int, optional
+        The point after the last visible point. Defaults to the end of the signal.
+    outside_bins : int
+        The number of bins on either side of the visible range.
+
+    Returns
+    -------
+    np.ndarray
+        The sorted, unique indices. Ranges with fewer points than bins get one bin
+        per point.
+    """
+    start = 0 if start is None else min(max(start, 0), points)
+    stop = points if stop is None else min(max(stop, start), points)
+    edges = [np.linspace(start, stop, width + 1)[:-1]]
+    if start > 0:
+        edges.insert(0, np.linspace(0, start, outside_bins + 1)[:-1])
+    if stop < points:
+        edges.append(np.linspace(stop, points, outside_bins + 1)[:-1])
+    bins = np.unique(np.concatenate(edges).astype(np.intp))
+    return bins[bins < points]
+
+
+def minmax_envelope(y, bins, out=None):
+    """The minimum and maximum of a signal in each bin.
+
+    Parameters
+    ----------
+    y : np.ndarray
+        The signal.
+    bins : np.ndarray
+        The first index of each bin, see `envelope_bins`.
+    out : np.ndarray, optional
+        Where to store the result.
+
+    Returns
+    -------
+    np.ndarray
+        The minimum and maximum of each bin, interleaved, so that drawing a line
+        through them traces the envelope of the signal.
+    """
+    if out is None:
+        out = np.empty(2 * len(bins))
+    out[0::2] = np.minimum.reduceat(y, bins)
+    out[1::2] = np.maximum.reduceat(y, bins)
+    return out
+
+
+def band_envelope(avg, err, bins, scratch):
+    """The edges of an error band around a signal in each bin.
+
+    Parameters
+    ----------
+    avg : np.ndarray
+        The signal at the center of the band.
+    err : np.ndarray
+        The half-width of the band.
+    bins : np.ndarray
+        The first index of each bin, see `envelope_bins`.
+    scratch : np.ndarray
+        A buffer the same size as the signal for intermediate results.
+
+    Returns
+    -------
+    upper, lower : np.ndarray
+        The highest and lowest edge of the band in each bin, repeated so that they
+        line up with the output of `minmax_envelope`.
+    """
+    np.add(avg, err, out=scratch)
+    upper = np.repeat(np.maximum.reduceat(scratch, bins), 2)
+    np.subtract(avg, err, out=scratch)
+    lower = np.repeat(np.minimum.reduceat(scratch, bins), 2)
+    return upper, lower
+
+
+def envelope_time(bins, t_res):
+    """The times that go with the output of `minmax_envelope`.
+    """
+    return t_res * np.repeat(bins, 2)
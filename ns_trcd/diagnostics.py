@@ -0,0 +1,80 @@
+from PySide2.QtCore import Qt, QTimer, Slot
+from PySide2.QtWidgets import (
+    QDockWidget,
+    QFileDialog,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+from .timing import StageTimings
+
+
+# The statistics shown for each stage, in milliseconds
+COLUMNS = ("mean", "p50", "p90", "p99", "max")
+
+
+class DiagnosticsPanel(QDockWidget):
+    """A dock widget showing how long each stage of the pipeline takes per shot.
+
+    Parameters
+    ----------
+    refresh_ms : int
+        How often the table is updated while the panel is visible.
+    """
+
+    def __init__(self, parent=None, refresh_ms=1_000):
+        super(DiagnosticsPanel, self).__init__("Diagnostics", parent)
+        self.timings = StageTimings()
+        self.table = QTableWidget(0, len(COLUMNS) + 1)
+        self.table.setHorizontalHeaderLabels(
+            ["count"] + [f"{c} (ms)" for c in COLUMNS]
+        )
+        self.export_btn = QPushButton("Export...")
+        self.export_btn.clicked.connect(self.export)
+        layout = QVBoxLayout()
+        layout.addWidget(self.table)
+        layout.addWidget(self.export_btn)
+        contents = QWidget()
+        contents.setLayout(layout)
+        self.setWidget(contents)
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start(refresh_ms)
+
+    def show_timings(self, timings):
+        """Show the timings of a new run.
+        """
+        self.timings = timings
+        self.refresh()
+
+    @Slot()
+    def refresh(self):
+        """Update the table with the latest statistics.
+        """
+        if not self.isVisible():
+            return
+        summary = self.timings.summary()
+        self.table.setRowCount(len(summary))
+        self.table.setVerticalHeaderLabels(list(summary))
+        for row, stats in enumerate(summary.values()):
+            self._set_cell(row, 0, str(stats["count"]))
+            for col, name in enumerate(COLUMNS, start=1):
+                value = stats.get(name)
+                self._set_cell(row, col, "" if value is None else f"{value * 1e3:.3f}")
+
+    def _set_cell(self, row, col, text):
+        item = QTableWidgetItem(text)
+        item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+        self.table.setItem(row, col, item)
+
+    @Slot()
+    def export(self):
+        """Save the timings to a file chosen by the user.
+        """
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export Timings", "timings.json", "JSON (*.json)"
+        )
+        if path:
+            self.timings.export(path)
@@ -1,10 +1,14 @@
 # import structlog
+from time import perf_counter
 from serial import Serial, SerialException
 from pyvisa.errors import VisaIOError
 from PySide2.QtCore import QObject, Signal, Slot
 from . import common
 from .common import RawData, Preamble
 from .oscilloscope import Oscilloscope
+from .shot_queue import ShotQueue
+from .simulation import SimulatedLaser, SimulatedOscilloscope, SimulatedShutter
+from .timing import StageTimings
 
 
 # logger = structlog.get_logger()
@@ -13,15 +17,14 @@ from .oscilloscope import Oscilloscope
 class ExperimentSignals(QObject):
     """Signals that may be generated by the experiment worker.
 
-    new_data : RawData
-        Contains the parallel, perpendicular, reference, and shutter traces
-        from the oscilloscope. Generated for each acquisition.
+    shots_ready : empty
+        Emitted when shots or preambles have been queued in the worker's
+        `ShotQueue`. It isn't emitted again until the queue has been emptied.
     error : (exctype, value, traceback.format_exc())
         Emitted when there is an error in the experiment.
     """
 
-    new_data = Signal(RawData)
-    preamble = Signal(Preamble)
+    shots_ready = Signal()
     done = Signal()
     error = Signal(tuple)
 
@@ -34,23 +37,49 @@ class ExperimentWorker(QObject):
 
     Notes
     -----
-    Currently this only generates dummy data and does not communicate with the
-    oscilloscope.
+    Simulated instruments are used instead of the real ones when
+    `UiSettings.simulation` is set.
+
+    Each shot is put in `shots`, a bounded queue that the computation worker
+    takes them from, so memory use is bounded when computation falls behind.
+
+    The time spent waiting for triggers, reading the shutter, and transferring the
+    curves is recorded in `timings`, which may be shared with other workers.
     """
 
-    def __init__(self, mutex, ui_settings):
+    def __init__(self, mutex, ui_settings, timings=None):
         super(ExperimentWorker, self).__init__()
         self.mutex = mutex
         self.signals = ExperimentSignals()
+        self.shots = ShotQueue(
+            ui_settings.shot_queue_size, ui_settings.shot_queue_policy
+        )
+        self.timings = StageTimings() if timings is None else timings
         # self._log = logger.bind(worker="experiment")
         # log = self._log.bind(method="__init__")
         self.prev_had_pump = None
         self.start_pt = ui_settings.start_pt
         self.stop_pt = ui_settings.stop_pt
+        self.preamble_check_interval = ui_settings.preamble_check_interval
+        self.resync_settings = ui_settings.resync_settings
         try:
-            self._scope = Oscilloscope(ui_settings.instr_name)
+            if ui_settings.simulation is not None:
+                laser = SimulatedLaser(ui_settings.simulation.trigger_rate)
+                resource = SimulatedOscilloscope(ui_settings.simulation, laser)
+            else:
+                resource = ui_settings.instr_name
+            self._scope = Oscilloscope(
+                resource,
+                binary_transfer=ui_settings.binary_transfer,
+                max_poll_rate=ui_settings.max_poll_rate,
+            )
             # log.debug("oscilloscope connected")
-            self._shutter = Serial("COM4", baudrate=9_600, timeout=1)
+            if ui_settings.simulation is not None:
+                self._shutter = SimulatedShutter(laser)
+            else:
+                self._shutter = Serial(
+                    ui_settings.shutter_port, baudrate=9_600, timeout=1
+                )
             # log.debug("arduino connected")
         except (VisaIOError, SerialException, ValueError) as e:
             # log.err(e)
@@ -60,47 +89,57 @@ class ExperimentWorker(QObject):
             self.mutex.unlock()
             # log.debug("mutex unlocked")
 
+    def _should_stop(self):
+        """Check whether the experiment has been told to stop.
+        """
+        self.mutex.lock()
+        should_stop = common.SHOULD_STOP
+        self.mutex.unlock()
+        return should_stop
+
     def _ensure_basic_settings(self):
         """Ensure that a few settings always have default values.
+
+        Settings that the oscilloscope already has aren't sent again.
         """
-        self._scope.set_hi_res_mode()
-        self._scope.set_continuous_acquisition_mode()
-        self._scope.set_waveform_data_source_single_channel(1)
-        self._scope.set_waveform_encoding_ascii()
-        self._scope.set_waveform_start_point(1)
-        self._scope.set_waveform_stop_point(self._scope.get_waveform_length())
-        self._scope.add_immediate_mean_measurement(4)
-        self._scope.set_waveform_start_point(self.start_pt)
-        if self.stop_pt is None:
-            self._scope.set_waveform_stop_point(10_000_000)
-        else:
-            self._scope.set_waveform_stop_point(self.stop_pt)
+        if self.resync_settings:
+            self._scope.resync_settings()
+        with self._scope.batch(wait=True):
+            self._scope.set_hi_res_mode()
+            self._scope.set_continuous_acquisition_mode()
+            self._scope.set_waveform_data_source_single_channel(1)
+            self._scope.set_waveform_encoding()
+            self._scope.add_immediate_mean_measurement(4)
+            self._scope.set_waveform_start_point(self.start_pt)
+            if self.stop_pt is None:
+                self._scope.set_waveform_stop_point(10_000_000)
+            else:
+                self._scope.set_waveform_stop_point(self.stop_pt)
 
     def _send_preamble(self):
         """Send the data needed to reconstruct signals from the oscilloscope.
         """
-        time_res = self._scope.get_time_resolution()
-        self._scope.set_waveform_data_source_single_channel(1)
-        v_scale_par = self._scope.get_voltage_scale_factor()
-        v_offset_par = self._scope.get_vertical_offset_volts()
-        self._scope.set_waveform_data_source_single_channel(2)
-        v_scale_perp = self._scope.get_voltage_scale_factor()
-        v_offset_perp = self._scope.get_vertical_offset_volts()
-        self._scope.set_waveform_data_source_single_channel(3)
-        v_scale_ref = self._scope.get_voltage_scale_factor()
-        v_offset_ref = self._scope.get_vertical_offset_volts()
-        points = self._scope.get_waveform_length()
+        par = self._scope.get_channel_preamble(1)
+        perp = self._scope.get_channel_preamble(2)
+        ref = self._scope.get_channel_preamble(3)
         data = Preamble(
-            time_res,
-            v_scale_par,
-            v_offset_par,
-            v_scale_perp,
-            v_offset_perp,
-            v_scale_ref,
-            v_offset_ref,
-            points,
+            par.t_res,
+            par.v_scale,
+            par.v_offset,
+            perp.v_scale,
+            perp.v_offset,
+            ref.v_scale,
+            ref.v_offset,
+            par.points,
         )
-        self.signals.preamble.emit(data)
+        if self.shots.put_preamble(data):
+            self.signals.shots_ready.emit()
+
+    def _check_preamble(self):
+        """Resend the preamble if the vertical settings were changed during a run.
+        """
+        if self._scope.vertical_settings_changed([1, 2, 3]):
+            self._send_preamble()
 
     @Slot()
     def measure(self):
@@ -120,60 +159,63 @@ class ExperimentWorker(QObject):
         # log.debug("basic settings set")
         self._send_preamble()
         # log.debug("preamble sent")
+        self._scope.vertical_settings_changed([1, 2, 3])
+        last_preamble_check = perf_counter()
         self._scope.acquisition_start()
         # log.debug("oscilloscope started")
         self._shutter.reset_input_buffer()
         # log.debug("arduino buffer cleared")
         while True:
-            self.mutex.lock()
-            if common.SHOULD_STOP:
-                self.mutex.unlock()
+            trigger_wait = self._scope.trigger_waiter.wait_for(
+                "ready", should_stop=self._should_stop
+            )
+            if trigger_wait is None:
                 break
-            self.mutex.unlock()
-            if self._scope.get_trigger_state() == "ready":
-                # log.debug("oscilloscope is ready")
-                try:
+            self.timings.record("trigger_wait", trigger_wait.wait_time)
+            if perf_counter() - last_preamble_check > self.preamble_check_interval:
+                self._check_preamble()
+                last_preamble_check = perf_counter()
+            # log.debug("oscilloscope is ready")
+            try:
+                with self.timings.time("shutter_read"):
                     state = self._shutter.read(4)
-                    # log.debug("shutter", state=state)
-                except Exception as e:
-                    log.err(e)
-                # has_pump = self._scope.get_immediate_measurement_value() > 2.5
-                # log.debug("shutter", has_pump=has_pump)
-                if state == b"open":
-                    has_pump = True
-                elif state == b"shut":
-                    has_pump = False
-                else:
-                    continue
-                # has_pump = state == "open"
-                if self.prev_had_pump is None:
-                    # storing the opposite of has_pump prevents skipping the first measurement
-                    self.prev_had_pump = not has_pump
-                    # log.debug("stored initial pump state", prev_had_pump=(not has_pump))
-                if has_pump and self.prev_had_pump:
-                    # log.debug("skipping two successive pumps")
-                    continue
-                elif (not has_pump) and (not self.prev_had_pump):
-                    # log.debug("skipping two successive no-pumps")
-                    continue
-                else:
-                    # log.debug("collecting data from oscilloscope")
-                    self._scope.set_waveform_data_source_single_channel(1)
-                    par = self._scope.get_curve()
-                    self._scope.set_waveform_data_source_single_channel(2)
-                    perp = self._scope.get_curve()
-                    self._scope.set_waveform_data_source_single_channel(3)
-                    ref = self._scope.get_curve()
-                    data = RawData(par, perp, ref, has_pump)
-                    self.signals.new_data.emit(data)
-                    # log.debug("new data signal emitted")
-                    self.prev_had_pump = has_pump
+                # log.debug("shutter", state=state)
+            except Exception as e:
+                log.err(e)
+            # has_pump = self._scope.get_immediate_measurement_value() > 2.5
+            # log.debug("shutter", has_pump=has_pump)
+            if state == b"open":
+                has_pump = True
+            elif state == b"shut":
+                has_pump = False
+            else:
+                continue
+            # has_pump = state == "open"
+            if self.prev_had_pump is None:
+                # storing the opposite of has_pump prevents skipping the first measurement
+                self.prev_had_pump = not has_pump
+                # log.debug("stored initial pump state", prev_had_pump=(not has_pump))
+            if has_pump and self.prev_had_pump:
+                # log.debug("skipping two successive pumps")
+                continue
+            elif (not has_pump) and (not self.prev_had_pump):
+                # log.debug("skipping two successive no-pumps")
+                continue
+            else:
+                # log.debug("collecting data from oscilloscope")
+                with self.timings.time("transfer"):
+                    par, perp, ref = self._scope.get_curves([1, 2, 3])
+                data = RawData(par, perp, ref, has_pump, trigger_wait, perf_counter())
+                if self.shots.put(data, should_stop=self._should_stop):
+                    self.signals.shots_ready.emit()
+                # log.debug("new data queued")
+                self.prev_had_pump = has_pump
         self._scope.acquisition_stop()
         # log.debug("oscilloscope stopped")
         self._scope.cleanup()
         # log.debug("oscilloscope disconnected")
         self._shutter.close()
         # log.debug("arduino disconnected")
-        self.signals.new_data.disconnect()
+        self.signals.shots_ready.disconnect()
         self.signals.done.emit()
         # log.debug("done signal emitted")
@@ -0,0 +1,167 @@
+import json
+from eliot import add_destinations, remove_destination, start_action
+from pathlib import Path
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+
+
+# The levels that actions can be logged at, from least to most important
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "off": 100}
+DEFAULT_LOG_FILE = Path.home() / ".ns_trcd" / "log.txt"
+
+_level = LEVELS["info"]
+_sample_every = dict()
+_sample_counts = dict()
+_sample_lock = Lock()
+_sink = None
+
+
+class _SkippedAction:
+    """Stands in for an eliot action that isn't logged.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add_success_fields(self, **fields):
+        pass
+
+
+SKIPPED_ACTION = _SkippedAction()
+
+
+class AsyncFileSink:
+    """An eliot destination that writes messages to a file from a background thread.
+
+    Parameters
+    ----------
+    path : Path
+        The file to write to. Missing parent directories are created.
+    max_queued : int
+        The number of messages that can be waiting to be written. Messages that
+        arrive while the queue is full are counted in `dropped` instead of making
+        the caller wait.
+    buffer_bytes : int
+        The size of the file's write buffer.
+    flush_interval : float
+        The file is flushed whenever no messages have arrived for this many seconds.
+
+    Notes
+    -----
+    Messages are only put on a queue by the thread that logs them, so serializing
+    them and writing them to disk never holds up the GUI or the workers.
+    """
+
+    def __init__(
+        self, path, max_queued=10_000, buffer_bytes=65_536, flush_interval=1.0
+    ):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.dropped = 0
+        self.flush_interval = flush_interval
+        self._file = open(path, "w", buffering=buffer_bytes)
+        self._queue = Queue(maxsize=max_queued)
+        self._thread = Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def __call__(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except Full:
+            self.dropped += 1
+
+    def close(self):
+        """Write the messages that are queued and close the file.
+        """
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                message = self._queue.get(timeout=self.flush_interval)
+            except Empty:
+                self._file.flush()
+                continue
+            if message is None:
+                self._file.close()
+                return
+            self._file.write(json.dumps(message, default=str) + "\n")
+
+
+def configure_logging(path=DEFAULT_LOG_FILE, level="info", sample_rates=None):
+    """Send log messages to a file and choose which actions are logged.
+
+    Parameters
+    ----------
+    path : Path or None
+        The file to write the log to. Nothing is written if this is None.
+    level : str
+        The least important level that's logged, one of `LEVELS`. Nothing is
+        written at "off", including messages that aren't logged with `log_action`.
+    sample_rates : dict, optional
+        The fraction of each action type that's logged, e.g. {"update_plots": 0.01}
+        logs one in every hundred redraws. Action types that aren't listed are
+        always logged.
+
+    Returns
+    -------
+    AsyncFileSink or None
+        The destination the messages are written to.
+    """
+    global _level, _sink
+    if level not in LEVELS:
+        raise ValueError(f"unknown log level {level!r}, use one of {list(LEVELS)}")
+    _level = LEVELS[level]
+    _sample_every.clear()
+    _sample_counts.clear()
+    for action_type, rate in (sample_rates or dict()).items():
+        _sample_every[action_type] = None if rate <= 0 else max(1, round(1 / rate))
+    shutdown_logging()
+    if (path is not None) and (level != "off"):
+        _sink = AsyncFileSink(path)
+        add_destinations(_sink)
+    return _sink
+
+
+def shutdown_logging():
+    """Stop writing the log, once the messages logged so far have been written.
+    """
+    global _sink
+    if _sink is None:
+        return
+    remove_destination(_sink)
+    _sink.close()
+    _sink = None
+
+
+def log_action(action_type, level="info", **fields):
+    """Start an eliot action if its level and sampling rate allow it.
+
+    This is meant for actions on hot paths, e.g. every redraw, so the action is
+    skipped with a dictionary lookup and a comparison when it isn't logged.
+
+    Returns
+    -------
+    context manager
+        The eliot action, or a stand-in that does nothing.
+    """
+    if LEVELS[level] < _level:
+        return SKIPPED_ACTION
+    if action_type in _sample_every:
+        every = _sample_every[action_type]
+        if every is None:
+            return SKIPPED_ACTION
+        with _sample_lock:
+            count = _sample_counts.get(action_type, 0)
+            _sample_counts[action_type] = count + 1
+        if count % every:
+            return SKIPPED_ACTION
+        fields["sampled_every"] = every
+    return start_action(action_type=action_type, **fields)
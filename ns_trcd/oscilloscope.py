@@ -1,142 +1,297 @@
 import pyvisa as visa
 import numpy as np
+from contextlib import contextmanager
+from dataclasses import dataclass
+from time import perf_counter, sleep
+from .common import TriggerWait
+
+
+# Struct format characters for binary curve data, keyed by (signed, bytes per point)
+BINARY_DATATYPES = {
+    (True, 1): "b",
+    (True, 2): "h",
+    (False, 1): "B",
+    (False, 2): "H",
+}
+
+
+@dataclass
+class ChannelPreamble:
+    """The waveform output parameters for a single channel.
+    """
+
+    t_res: float
+    v_scale: float
+    v_offset: float
+    points: int
 
 
 class Oscilloscope:
-    def __init__(self, resource):
-        manager = visa.ResourceManager()
-        self._scope = manager.open_resource(resource)
+    # The longest message that will be sent when flushing a batch of commands
+    max_batch_length = 1024
+
+    def __init__(self, resource, binary_transfer=True, max_poll_rate=1_000):
+        if isinstance(resource, str):
+            manager = visa.ResourceManager()
+            self._scope = manager.open_resource(resource)
+        else:
+            # An already opened resource e.g. a simulated oscilloscope
+            self._scope = resource
         self._scope.timeout = 1000  # milliseconds
+        self.binary_transfer = binary_transfer
+        # (signed, big_endian) for the binary encoding last written, None for ASCII
+        self._binary_encoding = None
+        self._byte_width = None
+        self._data_source = None
+        self._single_acquisition = False
+        self._preambles = dict()
+        self._vertical_settings = dict()
+        self._pending = []
+        self._settings = dict()
+        self._batch_depth = 0
+        self._batch_wait = False
+        self.trigger_waiter = TriggerWaiter(self, max_poll_rate=max_poll_rate)
 
     def cleanup(self):
+        self._flush()
         self._scope.close()
 
+    ####################################################################################
+    # Command Batching
+    ####################################################################################
+
+    @contextmanager
+    def batch(self, wait=False):
+        """Queue commands and send them in as few writes as possible.
+
+        Commands written inside the context are joined into semicolon-separated
+        messages no longer than `max_batch_length` and sent when the outermost
+        batch exits. Any query made inside the context flushes the queue first, so
+        commands and queries are still handled in order.
+
+        Parameters
+        ----------
+        wait : bool
+            Block on *OPC? after flushing until the oscilloscope has finished
+            processing the commands.
+        """
+        self._batch_depth += 1
+        self._batch_wait = self._batch_wait or wait
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._flush()
+                wait = self._batch_wait
+                self._batch_wait = False
+        if wait and (self._batch_depth == 0):
+            self.wait_for_operation_complete()
+
+    def _write(self, cmd):
+        """Send a command unless it wouldn't change the oscilloscope's settings.
+
+        Returns
+        -------
+        bool
+            True if the command was sent (or queued), False if it was dropped.
+        """
+        setting = parse_setting(cmd)
+        if setting is not None:
+            header, value = setting
+            if self._settings.get(header) == value:
+                return False
+            self._settings[header] = value
+        if self._batch_depth > 0:
+            self._pending.append(cmd)
+        else:
+            self._scope.write(cmd)
+        return True
+
+    def _query(self, cmd):
+        self._flush()
+        return self._scope.query(cmd)
+
+    def _flush(self):
+        """Send any queued commands as compound messages.
+        """
+        if not self._pending:
+            return
+        message = ""
+        for cmd in self._pending:
+            # A leading colon resets the command tree so the commands are independent
+            if not cmd.startswith((":", "*")):
+                cmd = ":" + cmd
+            if not message:
+                message = cmd
+            elif len(message) + len(cmd) + 1 > self.max_batch_length:
+                self._scope.write(message)
+                message = cmd
+            else:
+                message = f"{message};{cmd}"
+        self._scope.write(message)
+        self._pending.clear()
+
+    ####################################################################################
+    # Settings Cache
+    ####################################################################################
+
+    def resync_settings(self):
+        """Replace the cached settings with a snapshot of the oscilloscope's setup.
+
+        The snapshot comes from a single *LRN? query, so commands that match the
+        oscilloscope's current setup are dropped even if this instance never wrote
+        them e.g. on back-to-back runs.
+        """
+        self._write("verbose on")
+        self._settings = parse_settings(self._query("*LRN?"))
+        self.invalidate_preambles()
+
     ####################################################################################
     # Acquisition Parameters
     ####################################################################################
 
     def set_hi_res_mode(self):
-        self._scope.write("acquire:mode hires")
+        if self._write("acquire:mode hires"):
+            self.invalidate_preambles()
 
     def set_single_acquisition_mode(self):
-        self._scope.write("acquire:stopafter sequence")
+        self._write("acquire:stopafter sequence")
+        self._single_acquisition = True
 
     def set_continuous_acquisition_mode(self):
-        self._scope.write("acquire:stopafter runstop")
+        self._write("acquire:stopafter runstop")
+        self._single_acquisition = False
 
     def acquisition_start(self):
-        self._scope.write("acquire:state run")
+        self._write("acquire:state run")
 
     def acquisition_stop(self):
-        self._scope.write("acquire:state stop")
+        self._write("acquire:state stop")
 
     def get_acquisition_state(self):
-        return self._scope.query("acquire:state?").lower().strip()
+        return self._query("acquire:state?").lower().strip()
 
     ####################################################################################
     # Horizontal Parameters
     ####################################################################################
 
     def set_time_per_div(self, div_time):
-        self._scope.write(f"horizontal:main:scale {div_time:.2E}")
+        if self._write(f"horizontal:main:scale {div_time:.2E}"):
+            self.invalidate_preambles()
 
     def set_horizontal_position(self, percentage):
-        self._scope.write(f"horizontal:position {percentage}")
+        self._write(f"horizontal:position {percentage}")
 
     def set_horizontal_points(self, points):
-        self._scope.write(f"horizontal:resolution {points}")
+        if self._write(f"horizontal:resolution {points}"):
+            self.invalidate_preambles()
 
     def get_time_resolution(self):
-        return float(self._scope.query("wfmoutpre:xincr?"))
+        return float(self._query("wfmoutpre:xincr?"))
 
     ####################################################################################
     # Vertical Parameters
     ####################################################################################
 
     def set_channel_on(self, channel):
-        self._scope.write(f"select:ch{channel} on")
+        self._write(f"select:ch{channel} on")
 
     def set_channel_off(self, channel):
-        self._scope.write(f"select:ch{channel} off")
+        self._write(f"select:ch{channel} off")
 
     def set_channels_on(self, channel_list):
-        for channel in channel_list:
-            self.set_channel_on(channel)
+        with self.batch():
+            for channel in channel_list:
+                self.set_channel_on(channel)
 
     def set_channels_off(self, channel_list):
-        for channel in channel_list:
-            self.set_channel_off(channel)
+        with self.batch():
+            for channel in channel_list:
+                self.set_channel_off(channel)
 
     def set_vertical_scale(self, channel, scale_volts):
-        self._scope.write(f"ch{channel}:scale {scale_volts:.4E}")
+        if self._write(f"ch{channel}:scale {scale_volts:.4E}"):
+            self.invalidate_preambles([channel])
 
     def set_vertical_offset(self, channel, offset_volts):
-        self._scope.write(f"ch{channel}:offset {offset_volts:.4E}")
+        if self._write(f"ch{channel}:offset {offset_volts:.4E}"):
+            self.invalidate_preambles([channel])
 
     def zero_vertical_position(self, channel):
-        self._scope.write(f"ch{channel}:position 0")
+        if self._write(f"ch{channel}:position 0"):
+            self.invalidate_preambles([channel])
 
     def zero_vertical_positions(self, channel_list):
-        for channel in channel_list:
-            self.zero_vertical_position(channel)
+        with self.batch():
+            for channel in channel_list:
+                self.zero_vertical_position(channel)
 
     def zero_all_vertical_positions(self):
-        for i in range(1, 5):
-            self.zero_vertical_position(i)
+        with self.batch():
+            for i in range(1, 5):
+                self.zero_vertical_position(i)
 
     def vertically_center_channel(self, channel):
         avg = self.measure_channel_mean(channel)
         self.set_vertical_offset(channel, avg)
 
     def get_voltage_scale_factor(self):
-        return float(self._scope.query("wfmoutpre:ymult?"))
+        return float(self._query("wfmoutpre:ymult?"))
 
     def get_vertical_offset_dig_levels(self):
-        return int(self._scope.query("wfmoutpre:yoff?"))
+        return int(self._query("wfmoutpre:yoff?"))
 
     def get_vertical_offset_volts(self):
-        return float(self._scope.query("wfmoutpre:yzero?"))
+        return float(self._query("wfmoutpre:yzero?"))
 
     ####################################################################################
     # Measurements
     ####################################################################################
 
     def turn_off_all_measurements(self):
-        for i in range(1, 9):
-            self._scope.write(f"measurement:meas{i}:state off")
+        with self.batch():
+            for i in range(1, 9):
+                self._write(f"measurement:meas{i}:state off")
 
     def add_displayed_mean_measurement(self, channel, meas_num):
-        self._scope.write(f"measurement:meas{meas_num}:source ch{channel}")
-        self._scope.write(f"measurement:meas{meas_num}:state on")
-        self._scope.write(f"measurement:meas{meas_num}:type mean")
+        with self.batch():
+            self._write(f"measurement:meas{meas_num}:source ch{channel}")
+            self._write(f"measurement:meas{meas_num}:state on")
+            self._write(f"measurement:meas{meas_num}:type mean")
 
     def add_displayed_max_measurement(self, channel, meas_num):
-        self._scope.write(f"measurement:meas{meas_num}:source ch{channel}")
-        self._scope.write(f"measurement:meas{meas_num}:state on")
-        self._scope.write(f"measurement:meas{meas_num}:type high")
+        with self.batch():
+            self._write(f"measurement:meas{meas_num}:source ch{channel}")
+            self._write(f"measurement:meas{meas_num}:state on")
+            self._write(f"measurement:meas{meas_num}:type high")
 
     def add_displayed_min_measurement(self, channel, meas_num):
-        self._scope.write(f"measurement:meas{meas_num}:source ch{channel}")
-        self._scope.write(f"measurement:meas{meas_num}:state on")
-        self._scope.write(f"measurement:meas{meas_num}:type low")
+        with self.batch():
+            self._write(f"measurement:meas{meas_num}:source ch{channel}")
+            self._write(f"measurement:meas{meas_num}:state on")
+            self._write(f"measurement:meas{meas_num}:type low")
 
     def get_displayed_measurement_value(self, meas_num):
-        return float(self._scope.query(f"measurement:meas{meas_num}:value?"))
+        return float(self._query(f"measurement:meas{meas_num}:value?"))
 
     def add_immediate_mean_measurement(self, channel):
-        self._scope.write(f"measurement:immed:source ch{channel}")
-        self._scope.write("measurement:immed:type mean")
+        with self.batch():
+            self._write(f"measurement:immed:source ch{channel}")
+            self._write("measurement:immed:type mean")
 
     def add_immediate_max_measurement(self, channel):
-        self._scope.write(f"measurement:immed:source ch{channel}")
-        self._scope.write("measurement:immed:type high")
+        with self.batch():
+            self._write(f"measurement:immed:source ch{channel}")
+            self._write("measurement:immed:type high")
 
     def add_immediate_min_measurement(self, channel):
-        self._scope.write(f"measurement:immed:source ch{channel}")
-        self._scope.write("measurement:immed:type low")
+        with self.batch():
+            self._write(f"measurement:immed:source ch{channel}")
+            self._write("measurement:immed:type low")
 
     def get_immediate_measurement_value(self):
-        return float(self._scope.query("measurement:immed:value?"))
+        return float(self._query("measurement:immed:value?"))
 
     def measure_channel_mean(self, channel):
         self.add_immediate_mean_measurement(channel)
@@ -149,46 +304,186 @@ class Oscilloscope:
     # Output waveform parameters
     #################################################
 
+    def set_waveform_encoding(self):
+        """Set the curve encoding that matches the selected transfer mode.
+        """
+        if self.binary_transfer:
+            self.set_waveform_encoding_signed_le_binary()
+        else:
+            self.set_waveform_encoding_ascii()
+
     def set_waveform_encoding_ascii(self):
-        self._scope.write("data:encdg ascii")
+        self._write("data:encdg ascii")
+        self._binary_encoding = None
 
     def set_waveform_encoding_unsigned_le_binary(self):
-        self._scope.write("data:encdg srpbinary")
+        written = self._write("data:encdg srpbinary")
+        self._set_binary_encoding(False, False, written)
 
     def set_waveform_encoding_signed_le_binary(self):
-        self._scope.write("data:encdg sribinary")
+        written = self._write("data:encdg sribinary")
+        self._set_binary_encoding(True, False, written)
 
     def set_waveform_encoding_unsigned_be_binary(self):
-        self._scope.write("data:encdg rpbinary")
+        written = self._write("data:encdg rpbinary")
+        self._set_binary_encoding(False, True, written)
 
     def set_waveform_encoding_signed_be_binary(self):
-        self._scope.write("data:encdg ribinary")
+        written = self._write("data:encdg ribinary")
+        self._set_binary_encoding(True, True, written)
+
+    def _set_binary_encoding(self, signed, big_endian, written):
+        self._binary_encoding = (signed, big_endian)
+        if written:
+            self._byte_width = None
+            self.invalidate_preambles()
 
     def get_waveform_encoding(self):
-        return self._scope.query("wfmoutpre:encdg?").lower().strip()
+        return self._query("wfmoutpre:encdg?").lower().strip()
+
+    def set_waveform_byte_width(self, width):
+        if self._write(f"data:width {width}"):
+            self._byte_width = None
+            self.invalidate_preambles()
+
+    def get_waveform_byte_width(self):
+        return int(self._query("wfmoutpre:byt_nr?"))
 
     def get_waveform_length(self):
-        return int(self._scope.query("wfmoutpre:nr_pt?"))
+        return int(self._query("wfmoutpre:nr_pt?"))
+
+    def get_channel_preamble(self, channel):
+        """Return the waveform output parameters for a channel.
+
+        Notes
+        -----
+        The parameters are cached until a setter that could change them is called
+        or `vertical_settings_changed` detects a change made on the front panel. A
+        cache miss fills the preamble with a single compound `wfmoutpre` query.
+        """
+        preamble = self._preambles.get(channel)
+        if preamble is not None:
+            return preamble
+        if self._data_source != (channel,):
+            self.set_waveform_data_source_single_channel(channel)
+        reply = self._query("wfmoutpre:xincr?;ymult?;yzero?;nr_pt?")
+        t_res, v_scale, v_offset, points = reply.strip().split(";")
+        preamble = ChannelPreamble(
+            float(t_res), float(v_scale), float(v_offset), int(points)
+        )
+        self._preambles[channel] = preamble
+        return preamble
+
+    def invalidate_preambles(self, channels=None):
+        """Discard cached preambles for some channels, or all of them by default.
+        """
+        if channels is None:
+            self._preambles.clear()
+            return
+        for channel in channels:
+            self._preambles.pop(channel, None)
+
+    def vertical_settings_changed(self, channels):
+        """Check whether the vertical scale or offset of any channel has changed.
+
+        This only takes a single query, so it's cheap enough to call during a run.
+        The preambles of any channels that changed are invalidated.
+
+        Parameters
+        ----------
+        channels : list of int
+            The channels to check.
+
+        Returns
+        -------
+        bool
+            True if any channel changed since the last check.
+        """
+        query = ";:".join(f"ch{c}:scale?;:ch{c}:offset?" for c in channels)
+        values = [float(x) for x in self._query(query).strip().split(";")]
+        changed = []
+        for i, channel in enumerate(channels):
+            settings = (values[2 * i], values[2 * i + 1])
+            previous = self._vertical_settings.get(channel)
+            if (previous is not None) and (previous != settings):
+                changed.append(channel)
+            self._vertical_settings[channel] = settings
+            self._settings[f"ch{channel}:scale"] = repr(settings[0])
+            self._settings[f"ch{channel}:offset"] = repr(settings[1])
+        self.invalidate_preambles(changed)
+        return len(changed) > 0
 
     ####################################################################################
     # Obtaining Waveforms
     ####################################################################################
 
     def set_waveform_data_source_single_channel(self, channel):
-        self._scope.write(f"data:source ch{channel}")
+        self._write(f"data:source ch{channel}")
+        self._data_source = (channel,)
 
     def set_waveform_data_source_multiple_channels(self, channel_list):
         channels = ", ".join([f"ch{x}" for x in channel_list])
-        self._scope.write(f"data:source {channels}")
+        self._write(f"data:source {channels}")
+        self._data_source = tuple(channel_list)
 
     def set_waveform_start_point(self, point):
-        self._scope.write(f"data:start {point}")
+        if self._write(f"data:start {point}"):
+            self.invalidate_preambles()
 
     def set_waveform_stop_point(self, point):
-        self._scope.write(f"data:stop {point}")
+        if self._write(f"data:stop {point}"):
+            self.invalidate_preambles()
 
     def get_curve(self):
-        return self._scope.query_ascii_values("curve?", container=np.array)
+        """Transfer the curve for the current data source.
+
+        Notes
+        -----
+        Binary transfers are read directly into an int8 or int16 array depending on
+        the number of bytes per point reported by the oscilloscope. The byte width is
+        only queried once per encoding change. ASCII transfers are used whenever a
+        binary encoding hasn't been set.
+        """
+        self._flush()
+        if self._binary_encoding is None:
+            return self._scope.query_ascii_values("curve?", container=np.array)
+        signed, big_endian = self._binary_encoding
+        if self._byte_width is None:
+            self._byte_width = self.get_waveform_byte_width()
+        datatype = BINARY_DATATYPES[(signed, self._byte_width)]
+        return self._scope.query_binary_values(
+            "curve?", datatype=datatype, is_big_endian=big_endian, container=np.array
+        )
+
+    def get_curves(self, channels):
+        """Transfer the curves for several channels in a single query.
+
+        Parameters
+        ----------
+        channels : list of int
+            The channels to transfer, in the order they should be returned.
+
+        Returns
+        -------
+        list of np.ndarray
+            One curve per channel. Binary curves are read-only views into the
+            buffer that was read from the oscilloscope.
+        """
+        channels = tuple(channels)
+        if self._data_source != channels:
+            self.set_waveform_data_source_multiple_channels(channels)
+        if self._binary_encoding is None:
+            reply = self._query("curve?")
+            return [np.array(c.split(","), dtype=float) for c in reply.split(";")]
+        signed, big_endian = self._binary_encoding
+        if self._byte_width is None:
+            self._byte_width = self.get_waveform_byte_width()
+        dtype = np.dtype(BINARY_DATATYPES[(signed, self._byte_width)])
+        dtype = dtype.newbyteorder(">" if big_endian else "<")
+        self._flush()
+        self._scope.write("curve?")
+        raw = self._scope.read_raw()
+        return split_binary_blocks(raw, len(channels), dtype)
 
     def retrieve_waveform(self):
         value_list = self._scope.query_ascii_values("curve?", delay=0.5)
@@ -203,26 +498,215 @@ class Oscilloscope:
     ####################################################################################
 
     def set_trigger_source_channel(self, channel):
-        self._scope.write(f"trigger:a:edge:source ch{channel}")
+        self._write(f"trigger:a:edge:source ch{channel}")
 
     def set_trigger_source_aux(self):
-        self._scope.write(f"trigger:a:edge:source auxiliary")
+        self._write(f"trigger:a:edge:source auxiliary")
 
     def trigger_from_line(self):
-        self._scope.write("trigger:a:edge:source line")
+        self._write("trigger:a:edge:source line")
 
     def trigger_on_rising_edge(self):
-        self._scope.write("trigger:a:edge:slope rise")
+        self._write("trigger:a:edge:slope rise")
 
     def trigger_on_falling_edge(self):
-        self._scope.write("trigger:a:edge:slope fall")
+        self._write("trigger:a:edge:slope fall")
 
     def set_trigger_level(self, volts):
-        self._scope.write(f"trigger:a:level {volts}")
+        self._write(f"trigger:a:level {volts}")
 
     def get_trigger_state(self):
-        return self._scope.query("trigger:state?").lower().strip()
+        return self._query("trigger:state?").lower().strip()
 
     def wait_until_triggered(self):
-        while self.get_trigger_state() != "save":
-            pass
+        if self._single_acquisition:
+            return self.trigger_waiter.wait_for_acquisition()
+        return self.trigger_waiter.wait_for("save")
+
+    def wait_for_operation_complete(self, timeout=None):
+        """Block on *OPC? until all pending operations have completed.
+
+        Parameters
+        ----------
+        timeout : int, optional
+            The VISA timeout in milliseconds to use for this query only.
+        """
+        old_timeout = self._scope.timeout
+        if timeout is not None:
+            self._scope.timeout = timeout
+        try:
+            self._query("*OPC?")
+        finally:
+            self._scope.timeout = old_timeout
+
+
+class TriggerWaiter:
+    """Waits for the oscilloscope to reach a trigger state without flooding the bus.
+
+    The trigger state is polled with an adaptive backoff. The first poll happens
+    immediately, after which the interval between polls starts at the inverse of
+    the maximum poll rate and grows by a factor of `backoff` each time the state
+    hasn't changed, up to `max_interval`.
+    """
+
+    def __init__(self, scope, max_poll_rate=1_000, max_interval=0.01, backoff=2.0):
+        self._scope = scope
+        self.min_interval = 1 / max_poll_rate
+        self.max_interval = max(max_interval, self.min_interval)
+        self.backoff = backoff
+
+    def wait_for(self, state, should_stop=None):
+        """Poll the trigger state until it matches `state`.
+
+        Parameters
+        ----------
+        state : str
+            The trigger state to wait for e.g. "ready" or "save".
+        should_stop : callable, optional
+            Checked before each poll. The wait is abandoned when it returns True.
+
+        Returns
+        -------
+        TriggerWait or None
+            The number of polls and the time spent waiting, or None if the wait
+            was abandoned.
+        """
+        polls = 0
+        interval = self.min_interval
+        start = perf_counter()
+        while True:
+            if (should_stop is not None) and should_stop():
+                return None
+            polls += 1
+            if self._scope.get_trigger_state() == state:
+                return TriggerWait(polls, perf_counter() - start)
+            sleep(interval)
+            interval = min(interval * self.backoff, self.max_interval)
+
+    def wait_for_acquisition(self, timeout=None):
+        """Wait for a single-sequence acquisition to complete using *OPC?.
+
+        The oscilloscope holds off the reply until the acquisition is done, so this
+        is a single bus transaction rather than a polling loop.
+        """
+        start = perf_counter()
+        self._scope.wait_for_operation_complete(timeout)
+        return TriggerWait(1, perf_counter() - start)
+
+
+# Commands that trigger an action rather than change a setting, so they are never
+# dropped by the settings cache
+UNCACHED_HEADERS = {"acquire:state"}
+
+
+def normalize_setting_value(value):
+    """Put a setting value into a canonical form so equivalent values compare equal.
+    """
+    value = value.strip().lower().replace(" ", "")
+    value = {"on": "1", "off": "0"}.get(value, value)
+    try:
+        return repr(float(value))
+    except ValueError:
+        return value
+
+
+def parse_setting(cmd):
+    """Split a command into a normalized (header, value) pair.
+
+    Returns None for commands that shouldn't be cached i.e. common commands,
+    queries, commands without an argument, and commands in `UNCACHED_HEADERS`.
+    """
+    cmd = cmd.strip()
+    if cmd.startswith("*") or cmd.endswith("?") or (" " not in cmd):
+        return None
+    header, value = cmd.split(" ", 1)
+    header = header.lstrip(":").lower()
+    if header in UNCACHED_HEADERS:
+        return None
+    return header, normalize_setting_value(value)
+
+
+def split_commands(message):
+    """Split a compound message on semicolons that aren't inside quoted strings.
+    """
+    commands = []
+    current = []
+    quoted = False
+    for char in message:
+        if char == '"':
+            quoted = not quoted
+        if (char == ";") and not quoted:
+            commands.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    commands.append("".join(current))
+    return commands
+
+
+def resolve_commands(message):
+    """Yield the full header and argument of each command in a compound message.
+
+    Headers that don't start with a colon are relative to the previous header, as
+    described in the SCPI standard. Headers are lowercase and the argument is None
+    for commands that don't have one.
+    """
+    path = []
+    for cmd in split_commands(message.strip()):
+        cmd = cmd.strip()
+        if not cmd:
+            continue
+        header, _, argument = cmd.partition(" ")
+        argument = argument.strip() or None
+        if header.startswith("*"):
+            yield header.lower(), argument
+            continue
+        nodes = header.lstrip(":").lower().split(":")
+        if not header.startswith(":"):
+            nodes = path[:-1] + nodes
+        path = nodes
+        yield ":".join(nodes), argument
+
+
+def parse_settings(message):
+    """Parse a *LRN? or SET? reply into a dictionary of normalized settings.
+    """
+    settings = dict()
+    for header, argument in resolve_commands(message):
+        setting = parse_setting(f"{header} {argument}" if argument else header)
+        if setting is not None:
+            settings[setting[0]] = setting[1]
+    return settings
+
+
+def split_binary_blocks(raw, count, dtype):
+    """Split a reply containing several IEEE 488.2 binary blocks into arrays.
+
+    Parameters
+    ----------
+    raw : bytes
+        The reply from the oscilloscope, e.g. b"#13abc;#13def\n".
+    count : int
+        The number of blocks in the reply.
+    dtype : np.dtype
+        The type of each point in the blocks.
+
+    Returns
+    -------
+    list of np.ndarray
+        The contents of each block as views into `raw`, so no data is copied.
+    """
+    curves = []
+    offset = 0
+    for _ in range(count):
+        start = raw.index(b"#", offset)
+        num_digits = int(raw[start + 1 : start + 2])
+        data_start = start + 2 + num_digits
+        length = int(raw[start + 2 : data_start])
+        curves.append(
+            np.frombuffer(
+                raw, dtype=dtype, count=length // dtype.itemsize, offset=data_start
+            )
+        )
+        offset = data_start + length
+    return curves
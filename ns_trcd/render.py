@@ -0,0 +1,78 @@
+from time import perf_counter
+from PySide2.QtCore import QObject, QTimer, Slot
+
+
+class RenderScheduler(QObject):
+    """Limits how often the plots are redrawn, skipping data that arrives too fast.
+
+    Parameters
+    ----------
+    render : callable
+        Draws a frame. It's called with the `PlotData` whose traces should be
+        drawn and the `PlotData` whose dA signals should be drawn, either of which
+        may be None, and takes over the references to their buffers.
+    max_fps : float
+        The maximum number of frames drawn per second.
+
+    Notes
+    -----
+    The data to draw is taken from a `FrameExchange` set with `attach`, which
+    only ever holds the newest data. The data that was replaced before it could be
+    drawn is counted in `dropped_frames`.
+    """
+
+    def __init__(self, render, max_fps=30.0, parent=None):
+        super(RenderScheduler, self).__init__(parent)
+        self._render = render
+        self.max_fps = max_fps
+        self.rendered_frames = 0
+        self._frames = None
+        self._last_render = None
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.render_pending)
+
+    def attach(self, frames):
+        """Start drawing the data published to a `FrameExchange`.
+        """
+        self.clear()
+        self._frames = frames
+
+    @property
+    def dropped_frames(self):
+        return 0 if self._frames is None else self._frames.dropped
+
+    @Slot(int)
+    def frame_ready(self, sequence):
+        """Schedule a frame to be drawn now that new data has been published.
+        """
+        if not self._timer.isActive():
+            self._timer.start(self._delay_ms())
+
+    def _delay_ms(self):
+        """The time until the next frame can be drawn.
+        """
+        if self._last_render is None:
+            return 0
+        next_render = self._last_render + 1 / self.max_fps
+        return max(0, int(1000 * (next_render - perf_counter())))
+
+    @Slot()
+    def render_pending(self):
+        """Draw the newest data, if there is any.
+        """
+        if self._frames is None:
+            return
+        traces, da = self._frames.take()
+        if (traces is None) and (da is None):
+            return
+        self._last_render = perf_counter()
+        self.rendered_frames += 1
+        self._render(traces, da)
+
+    def clear(self):
+        """Release the data that's waiting without drawing it.
+        """
+        self._timer.stop()
+        if self._frames is not None:
+            self._frames.clear()
@@ -0,0 +1,164 @@
+from collections import deque
+from threading import Condition
+
+
+# What to do when a shot arrives and the queue is full
+SHOT_QUEUE_POLICIES = ("block", "drop_oldest", "drop_pairs")
+# How often a blocked acquisition checks whether it has been told to stop, in seconds
+BLOCK_CHECK_INTERVAL = 0.1
+
+
+class ShotQueue:
+    """A bounded queue of shots from the experiment worker to the computation worker.
+
+    Parameters
+    ----------
+    capacity : int
+        The number of shots that can be waiting to be computed.
+    policy : str
+        What to do when a shot arrives and the queue is full. "block" waits for the
+        computation worker to catch up, which pauses acquisition. "drop_oldest"
+        discards the oldest shot, and "drop_pairs" discards the oldest whole
+        pump/no-pump pair.
+
+    Notes
+    -----
+    The shots alternate between having the pump and not having it, and the
+    computation worker splits them into consecutive pairs that dA is computed from.
+    Discarding a single shot pairs up shots that weren't taken one after the other,
+    so "drop_pairs" only discards both shots of a pair. Since the pairs start with
+    the first shot, the worker is holding the first half of a pair whenever an odd
+    number of shots has been taken, and the oldest queued shot is its partner,
+    which is never discarded. Discarded shots are counted in `dropped`.
+
+    Preambles are queued along with the shots so that they're applied to the shots
+    that follow them. They don't count towards the capacity and are never discarded.
+    """
+
+    def __init__(self, capacity=8, policy="block"):
+        if policy not in SHOT_QUEUE_POLICIES:
+            raise ValueError(
+                f"unknown policy {policy!r}, use one of {SHOT_QUEUE_POLICIES}"
+            )
+        if capacity < 1:
+            raise ValueError("the capacity must be at least one shot")
+        if (policy == "drop_pairs") and (capacity < 2):
+            raise ValueError("the capacity must be at least two shots to drop pairs")
+        self.capacity = capacity
+        self.policy = policy
+        self.dropped = 0
+        self.max_depth = 0
+        self._items = deque()
+        self._shots = 0
+        self._holds_half = False
+        self._notified = False
+        self._cond = Condition()
+
+    def put(self, data, should_stop=None):
+        """Queue a shot to be computed.
+
+        Parameters
+        ----------
+        data : RawData
+            The shot.
+        should_stop : callable, optional
+            Checked while blocked on a full queue. The shot is discarded if it
+            returns True.
+
+        Returns
+        -------
+        bool
+            True if the consumer should be notified. The consumer is only notified
+            once until it has emptied the queue, so notifications never pile up.
+        """
+        with self._cond:
+            while self._shots >= self.capacity:
+                if self.policy == "drop_oldest":
+                    self._drop_oldest()
+                elif self.policy == "drop_pairs":
+                    if self._drop_pair():
+                        return False
+                elif (should_stop is not None) and should_stop():
+                    return False
+                else:
+                    self._cond.wait(BLOCK_CHECK_INTERVAL)
+            self._items.append((True, data))
+            self._shots += 1
+            self.max_depth = max(self.max_depth, self._shots)
+            return self._notify()
+
+    def put_preamble(self, preamble):
+        """Queue a preamble, which is applied to the shots queued after it.
+
+        Returns
+        -------
+        bool
+            True if the consumer should be notified.
+        """
+        with self._cond:
+            self._items.append((False, preamble))
+            return self._notify()
+
+    def get(self):
+        """Take the oldest item from the queue.
+
+        Returns
+        -------
+        item : RawData, Preamble, or None
+            The oldest shot or preamble, or None if the queue is empty.
+        more : bool
+            Whether there are more items waiting. Once this is False the consumer
+            is notified again when something is queued.
+        """
+        with self._cond:
+            if not self._items:
+                self._notified = False
+                return None, False
+            is_shot, item = self._items.popleft()
+            if is_shot:
+                self._shots -= 1
+                self._holds_half = not self._holds_half
+                self._cond.notify_all()
+            more = len(self._items) > 0
+            if not more:
+                self._notified = False
+            return item, more
+
+    def depth(self):
+        """The number of shots waiting to be computed.
+        """
+        with self._cond:
+            return self._shots
+
+    def _notify(self):
+        notify = not self._notified
+        self._notified = True
+        return notify
+
+    def _drop_oldest(self):
+        """Discard the oldest shot, keeping any preambles in their place.
+        """
+        for i, (is_shot, _) in enumerate(self._items):
+            if is_shot:
+                del self._items[i]
+                self._shots -= 1
+                self.dropped += 1
+                return
+
+    def _drop_pair(self):
+        """Discard the oldest pair that the worker isn't holding half of.
+
+        Returns
+        -------
+        bool
+            True if the pair is completed by the shot being put, which is
+            discarded along with the queued half.
+        """
+        shots = [i for i, (is_shot, _) in enumerate(self._items) if is_shot]
+        first = 1 if self._holds_half else 0
+        pair = shots[first : first + 2]
+        for i in reversed(pair):
+            del self._items[i]
+        self._shots -= len(pair)
+        self.dropped += 2
+        return len(pair) < 2
@@ -0,0 +1,272 @@
+import numpy as np
+from time import perf_counter, sleep
+from .common import SimulationSettings
+from .oscilloscope import resolve_commands
+
+
+# Fraction of the record before the pump arrives, and the decay time of the signal
+PUMP_DELAY = 0.1
+DECAY_TIME = 0.2
+# dA amplitude of each channel when the pump is present
+DA_AMPLITUDES = {1: 5e-3, 2: 4e-3, 3: 0.0, 4: 0.0}
+PROBE_LEVEL = 0.5
+SHUTTER_LEVEL = 5.0
+# Extra noise samples so that each shot can use a different slice of the noise
+NOISE_PADDING = 4_096
+
+
+class SimulatedLaser:
+    """The clock shared by the simulated shutter and oscilloscope.
+
+    Shots happen at a fixed rate, and the shutter is open for every other shot.
+    """
+
+    def __init__(self, trigger_rate):
+        self.period = 1 / trigger_rate
+        self._start = perf_counter()
+
+    def latest_shot(self):
+        return int((perf_counter() - self._start) / self.period)
+
+    def time_until(self, shot):
+        return self._start + shot * self.period - perf_counter()
+
+    def time_since_latest_shot(self):
+        return (perf_counter() - self._start) % self.period
+
+    @staticmethod
+    def has_pump(shot):
+        return shot % 2 == 0
+
+
+class SimulatedShutter:
+    """A stand-in for the serial connection to the Arduino that controls the shutter.
+
+    The Arduino sends "open" or "shut" for every shot, so reading blocks until the
+    next shot unless the reader has fallen behind.
+    """
+
+    def __init__(self, laser, timeout=1):
+        self._laser = laser
+        self.timeout = timeout
+        self._next_shot = laser.latest_shot() + 1
+
+    def read(self, size=1):
+        wait = self._laser.time_until(self._next_shot)
+        if wait > self.timeout:
+            sleep(self.timeout)
+            return b""
+        if wait > 0:
+            sleep(wait)
+        state = b"open" if self._laser.has_pump(self._next_shot) else b"shut"
+        self._next_shot += 1
+        return state[:size]
+
+    def reset_input_buffer(self):
+        self._next_shot = self._laser.latest_shot() + 1
+
+    def close(self):
+        pass
+
+
+class SimulatedOscilloscope:
+    """A stand-in for the VISA resource of the oscilloscope.
+
+    The simulated oscilloscope understands the commands sent by `Oscilloscope`,
+    including compound messages, and returns synthetic pump-probe decays with
+    Gaussian noise. Every bus transaction is delayed by a fixed latency plus the
+    time needed to transfer the message at the configured bandwidth.
+    """
+
+    def __init__(self, settings=None, laser=None):
+        if settings is None:
+            settings = SimulationSettings()
+        if laser is None:
+            laser = SimulatedLaser(settings.trigger_rate)
+        self.laser = laser
+        self.timeout = 1000
+        self.record_length = settings.record_length
+        self.t_res = settings.t_res
+        self.latency = settings.latency
+        self.bandwidth = settings.bandwidth
+        self._rng = np.random.default_rng(settings.seed)
+        self._noise = self._rng.normal(
+            0, settings.noise, self.record_length + NOISE_PADDING
+        ).astype(np.float32)
+        self._traces = dict()
+        self._reply = b""
+        self._settings = {
+            "acquire:mode": "sample",
+            "acquire:stopafter": "runstop",
+            "acquire:state": "0",
+            "data:source": "ch1",
+            "data:encdg": "ascii",
+            "data:width": "1",
+            "data:start": "1",
+            "data:stop": str(self.record_length),
+        }
+        for channel in range(1, 5):
+            self._settings[f"ch{channel}:scale"] = "0.1"
+            self._settings[f"ch{channel}:offset"] = str(PROBE_LEVEL)
+            self._settings[f"ch{channel}:position"] = "0"
+        self._settings["ch4:scale"] = "1.0"
+        self._settings["ch4:offset"] = "0.0"
+
+    def close(self):
+        pass
+
+    def write(self, message):
+        self._transfer(len(message))
+        for header, argument in resolve_commands(message):
+            if header == "curve?":
+                self._reply = self._curve_reply()
+            elif argument is not None:
+                self._settings[header] = argument.lower()
+
+    def query(self, message):
+        self._transfer(len(message))
+        replies = []
+        for header, argument in resolve_commands(message):
+            if header.endswith("?"):
+                replies.append(self._answer(header))
+            elif argument is not None:
+                self._settings[header] = argument.lower()
+        reply = ";".join(replies)
+        self._transfer(len(reply))
+        return reply + "\n"
+
+    def query_ascii_values(self, message, container=list, **kwargs):
+        reply = self.query(message)
+        values = [float(x) for x in reply.split(";")[0].split(",")]
+        return container(values)
+
+    def query_binary_values(
+        self, message, datatype="f", is_big_endian=False, container=list
+    ):
+        self._transfer(len(message))
+        curve = self._curves()[0]
+        self._transfer(curve.nbytes)
+        return container(curve)
+
+    def read_raw(self):
+        reply = self._reply
+        self._reply = b""
+        self._transfer(len(reply))
+        return reply
+
+    def _transfer(self, num_bytes):
+        sleep(self.latency + num_bytes / self.bandwidth)
+
+    def _running(self):
+        return self._settings["acquire:state"] in ("1", "on", "run")
+
+    def _sources(self):
+        sources = self._settings["data:source"].replace(" ", "").split(",")
+        return [int(s[2:]) for s in sources]
+
+    def _width(self):
+        return int(float(self._settings["data:width"]))
+
+    def _start_stop(self):
+        start = int(float(self._settings["data:start"])) - 1
+        stop = min(int(float(self._settings["data:stop"])), self.record_length)
+        return start, stop
+
+    def _ymult(self, channel):
+        levels_per_div = 25 * 256 ** (self._width() - 1)
+        return float(self._settings[f"ch{channel}:scale"]) / levels_per_div
+
+    def _yzero(self, channel):
+        return float(self._settings[f"ch{channel}:offset"])
+
+    def _trigger_state(self):
+        if not self._running():
+            return "save"
+        if self.laser.time_since_latest_shot() < 0.1 * self.laser.period:
+            return "trigger"
+        return "ready"
+
+    def _answer(self, header):
+        channel = self._sources()[0]
+        start, stop = self._start_stop()
+        encoding = self._settings["data:encdg"]
+        answers = {
+            "*opc?": lambda: "1",
+            "*lrn?": self._learn,
+            "trigger:state?": self._trigger_state,
+            "acquire:state?": lambda: "1" if self._running() else "0",
+            "wfmoutpre:byt_nr?": lambda: str(self._width()),
+            "wfmoutpre:nr_pt?": lambda: str(stop - start),
+            "wfmoutpre:xincr?": lambda: f"{self.t_res:.4E}",
+            "wfmoutpre:ymult?": lambda: f"{self._ymult(channel):.4E}",
+            "wfmoutpre:yzero?": lambda: f"{self._yzero(channel):.4E}",
+            "wfmoutpre:yoff?": lambda: "0",
+            "wfmoutpre:encdg?": lambda: "ascii" if encoding == "ascii" else "binary",
+            "measurement:immed:value?": lambda: "0.0",
+            "curve?": lambda: self._curve_reply().decode().strip(),
+        }
+        if header in answers:
+            return answers[header]()
+        if header.startswith("measurement:meas") and header.endswith(":value?"):
+            return "0.0"
+        if header[:-1] in self._settings:
+            return self._settings[header[:-1]]
+        raise ValueError(f"unsupported query: {header}")
+
+    def _learn(self):
+        return ";".join(f":{h.upper()} {v.upper()}" for h, v in self._settings.items())
+
+    def _trace(self, channel, has_pump):
+        """The noiseless signal on a channel in volts.
+        """
+        key = (channel, has_pump)
+        if key not in self._traces:
+            t = np.arange(self.record_length) / self.record_length
+            decay = np.where(
+                t > PUMP_DELAY, np.exp(-(t - PUMP_DELAY) / DECAY_TIME), 0.0
+            )
+            if channel == 4:
+                trace = np.full(self.record_length, SHUTTER_LEVEL if has_pump else 0.0)
+            elif has_pump:
+                trace = PROBE_LEVEL * 10 ** (-DA_AMPLITUDES[channel] * decay)
+            else:
+                trace = np.full(self.record_length, PROBE_LEVEL)
+            self._traces[key] = trace.astype(np.float32)
+        return self._traces[key]
+
+    def _curves(self):
+        """Digitize the most recent shot on each data source.
+        """
+        has_pump = self.laser.has_pump(self.laser.latest_shot())
+        start, stop = self._start_stop()
+        width = self._width()
+        encoding = self._settings["data:encdg"]
+        signed = encoding in ("ascii", "ribinary", "sribinary")
+        big_endian = encoding in ("ribinary", "rpbinary")
+        byte_order = ">" if big_endian else "<"
+        dtype = np.dtype(f"{byte_order}{'i' if signed else 'u'}{width}")
+        curves = []
+        for channel in self._sources():
+            offset = self._rng.integers(NOISE_PADDING)
+            noisy = self._trace(channel, has_pump)[start:stop] + self._noise[
+                offset : offset + stop - start
+            ]
+            codes = np.rint((noisy - self._yzero(channel)) / self._ymult(channel))
+            limit = 2 ** (8 * width - 1)
+            np.clip(codes, -limit, limit - 1, out=codes)
+            if not signed:
+                codes += limit
+            curves.append(codes.astype(dtype))
+        return curves
+
+    def _curve_reply(self):
+        curves = self._curves()
+        if self._settings["data:encdg"] == "ascii":
+            text = ";".join(",".join(str(int(x)) for x in c) for c in curves)
+            return (text + "\n").encode()
+        blocks = []
+        for curve in curves:
+            data = curve.tobytes()
+            length = str(len(data))
+            blocks.append(f"#{len(length)}{length}".encode() + data)
+        return b";".join(blocks) + b"\n"
@@ -0,0 +1,93 @@
+import numpy as np
+
+
+class RunningStats:
+    """Per-point running mean and variance of a signal, updated in place.
+
+    The statistics are accumulated with Welford's algorithm, which is numerically
+    stable and only needs the current mean and the sum of squared deviations, so
+    the memory used doesn't depend on the number of measurements. Points can be
+    left out of a measurement where the signal isn't valid, so the number of
+    samples behind each point is counted in `counts`, while `count` is the number
+    of measurements.
+
+    Parameters
+    ----------
+    points : int
+        The number of points in the signal.
+    """
+
+    def __init__(self, points):
+        self.count = 0
+        self.counts = np.zeros(points)
+        self.mean = np.zeros(points)
+        self._m2 = np.zeros(points)
+        self._delta = np.empty(points)
+        self._scratch = np.empty(points)
+        self._known = np.zeros(points, dtype=bool)
+
+    @property
+    def points(self):
+        return len(self.mean)
+
+    def reset(self):
+        """Forget every measurement that has been accumulated.
+        """
+        self.count = 0
+        self.counts.fill(0)
+        self.mean.fill(0)
+        self._m2.fill(0)
+        self._known.fill(False)
+
+    def update(self, x, where=None):
+        """Add a measurement to the statistics.
+
+        Parameters
+        ----------
+        x : np.ndarray
+            The measurement.
+        where : np.ndarray of bool, optional
+            The points that are added. The others are left out, so that invalid
+            points don't pull the mean towards whatever they were filled with.
+            Every point is added by default.
+        """
+        if where is None:
+            where = True
+        self.count += 1
+        np.add(self.counts, 1, out=self.counts, where=where)
+        np.subtract(x, self.mean, out=self._delta)
+        np.divide(self._delta, self.counts, out=self._scratch, where=where)
+        np.add(self.mean, self._scratch, out=self.mean, where=where)
+        np.subtract(x, self.mean, out=self._scratch)
+        np.multiply(self._delta, self._scratch, out=self._scratch)
+        np.add(self._m2, self._scratch, out=self._m2, where=where)
+        np.greater_equal(self.counts, 2, out=self._known)
+
+    def variance(self, out=None):
+        """The per-point sample variance, which is zero for fewer than two samples.
+        """
+        if out is None:
+            out = np.empty(self.points)
+        out.fill(0)
+        np.subtract(self.counts, 1, out=self._scratch)
+        return np.divide(self._m2, self._scratch, out=out, where=self._known)
+
+    def window_standard_error(self, start=None, stop=None):
+        """The root-mean-square standard error over a range of points.
+
+        Points with fewer than two samples are left out, and infinity is returned
+        if that's every point since the error isn't known yet.
+        """
+        known = self._known[start:stop]
+        if not known.any():
+            return np.inf
+        counts = self.counts[start:stop][known]
+        mean_variance = (self._m2[start:stop][known] / ((counts - 1) * counts)).mean()
+        return float(np.sqrt(mean_variance))
+
+    def standard_error(self, out=None):
+        """The per-point standard error of the mean.
+        """
+        out = self.variance(out)
+        np.divide(out, self.counts, out=out, where=self._known)
+        return np.sqrt(out, out=out)
@@ -0,0 +1,992 @@
+import bz2
+import json
+import lzma
+import os
+import shutil
+import zlib
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from queue import Full, Queue
+from threading import Condition, Thread
+from time import perf_counter
+
+
+# The signals saved for each measurement, in the order they're stored
+DATASETS = (
+    "with_pump_par",
+    "with_pump_perp",
+    "with_pump_ref",
+    "without_pump_par",
+    "without_pump_perp",
+    "without_pump_ref",
+    "da_par",
+    "da_perp",
+    "da_cd",
+)
+RUN_FILE_NAME = "measurements.trcd"
+# The preambles of a run are kept next to the run file since a run can have any
+# number of them, which wouldn't fit in the header
+PREAMBLES_FILE_NAME = "preambles.jsonl"
+# Each run is saved to its own directory named with this prefix and a timestamp
+RUN_DIR_PREFIX = "run-"
+MAGIC = b"NSTRCD01"
+# Position in the header of the number of complete measurements
+COUNT_OFFSET = len(MAGIC)
+# What a BackgroundWriter does with a measurement when its queue is full
+WRITER_POLICIES = ("block", "drop")
+# The compression codecs available for compressed run files, as a function that
+# creates a streaming compressor for a compression level and a decompression function
+CODECS = {
+    "zlib": (lambda level: zlib.compressobj(level), zlib.decompress),
+    "bz2": (lambda level: bz2.BZ2Compressor(level), bz2.decompress),
+    "lzma": (lambda level: lzma.LZMACompressor(preset=level), lzma.decompress),
+}
+# How much of a chunk is passed to the compressor at a time, in bytes
+COMPRESS_STEP = 1_048_576
+# Space reserved at the start of the file for the JSON header so that the metadata
+# can be updated in place during a run
+HEADER_SIZE = 65_536
+
+
+def create_run_dir(root, now=None):
+    """Create a new, empty directory for a run inside the save location.
+
+    Parameters
+    ----------
+    root : Path
+        The save location.
+    now : datetime, optional
+        The time that the directory is named after. Defaults to the current time.
+
+    Returns
+    -------
+    Path
+        The new directory, named after the time the run started. A counter is added
+        if a run was already started at the same time.
+    """
+    if now is None:
+        now = datetime.now()
+    name = f"{RUN_DIR_PREFIX}{now:%Y%m%d-%H%M%S}"
+    suffix = 0
+    while True:
+        path = Path(root) / (name if suffix == 0 else f"{name}-{suffix}")
+        try:
+            path.mkdir()
+            return path
+        except FileExistsError:
+            suffix += 1
+
+
+def _run_dir_order(path):
+    timestamp = path.name[len(RUN_DIR_PREFIX) : len(RUN_DIR_PREFIX) + 15]
+    suffix = path.name[len(RUN_DIR_PREFIX) + 16 :]
+    return timestamp, int(suffix) if suffix.isdigit() else 0
+
+
+def list_run_dirs(root):
+    """The run directories in the save location, oldest first.
+    """
+    runs = [
+        p
+        for p in Path(root).iterdir()
+        if p.is_dir() and p.name.startswith(RUN_DIR_PREFIX)
+    ]
+    return sorted(runs, key=_run_dir_order)
+
+
+def remove_old_runs(root, keep_runs=None, max_age_days=None, exclude=(), now=None):
+    """Delete run directories according to a retention policy.
+
+    Only directories created by `create_run_dir` are deleted, anything else in the
+    save location is left alone.
+
+    Parameters
+    ----------
+    root : Path
+        The save location.
+    keep_runs : int, optional
+        The number of most recent runs to keep, including excluded ones.
+    max_age_days : float, optional
+        Runs last modified longer ago than this are deleted.
+    exclude : list of Path
+        Runs that must never be deleted, such as the one in progress.
+    now : datetime, optional
+        The time that ages are measured from. Defaults to the current time.
+
+    Returns
+    -------
+    list of Path
+        The runs that were deleted.
+    """
+    if now is None:
+        now = datetime.now()
+    runs = list_run_dirs(root)
+    old = set()
+    if keep_runs is not None:
+        old.update(runs[: max(len(runs) - keep_runs, 0)])
+    if max_age_days is not None:
+        for run in runs:
+            modified = datetime.fromtimestamp(run.stat().st_mtime)
+            if (now - modified).total_seconds() > max_age_days * 86_400:
+                old.add(run)
+    exclude = {Path(p) for p in exclude}
+    removed = []
+    for run in runs:
+        if (run in old) and (run not in exclude):
+            shutil.rmtree(run, ignore_errors=True)
+            removed.append(run)
+    return removed
+
+
+def append_preamble(run_dir, preamble):
+    """Add a preamble to the ones saved for a run.
+
+    Each preamble is a line of JSON, so adding one never rewrites the others.
+    """
+    with open(Path(run_dir) / PREAMBLES_FILE_NAME, "a") as f:
+        f.write(json.dumps(preamble, default=str) + "\n")
+
+
+def read_preambles(run):
+    """The preambles saved for a run, oldest first.
+
+    Parameters
+    ----------
+    run : RunReader or CompressedRunReader
+        The run file.
+    """
+    if "preambles" in run.metadata:
+        return run.metadata["preambles"]
+    path = run.path.parent / PREAMBLES_FILE_NAME
+    if not path.exists():
+        return []
+    with open(path) as f:
+        # The last line may still be being written
+        return [json.loads(line) for line in f if line.endswith("\n")]
+
+
+def record_dtype(datasets, points):
+    """The structured type of a single measurement in a run file.
+
+    Parameters
+    ----------
+    datasets : list of (str, str)
+        The name and NumPy type string of each dataset.
+    points : int
+        The number of points in each signal.
+    """
+    return np.dtype([(name, dtype, (points,)) for name, dtype in datasets])
+
+
+def _new_header(points, datasets, metadata):
+    if datasets is None:
+        datasets = [(name, "<f8") for name in DATASETS]
+    return {
+        "points": points,
+        "datasets": [(name, np.dtype(dtype).str) for name, dtype in datasets],
+        "metadata": dict() if metadata is None else metadata,
+    }
+
+
+def _encode_header(header, count):
+    """The header of a run file.
+
+    The header holds the magic bytes, the number of complete measurements, the
+    length of the JSON-encoded header data, and the header data itself, padded to
+    `HEADER_SIZE` bytes.
+    """
+    encoded = json.dumps(header, default=str).encode()
+    size = COUNT_OFFSET + 16 + len(encoded)
+    if size > HEADER_SIZE:
+        raise ValueError(f"run file header is too large ({size} bytes)")
+    lengths = np.array([count, len(encoded)], dtype="<u8").tobytes()
+    return MAGIC + lengths + encoded + b"\0" * (HEADER_SIZE - size)
+
+
+def _decode_header(raw):
+    """The header data and measurement count from the header of a run file.
+    """
+    if raw[:COUNT_OFFSET] != MAGIC:
+        raise ValueError("not a run file")
+    count, length = np.frombuffer(raw[COUNT_OFFSET : COUNT_OFFSET + 16], dtype="<u8")
+    start = COUNT_OFFSET + 16
+    return json.loads(raw[start : start + int(length)].decode()), int(count)
+
+
+def _validate_record(datasets, points, arrays):
+    """Convert the arrays in a measurement to the types of their datasets.
+    """
+    record = [
+        np.ascontiguousarray(arrays[name], dtype=dtype) for name, dtype in datasets
+    ]
+    for (name, _), data in zip(datasets, record):
+        if data.shape != (points,):
+            raise ValueError(f"{name} has shape {data.shape}, not ({points},)")
+    return record
+
+
+class RunWriter:
+    """Appends measurements to a single file holding an entire run.
+
+    Every measurement is stored as one fixed-size record containing each dataset,
+    so appending a measurement is a single sequential write and the file can be
+    read while it's still being written.
+
+    Parameters
+    ----------
+    path : Path
+        The file to create. An existing file is overwritten.
+    points : int
+        The number of points in each signal.
+    datasets : list of (str, str), optional
+        The name and NumPy type string of each dataset. All of `DATASETS` are stored
+        as float64 by default.
+    metadata : dict, optional
+        Data describing the run e.g. the preamble and UI settings.
+    """
+
+    def __init__(self, path, points, datasets=None, metadata=None):
+        self.path = Path(path)
+        self.points = points
+        self.count = 0
+        self._header = _new_header(points, datasets, metadata)
+        self.datasets = self._header["datasets"]
+        self._file = open(self.path, "wb")
+        self._file.write(_encode_header(self._header, self.count))
+        self._file.flush()
+
+    def append(self, arrays):
+        """Append a single measurement.
+
+        Parameters
+        ----------
+        arrays : dict
+            The signals in the measurement, keyed by dataset name.
+        """
+        # Nothing is written until every dataset is known to be valid so that the
+        # file never contains a partial record
+        record = _validate_record(self.datasets, self.points, arrays)
+        for data in record:
+            self._file.write(memoryview(data).cast("B"))
+        self.count += 1
+        self._file.seek(COUNT_OFFSET)
+        self._file.write(np.uint64(self.count).tobytes())
+        self._file.seek(0, 2)
+        self._file.flush()
+
+    def update_metadata(self, **fields):
+        """Add to or replace fields in the metadata stored in the file header.
+        """
+        self._header["metadata"].update(fields)
+        header = _encode_header(self._header, self.count)
+        self._file.seek(0)
+        self._file.write(header)
+        self._file.seek(0, 2)
+        self._file.flush()
+
+    @property
+    def metadata(self):
+        return self._header["metadata"]
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class RunStore:
+    """A run file with space for every measurement allocated up front.
+
+    The measurements are memory-mapped, so saving a measurement copies it straight
+    into the next row of the file without any intermediate serialization, and the
+    file never needs to grow during the run.
+
+    Parameters
+    ----------
+    path : Path
+        The file to create. An existing file is overwritten.
+    points : int
+        The number of points in each signal.
+    capacity : int
+        The maximum number of measurements in the run.
+    datasets : list of (str, str), optional
+        The name and NumPy type string of each dataset. All of `DATASETS` are stored
+        as float64 by default.
+    metadata : dict, optional
+        Data describing the run e.g. the preamble and UI settings.
+
+    Notes
+    -----
+    The file is the same format as the one produced by `RunWriter`, so it's read
+    with `RunReader`. The space for measurements that were never saved is removed
+    when the store is closed.
+
+    The whole capacity is allocated when the store is created, which can be
+    hundreds of gigabytes for long records on file systems without sparse files,
+    so it's only suitable when the run is known to fit on disk.
+    """
+
+    def __init__(self, path, points, capacity, datasets=None, metadata=None):
+        self.path = Path(path)
+        self.points = points
+        self.capacity = capacity
+        self.count = 0
+        self._header = _new_header(points, datasets, metadata)
+        self.datasets = self._header["datasets"]
+        self._dtype = record_dtype(self.datasets, points)
+        with open(self.path, "wb") as f:
+            f.write(_encode_header(self._header, self.count))
+            f.truncate(HEADER_SIZE + capacity * self._dtype.itemsize)
+        self._head = np.memmap(self.path, dtype=np.uint8, mode="r+", shape=HEADER_SIZE)
+        self._count = self._head[COUNT_OFFSET : COUNT_OFFSET + 8].view("<u8")
+        self._records = np.memmap(
+            self.path,
+            dtype=self._dtype,
+            mode="r+",
+            offset=HEADER_SIZE,
+            shape=(capacity,),
+        )
+
+    def next_row(self):
+        """Writable views of each dataset in the row for the next measurement.
+
+        Call `commit` once the row has been filled in.
+        """
+        if self.count >= self.capacity:
+            raise ValueError(f"the run store is full ({self.capacity} measurements)")
+        return {name: self._records[name][self.count] for name, _ in self.datasets}
+
+    def commit(self):
+        """Mark the next row as a complete measurement.
+        """
+        self.count += 1
+        self._count[0] = self.count
+
+    def append(self, arrays):
+        """Copy a single measurement into the next row.
+
+        Parameters
+        ----------
+        arrays : dict
+            The signals in the measurement, keyed by dataset name.
+        """
+        record = _validate_record(self.datasets, self.points, arrays)
+        row = self.next_row()
+        for (name, _), data in zip(self.datasets, record):
+            np.copyto(row[name], data)
+        self.commit()
+
+    def update_metadata(self, **fields):
+        """Add to or replace fields in the metadata stored in the file header.
+        """
+        self._header["metadata"].update(fields)
+        header = _encode_header(self._header, self.count)
+        self._head[:] = np.frombuffer(header, dtype=np.uint8)
+
+    @property
+    def metadata(self):
+        return self._header["metadata"]
+
+    def flush(self):
+        """Write the modified parts of the file to disk.
+        """
+        self._records.flush()
+        self._head.flush()
+
+    def close(self):
+        """Flush the file and remove the space for unused measurements.
+        """
+        if self._records is None:
+            return
+        self.flush()
+        # The file can't be resized while it's mapped on Windows
+        self._records = None
+        self._head = None
+        self._count = None
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER_SIZE + self.count * self._dtype.itemsize)
+
+
+def _queued_size(arrays, buffers):
+    """The memory a queued measurement keeps alive.
+    """
+    if buffers:
+        return sum(b.nbytes for b in buffers)
+    return sum(a.nbytes for a in arrays.values())
+
+
+class BackgroundWriter:
+    """Appends measurements to a run file on a dedicated thread.
+
+    Parameters
+    ----------
+    writer : RunWriter
+        The run file to append to. It must only be used through this object from
+        now on.
+    max_queued : int
+        The number of measurements that can be waiting to be written.
+    policy : str
+        What to do when a measurement is submitted and the queue is full. "block"
+        waits for space in the queue, and "drop" discards the measurement and counts
+        it in `dropped`.
+    max_queued_bytes : int, optional
+        The memory that the measurements waiting to be written can keep alive. The
+        queue is also full once this is reached, although a single measurement is
+        always accepted when nothing else is queued.
+    timings : StageTimings, optional
+        Where the time taken to write each measurement is recorded, as the "write"
+        stage.
+
+    Notes
+    -----
+    The arrays in a submitted measurement must not change until they're written,
+    so any pooled buffers holding them are retained while they're queued. The
+    memory a measurement keeps alive is the size of those buffers, or the size of
+    its arrays if they aren't pooled.
+
+    An error while writing doesn't stop the thread. The first error is stored in
+    `error` and the measurements that follow are discarded.
+    """
+
+    def __init__(
+        self,
+        writer,
+        max_queued=64,
+        policy="block",
+        max_queued_bytes=None,
+        timings=None,
+    ):
+        if policy not in WRITER_POLICIES:
+            raise ValueError(f"unknown policy {policy!r}, use one of {WRITER_POLICIES}")
+        self.writer = writer
+        self.timings = timings
+        self.policy = policy
+        self.max_queued_bytes = max_queued_bytes
+        self.dropped = 0
+        self.error = None
+        self._queued_bytes = 0
+        self._space = Condition()
+        self._queue = Queue(maxsize=max_queued)
+        self._thread = Thread(target=self._run, name="run-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, arrays, buffers=()):
+        """Queue a measurement to be appended to the run file.
+
+        Parameters
+        ----------
+        arrays : dict
+            The signals in the measurement, keyed by dataset name.
+        buffers : list of PooledBuffers
+            The pooled buffers that hold the arrays.
+
+        Returns
+        -------
+        bool
+            False if the measurement was dropped because the queue was full.
+        """
+        size = _queued_size(arrays, buffers)
+        if not self._reserve(size):
+            self.dropped += 1
+            return False
+        for b in buffers:
+            b.retain()
+        item = (arrays, buffers)
+        if self.policy == "block":
+            self._queue.put(item)
+            return True
+        try:
+            self._queue.put_nowait(item)
+        except Full:
+            self.dropped += 1
+            for b in buffers:
+                b.release()
+            self._free(size)
+            return False
+        return True
+
+    def update_metadata(self, **fields):
+        """Update the metadata once the measurements queued so far are written.
+        """
+        self._queue.put((None, fields))
+
+    def depth(self):
+        """The number of measurements and updates waiting to be written.
+        """
+        return self._queue.qsize()
+
+    def queued_bytes(self):
+        """The memory kept alive by the measurements waiting to be written.
+        """
+        with self._space:
+            return self._queued_bytes
+
+    def _reserve(self, size):
+        """Count a measurement towards the memory limit, waiting for room if needed.
+
+        Returns False if the measurement should be dropped.
+        """
+        with self._space:
+            limit = self.max_queued_bytes
+            while (
+                (limit is not None)
+                and (self._queued_bytes > 0)
+                and (self._queued_bytes + size > limit)
+            ):
+                if self.policy == "drop":
+                    return False
+                self._space.wait()
+            self._queued_bytes += size
+            return True
+
+    def _free(self, size):
+        with self._space:
+            self._queued_bytes -= size
+            self._space.notify_all()
+
+    def flush(self):
+        """Wait until everything that has been queued is written.
+        """
+        self._queue.join()
+
+    def close(self):
+        """Write everything that has been queued and close the run file.
+        """
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self.writer.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            arrays, extra = item
+            try:
+                if self.error is None:
+                    self._write(arrays, extra)
+            except Exception as e:
+                self.error = e
+            finally:
+                if arrays is not None:
+                    for b in extra:
+                        b.release()
+                    self._free(_queued_size(arrays, extra))
+                self._queue.task_done()
+
+    def _write(self, arrays, extra):
+        if arrays is None:
+            self.writer.update_metadata(**extra)
+            return
+        start = perf_counter()
+        self.writer.append(arrays)
+        if self.timings is not None:
+            self.timings.record("write", perf_counter() - start)
+
+
+class RunReader:
+    """Lazily reads the measurements in a run file.
+
+    The measurements are memory-mapped, so only the parts of the file that are
+    actually accessed are read from disk.
+
+    Parameters
+    ----------
+    path : Path
+        The run file to read.
+
+    Examples
+    --------
+    >>> run = RunReader("measurements.trcd")
+    >>> avg_cd = run["da_cd"][100:200].mean(axis=0)
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            header, _ = _decode_header(f.read(HEADER_SIZE))
+        if "compression" in header:
+            raise ValueError("compressed run files are read with CompressedRunReader")
+        self.points = header["points"]
+        self.datasets = [(name, dtype) for name, dtype in header["datasets"]]
+        self._dtype = record_dtype(self.datasets, self.points)
+        self.metadata = None
+        self._records = None
+        self.refresh()
+
+    def refresh(self):
+        """Pick up measurements and metadata saved since the file was opened.
+        """
+        with open(self.path, "rb") as f:
+            header, count = _decode_header(f.read(HEADER_SIZE))
+        self.metadata = header["metadata"]
+        # Guard against a count that was written before the file was truncated
+        stored = (self.path.stat().st_size - HEADER_SIZE) // self._dtype.itemsize
+        count = min(count, stored)
+        if count > 0:
+            self._records = np.memmap(
+                self.path,
+                dtype=self._dtype,
+                mode="r",
+                offset=HEADER_SIZE,
+                shape=(count,),
+            )
+        else:
+            self._records = np.zeros(0, dtype=self._dtype)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __getitem__(self, name):
+        """A read-only view of a dataset with shape (measurements, points).
+        """
+        return self._records[name]
+
+    def read(self, name, shots=slice(None)):
+        """Load some of the measurements of a dataset into memory.
+
+        Parameters
+        ----------
+        name : str
+            The dataset to read.
+        shots : slice or int or array of int
+            The measurements to read.
+        """
+        return np.array(self._records[name][shots])
+
+
+def _compress_chunk(records, delta, codec, level):
+    """Delta encode the integer datasets in a chunk of measurements, in place, and
+    compress it.
+
+    Returns
+    -------
+    bytes, float
+        The compressed chunk and the time taken to compress it.
+    """
+    start = perf_counter()
+    for name in delta:
+        values = records[name]
+        # Integer differences wrap around, so the cumulative sum recovers them exactly
+        values[:, 1:] = np.diff(values, axis=1)
+    create_compressor, _ = CODECS[codec]
+    compressor = create_compressor(level)
+    # The records are compressed a piece at a time so they're never copied whole
+    raw = records.reshape(-1).view(np.uint8)
+    pieces = [
+        compressor.compress(raw[i : i + COMPRESS_STEP])
+        for i in range(0, len(raw), COMPRESS_STEP)
+    ]
+    pieces.append(compressor.flush())
+    return b"".join(pieces), perf_counter() - start
+
+
+class CompressedRunWriter:
+    """Appends measurements to a run file in compressed chunks.
+
+    Measurements are collected into chunks, and each full chunk is compressed on a
+    pool of threads while acquisition continues. The compressed chunks are written
+    in order as they finish.
+
+    Parameters
+    ----------
+    path : Path
+        The file to create. An existing file is overwritten.
+    points : int
+        The number of points in each signal.
+    datasets : list of (str, str), optional
+        The name and NumPy type string of each dataset. All of `DATASETS` are stored
+        as float64 by default.
+    metadata : dict, optional
+        Data describing the run e.g. the preamble and UI settings.
+    codec : str
+        One of the codecs in `CODECS`.
+    level : int
+        The compression level passed to the codec.
+    chunk_bytes : int
+        The size of the measurements that are compressed together. A chunk always
+        holds at least one measurement.
+    workers : int, optional
+        The number of compression threads. Defaults to the number of CPUs, up to 4.
+    max_pending_bytes : int, optional
+        The size of the chunks that can be waiting to be compressed or written.
+        Defaults to two chunks per thread.
+
+    Notes
+    -----
+    Integer datasets, such as raw digitizer codes, are delta encoded along each
+    trace before they're compressed since neighboring points are similar. Floating
+    point datasets are compressed as they are because their differences can't be
+    undone exactly.
+
+    Appending only blocks if the chunks waiting to be compressed or written take
+    up more than `max_pending_bytes`, though one chunk is always allowed to be
+    compressed while the next is filled.
+    """
+
+    def __init__(
+        self,
+        path,
+        points,
+        datasets=None,
+        metadata=None,
+        codec="zlib",
+        level=6,
+        chunk_bytes=4_000_000,
+        workers=None,
+        max_pending_bytes=None,
+    ):
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec {codec!r}, use one of {tuple(CODECS)}")
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        self.path = Path(path)
+        self.points = points
+        self.count = 0
+        self._header = _new_header(points, datasets, metadata)
+        self.datasets = self._header["datasets"]
+        self._dtype = record_dtype(self.datasets, points)
+        self.chunk_size = max(1, chunk_bytes // self._dtype.itemsize)
+        if max_pending_bytes is None:
+            max_pending_bytes = 2 * workers * chunk_bytes
+        self.max_pending_bytes = max_pending_bytes
+        delta = [
+            name for name, dtype in self.datasets if np.dtype(dtype).kind in "iu"
+        ]
+        self._header["compression"] = {
+            "codec": codec,
+            "level": level,
+            "chunk_size": self.chunk_size,
+            "delta": delta,
+        }
+        self._chunk = np.empty(self.chunk_size, dtype=self._dtype)
+        self._filled = 0
+        self._written = 0
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="compress")
+        self._pending = deque()
+        self._pending_bytes = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.compress_time = 0.0
+        self._file = open(self.path, "wb")
+        self._file.write(_encode_header(self._header, self._written))
+        self._file.flush()
+
+    def append(self, arrays):
+        """Append a single measurement.
+
+        Parameters
+        ----------
+        arrays : dict
+            The signals in the measurement, keyed by dataset name.
+        """
+        record = _validate_record(self.datasets, self.points, arrays)
+        row = self._chunk[self._filled]
+        for (name, _), data in zip(self.datasets, record):
+            row[name] = data
+        self._filled += 1
+        self.count += 1
+        if self._filled == self.chunk_size:
+            self._submit_chunk()
+        self._write_finished()
+        while (len(self._pending) > 1) and (
+            self._pending_bytes > self.max_pending_bytes
+        ):
+            self._write_finished(wait=True)
+
+    def _submit_chunk(self):
+        records = self._chunk[: self._filled]
+        compression = self._header["compression"]
+        future = self._executor.submit(
+            _compress_chunk,
+            records,
+            compression["delta"],
+            compression["codec"],
+            compression["level"],
+        )
+        self._pending.append((len(records), records.nbytes, future))
+        self._pending_bytes += records.nbytes
+        self._chunk = np.empty(self.chunk_size, dtype=self._dtype)
+        self._filled = 0
+
+    def _write_finished(self, wait=False):
+        """Write the compressed chunks that are ready, in order.
+
+        If `wait` is set, the oldest chunk is written even if it isn't ready yet.
+        """
+        while self._pending and (wait or self._pending[0][2].done()):
+            wait = False
+            count, raw_bytes, future = self._pending.popleft()
+            data, seconds = future.result()
+            self._pending_bytes -= raw_bytes
+            self._file.write(np.array([count, len(data)], dtype="<u8").tobytes())
+            self._file.write(data)
+            self._written += count
+            self.raw_bytes += raw_bytes
+            self.compressed_bytes += len(data)
+            self.compress_time += seconds
+            self._file.seek(COUNT_OFFSET)
+            self._file.write(np.uint64(self._written).tobytes())
+            self._file.seek(0, 2)
+        self._file.flush()
+
+    def update_metadata(self, **fields):
+        """Add to or replace fields in the metadata stored in the file header.
+        """
+        self._header["metadata"].update(fields)
+        header = _encode_header(self._header, self._written)
+        self._file.seek(0)
+        self._file.write(header)
+        self._file.seek(0, 2)
+        self._file.flush()
+
+    @property
+    def metadata(self):
+        return self._header["metadata"]
+
+    def stats(self):
+        """The compression ratio and throughput of the chunks written so far.
+
+        The throughput is the rate at which a single thread compresses data, in
+        bytes per second.
+        """
+        return {
+            "raw_bytes": self.raw_bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "ratio": self.raw_bytes / max(self.compressed_bytes, 1),
+            "throughput": self.raw_bytes / max(self.compress_time, 1e-9),
+        }
+
+    def close(self):
+        """Compress the last partial chunk, write everything, and close the file.
+
+        The compression statistics are stored in the metadata.
+        """
+        if self._file.closed:
+            return
+        if self._filled > 0:
+            self._submit_chunk()
+        while self._pending:
+            self._write_finished(wait=True)
+        self._executor.shutdown()
+        self.update_metadata(compression_stats=self.stats())
+        self._file.close()
+
+
+class CompressedRunReader:
+    """Reads the measurements in a compressed run file.
+
+    This has the same interface as `RunReader`, but chunks are decompressed as
+    they're needed, with the most recently used ones cached. Use `iter_chunks` to
+    stream through a run without holding all of it in memory.
+
+    Parameters
+    ----------
+    path : Path
+        The run file to read.
+    cached_chunks : int
+        The number of decompressed chunks to keep.
+    """
+
+    def __init__(self, path, cached_chunks=8):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            header, _ = _decode_header(f.read(HEADER_SIZE))
+        self.points = header["points"]
+        self.datasets = [(name, dtype) for name, dtype in header["datasets"]]
+        self.compression = header["compression"]
+        self._dtype = record_dtype(self.datasets, self.points)
+        self.metadata = None
+        # The position, length, first measurement, and number of measurements of
+        # each chunk
+        self._offsets = []
+        self._lengths = []
+        self._starts = []
+        self._counts = []
+        self._scanned = HEADER_SIZE
+        self._decode = lru_cache(maxsize=cached_chunks)(self._decode_chunk)
+        self.refresh()
+
+    def refresh(self):
+        """Pick up chunks and metadata saved since the file was opened.
+        """
+        with open(self.path, "rb") as f:
+            header, count = _decode_header(f.read(HEADER_SIZE))
+            self.metadata = header["metadata"]
+            f.seek(self._scanned)
+            while len(self) < count:
+                chunk_count, length = np.frombuffer(f.read(16), dtype="<u8")
+                self._offsets.append(self._scanned + 16)
+                self._lengths.append(int(length))
+                self._starts.append(len(self))
+                self._counts.append(int(chunk_count))
+                self._scanned += 16 + int(length)
+                f.seek(self._scanned)
+
+    def __len__(self):
+        return sum(self._counts)
+
+    def _decode_chunk(self, index):
+        with open(self.path, "rb") as f:
+            f.seek(self._offsets[index])
+            data = f.read(self._lengths[index])
+        _, decompress = CODECS[self.compression["codec"]]
+        records = np.frombuffer(decompress(data), dtype=self._dtype).copy()
+        for name in self.compression["delta"]:
+            values = records[name]
+            np.cumsum(values, axis=1, dtype=values.dtype, out=values)
+        records.flags.writeable = False
+        return records
+
+    def iter_chunks(self):
+        """Decompress the chunks one at a time.
+
+        Yields
+        ------
+        int, np.ndarray
+            The index of the first measurement in the chunk and the measurements,
+            as a structured array with a field for each dataset.
+        """
+        for index, start in enumerate(self._starts):
+            yield start, self._decode_chunk(index)
+
+    def __getitem__(self, name):
+        """Every measurement of a dataset with shape (measurements, points).
+        """
+        return self.read(name)
+
+    def read(self, name, shots=slice(None)):
+        """Load some of the measurements of a dataset into memory.
+
+        Parameters
+        ----------
+        name : str
+            The dataset to read.
+        shots : slice or int or array of int
+            The measurements to read.
+        """
+        rows = np.arange(len(self))[shots]
+        flat = np.atleast_1d(rows)
+        chunks = np.searchsorted(self._starts, flat, side="right") - 1
+        out = np.empty((len(flat), self.points), dtype=self._dtype[name].base)
+        for index in np.unique(chunks):
+            selected = chunks == index
+            records = self._decode(int(index))
+            out[selected] = records[name][flat[selected] - self._starts[index]]
+        return out if np.ndim(rows) else out[0]
+
+
+def open_run(path):
+    """Open a run file with the reader that matches its format.
+    """
+    with open(path, "rb") as f:
+        header, _ = _decode_header(f.read(HEADER_SIZE))
+    if "compression" in header:
+        return CompressedRunReader(path)
+    return RunReader(path)
@@ -0,0 +1,146 @@
+import json
+import numpy as np
+from bisect import bisect_right
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+
+
+# The stages of the pipeline that each shot goes through, in order
+STAGES = (
+    "trigger_wait",
+    "shutter_read",
+    "transfer",
+    "shot_queue",
+    "scale",
+    "compute_da",
+    "update_averages",
+    "save_queue",
+    "write",
+    "render",
+)
+# Bin edges of the latency histograms in seconds, ten bins per decade from 1us to 100s
+HISTOGRAM_EDGES = tuple(np.logspace(-6, 2, 81))
+
+
+class LatencyHistogram:
+    """A histogram of durations with fixed bins, so recording never allocates.
+
+    Parameters
+    ----------
+    edges : tuple of float
+        The increasing bin edges in seconds. Durations outside of the edges are
+        counted in an underflow or overflow bin.
+    """
+
+    def __init__(self, edges=HISTOGRAM_EDGES):
+        self.edges = edges
+        self.counts = np.zeros(len(edges) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = 0.0
+
+    def add(self, seconds):
+        """Count a duration.
+        """
+        self.counts[bisect_right(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """Estimate a percentile from the bins, to within the width of a bin.
+
+        Returns the upper edge of the bin containing the percentile, or NaN if
+        nothing has been counted.
+        """
+        if self.count == 0:
+            return np.nan
+        index = int(np.searchsorted(np.cumsum(self.counts), q / 100 * self.count))
+        if index >= len(self.edges):
+            return self.max
+        return min(self.edges[index], self.max)
+
+    def summary(self):
+        """The number of durations and their statistics in seconds.
+        """
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class StageTimings:
+    """Latency histograms for each stage of the pipeline, shared between threads.
+
+    Examples
+    --------
+    >>> timings = StageTimings()
+    >>> with timings.time("compute_da"):
+    ...     compute()
+    >>> timings.summary()["compute_da"]["p99"]
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._histograms = dict()
+
+    def record(self, stage, seconds):
+        """Count how long a stage took for one shot.
+        """
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self._histograms[stage] = histogram
+            histogram.add(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        """Record how long the body of a `with` block takes.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, perf_counter() - start)
+
+    def stages(self):
+        """The stages that have been recorded, in pipeline order.
+        """
+        with self._lock:
+            return self._stages_unlocked()
+
+    def summary(self):
+        """The statistics of each stage that has been recorded.
+        """
+        with self._lock:
+            return {s: self._histograms[s].summary() for s in self._stages_unlocked()}
+
+    def export(self, path):
+        """Save the statistics and the histograms of every stage as JSON.
+        """
+        with self._lock:
+            stages = {
+                s: {
+                    **self._histograms[s].summary(),
+                    "counts": self._histograms[s].counts.tolist(),
+                }
+                for s in self._stages_unlocked()
+            }
+        with open(Path(path), "w") as f:
+            json.dump({"edges": list(HISTOGRAM_EDGES), "stages": stages}, f, indent=2)
+
+    def _stages_unlocked(self):
+        known = [s for s in STAGES if s in self._histograms]
+        return known + sorted(s for s in self._histograms if s not in STAGES)
@@ -1,23 +1,27 @@
 import numpy as np
 # import structlog
-from eliot import start_action, Message, to_file
+from eliot import start_action, Message
 from pathlib import Path
-from pyqtgraph import ViewBox
-from PySide2.QtWidgets import QMainWindow, QFileDialog, QMessageBox
-from PySide2.QtCore import QObject, QThread, Signal, Slot, QMutex
+from pyqtgraph import FillBetweenItem, ViewBox, mkBrush
+from PySide2.QtWidgets import QLabel, QMainWindow, QFileDialog, QMessageBox
+from PySide2.QtCore import Qt, QObject, QThread, Signal, Slot, QMutex
 from . import common
-from .common import PlotData, UiSettings
+from .common import UiSettings, SimulationSettings
 from .comp_worker import ComputationWorker
+from .diagnostics import DiagnosticsPanel
 from .exp_worker import ExperimentWorker
+from .logs import log_action
+from .render import RenderScheduler
+from .timing import StageTimings
 from .generated_ui import Ui_MainWindow
 
 
 # logger = structlog.get_logger()
-to_file(open("log.txt", "w"))
 
 
 class MainWindowSignals(QObject):
     measure = Signal()
+    display_range = Signal(str, int, float, float)
 
 
 class MainWindow(QMainWindow):
@@ -31,6 +35,15 @@ class MainWindow(QMainWindow):
         self.max_measurements = 0
         self.collecting = False
         self.time_axis = None
+        # The newest data, and the data each group of plots is showing. Plots on
+        # hidden tabs aren't redrawn until their tab is shown.
+        self._latest_traces = None
+        self._latest_da = None
+        self._shown_traces = None
+        self._shown_live_da = None
+        self._shown_avg_da = None
+        self._held_traces = []
+        self._held_da = []
         self.mutex = QMutex()
         self.comp_thread = QThread()
         self.exp_thread = QThread()
@@ -38,6 +51,24 @@ class MainWindow(QMainWindow):
         self._set_initial_widget_states()
         self._store_line_objects()
         self._set_plot_mouse_mode()
+        self._sent_display_ranges = dict()
+        # The worker that's told about zooming, which is the last run's worker
+        # between runs so that its averages can still be redrawn in detail
+        self._display_range_worker = None
+        self._connect_display_ranges()
+        self.shot_queue_label = QLabel()
+        self.ui.statusbar.addPermanentWidget(self.shot_queue_label)
+        self.writer_queue_label = QLabel()
+        self.ui.statusbar.addPermanentWidget(self.writer_queue_label)
+        self.dropped_frames_label = QLabel()
+        self.ui.statusbar.addPermanentWidget(self.dropped_frames_label)
+        self.render_scheduler = RenderScheduler(self.update_plots, parent=self)
+        self.timings = StageTimings()
+        self.diagnostics = DiagnosticsPanel(self)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.diagnostics)
+        self.diagnostics.hide()
+        self.ui.menubar.addAction(self.diagnostics.toggleViewAction())
+        self.ui.tabs.currentChanged.connect(lambda index: self.refresh_visible_plots())
 
     def _set_initial_widget_states(self):
         with start_action(action_type="_set_initial_widget_states"):
@@ -79,6 +110,7 @@ class MainWindow(QMainWindow):
                     self.comp_thread.wait()
                 with start_action(action_type="wait_exp_thread"):
                     self.exp_thread.wait()
+                self._finish_saving()
             event.accept()
 
     def _store_line_objects(self):
@@ -94,6 +126,28 @@ class MainWindow(QMainWindow):
         self.avg_da_par_line = self.ui.avg_da_par_graph.plot(*starting_data)
         self.avg_da_perp_line = self.ui.avg_da_perp_graph.plot(*starting_data)
         self.avg_da_cd_line = self.ui.avg_da_cd_graph.plot(*starting_data)
+        self.avg_da_par_band = self._add_error_band(self.ui.avg_da_par_graph)
+        self.avg_da_perp_band = self._add_error_band(self.ui.avg_da_perp_graph)
+        self.avg_da_cd_band = self._add_error_band(self.ui.avg_da_cd_graph)
+
+    def _add_error_band(self, graph):
+        """Add a shaded band around a line to show the standard error of an average.
+
+        Returns
+        -------
+        (PlotDataItem, PlotDataItem)
+            The lines at the upper and lower edges of the band.
+        """
+        starting_data = (np.arange(100), np.zeros(100))
+        upper = graph.plot(*starting_data, pen=None)
+        lower = graph.plot(*starting_data, pen=None)
+        graph.addItem(FillBetweenItem(upper, lower, brush=mkBrush(100, 100, 255, 80)))
+        return upper, lower
+
+    def _set_error_band(self, band, avg, err):
+        upper, lower = band
+        upper.setData(self.time_axis, avg + err)
+        lower.setData(self.time_axis, avg - err)
 
     def _set_plot_mouse_mode(self):
         self.ui.live_par_graph.getPlotItem().getViewBox().setMouseMode(ViewBox.RectMode)
@@ -120,9 +174,60 @@ class MainWindow(QMainWindow):
             ViewBox.RectMode
         )
 
+    def _display_graphs(self):
+        return {
+            "live_par": self.ui.live_par_graph,
+            "live_perp": self.ui.live_perp_graph,
+            "live_ref": self.ui.live_ref_graph,
+            "live_da_par": self.ui.live_da_par_graph,
+            "live_da_perp": self.ui.live_da_perp_graph,
+            "live_da_cd": self.ui.live_da_cd_graph,
+            "avg_da_par": self.ui.avg_da_par_graph,
+            "avg_da_perp": self.ui.avg_da_perp_graph,
+            "avg_da_cd": self.ui.avg_da_cd_graph,
+        }
+
+    def _connect_display_ranges(self):
+        """Tell the computation worker about zooming and resizing so that it can
+        decimate the signals for each plot.
+        """
+        for plot, graph in self._display_graphs().items():
+            view_box = graph.getPlotItem().getViewBox()
+            view_box.sigXRangeChanged.connect(
+                lambda *args, plot=plot: self._send_display_range(plot)
+            )
+            view_box.sigResized.connect(
+                lambda *args, plot=plot: self._send_display_range(plot)
+            )
+
+    def _send_display_range(self, plot, force=False):
+        """Send the width and visible time range of a plot if they've changed.
+
+        The whole signal is requested while the plot is automatically ranged.
+        """
+        view_box = self._display_graphs()[plot].getPlotItem().getViewBox()
+        width = int(view_box.width())
+        if view_box.autoRangeEnabled()[0]:
+            start, stop = float("nan"), float("nan")
+            key = (width, None, None)
+        else:
+            start, stop = (x / 1e6 for x in view_box.viewRange()[0])
+            key = (width, start, stop)
+        if (not force) and (self._sent_display_ranges.get(plot) == key):
+            return
+        self._sent_display_ranges[plot] = key
+        self.signals.display_range.emit(plot, width, start, stop)
+
+    def _display_x(self, data, plot):
+        """The time axis in microseconds for a signal shown in a plot.
+        """
+        if data.display_time is None:
+            return self.time_axis
+        return data.display_time[plot] * 1e6
+
     @Slot(np.ndarray)
     def set_time_axis(self, values):
-        with start_action(action_type="set_time_axis"):
+        with log_action("set_time_axis", level="debug"):
             self.time_axis = values * 1e6
 
     @Slot(int)
@@ -135,12 +240,59 @@ class MainWindow(QMainWindow):
 
     @Slot(int)
     def update_current_measurement(self, x):
-        with start_action(action_type="update_current_measurement", new_meas=x):
+        with log_action("update_current_measurement", level="debug", new_meas=x):
             self.current_measurement = x
             self.ui.measurement_counter_label.setText(
                 f"{self.current_measurement}/{self.max_measurements}"
             )
 
+    @Slot(int, int)
+    def update_shot_queue(self, depth, dropped):
+        """Show how many shots are waiting to be computed.
+        """
+        text = f"Shot queue: {depth}"
+        if dropped:
+            text += f" ({dropped} dropped)"
+        self.shot_queue_label.setText(text)
+
+    @Slot(int, int)
+    def update_writer_queue(self, depth, dropped):
+        """Show how many measurements are waiting to be saved.
+        """
+        text = f"Save queue: {depth}"
+        if dropped:
+            text += f" ({dropped} dropped)"
+        self.writer_queue_label.setText(text)
+
+    def _finish_saving(self):
+        """Write any measurements that are still queued once the threads have stopped.
+
+        The stage timings are saved in the run directory along with the measurements.
+        """
+        with start_action(action_type="finish_saving"):
+            shots = self.exp_worker.shots
+            Message.log(dropped_shots=shots.dropped, max_shot_queue=shots.max_depth)
+            Message.log(timings=self.timings.summary())
+            self.comp_worker.close_run_file()
+            if self.comp_worker.save_dir is not None:
+                self.timings.export(self.comp_worker.save_dir / "timings.json")
+            self.shot_queue_label.clear()
+            self.writer_queue_label.clear()
+            # The worker's thread has stopped, so zooming is handled on this one
+            self._route_display_ranges(Qt.DirectConnection)
+
+    def _route_display_ranges(self, connection):
+        """Send changes to the plot ranges to the current computation worker.
+        """
+        if self._display_range_worker is not None:
+            self.signals.display_range.disconnect(
+                self._display_range_worker.set_display_range
+            )
+        self.signals.display_range.connect(
+            self.comp_worker.set_display_range, connection
+        )
+        self._display_range_worker = self.comp_worker
+
     @Slot()
     def start_collecting(self):
         """Begins collecting data when the "Start" button is pressed.
@@ -150,9 +302,17 @@ class MainWindow(QMainWindow):
             if should_quit:
                 Message.log(should_quit=should_quit)
                 return
+            self.timings = StageTimings()
+            self.diagnostics.show_timings(self.timings)
             with start_action(action_type="create_workers"):
-                self.comp_worker = ComputationWorker(self.mutex, settings)
-                self.exp_worker = ExperimentWorker(self.mutex, settings)
+                self.comp_worker = ComputationWorker(self.mutex, settings, self.timings)
+                self.exp_worker = ExperimentWorker(self.mutex, settings, self.timings)
+            self.render_scheduler.attach(self.comp_worker.frames)
+            self.render_scheduler.max_fps = settings.max_fps
+            self.dropped_frames_label.clear()
+            if self.comp_worker.save_dir is not None:
+                Message.log(run_dir=str(self.comp_worker.save_dir))
+                self.ui.statusbar.showMessage(f"Saving to {self.comp_worker.save_dir}")
             self._connect_worker_signals()
             self.comp_worker.moveToThread(self.comp_thread)
             self.exp_worker.moveToThread(self.exp_thread)
@@ -223,6 +383,8 @@ class MainWindow(QMainWindow):
                 Message.log(quit=quit)
                 quit = True
             settings.instr_name = instr_name
+            if instr_name.lower() == "sim":
+                settings.simulation = SimulationSettings()
             Message.log(quit=quit)
             return settings, quit
 
@@ -264,16 +426,22 @@ class MainWindow(QMainWindow):
         """Connect signals for communication between workers and the main window.
         """
         # Produced by the experiment worker
-        self.exp_worker.signals.preamble.connect(self.comp_worker.store_preamble)
-        self.exp_worker.signals.new_data.connect(self.comp_worker.compute_signals)
+        self.comp_worker.attach(self.exp_worker.shots)
+        self.exp_worker.signals.shots_ready.connect(self.comp_worker.process_shots)
         self.exp_worker.signals.done.connect(self.cleanup_when_done)
         # Produced by the computation worker
         self.comp_worker.signals.time_axis.connect(self.set_time_axis)
-        self.comp_worker.signals.new_data.connect(self.update_plots)
+        self.comp_worker.signals.frame_ready.connect(self.render_scheduler.frame_ready)
         self.comp_worker.signals.meas_num.connect(self.update_current_measurement)
+        self.comp_worker.signals.writer_queue.connect(self.update_writer_queue)
+        self.comp_worker.signals.shot_queue.connect(self.update_shot_queue)
         # Produced by the main window
         self.signals.measure.connect(self.exp_worker.measure)
         self.ui.reset_avg_btn.clicked.connect(self.comp_worker.reset_averages)
+        self._route_display_ranges(Qt.AutoConnection)
+        # Each run has a new worker, so it needs every range even if it hasn't changed
+        for plot in self._display_graphs():
+            self._send_display_range(plot, force=True)
 
     def _disable_acq_controls(self):
         """Disable certain controls while collecting data.
@@ -327,6 +495,7 @@ class MainWindow(QMainWindow):
                 self.comp_thread.wait()
             with start_action(action_type="wait_exp_thread"):
                 self.exp_thread.wait()
+            self._finish_saving()
             self._enable_acq_controls()
             self.current_measurement = 0
 
@@ -342,6 +511,7 @@ class MainWindow(QMainWindow):
                 self.comp_thread.wait()
             with start_action(action_type="wait_exp_thread"):
                 self.exp_thread.wait()
+            self._finish_saving()
             with start_action(action_type="mutex"):
                 self.mutex.lock()
                 common.SHOULD_STOP = False
@@ -353,27 +523,112 @@ class MainWindow(QMainWindow):
                     self, "Done", "The experiment has finished.", QMessageBox.StandardButton.Ok
                 )
 
-    @Slot(PlotData)
-    def update_plots(self, data):
-        """Update the plots in the Live/Average tabs when new data is available.
+    def update_plots(self, traces, da):
+        """Update the plots on the visible tab when new data is available.
 
         Parameters
         ----------
-        data : PlotData
-            Three live data channels and the signals computed from them.
-        """
-        with start_action(action_type="update_plots"):
-            self.live_par_line.setData(self.time_axis, data.par)
-            self.live_perp_line.setData(self.time_axis, data.perp)
-            self.live_ref_line.setData(self.time_axis, data.ref)
-            if data.da_par is not None:
-                with start_action(action_type="update_da_plots"):
-                    self.live_da_par_line.setData(self.time_axis, data.da_par)
-                    self.live_da_perp_line.setData(self.time_axis, data.da_perp)
-                    self.live_da_cd_line.setData(self.time_axis, data.da_cd)
-                    self.avg_da_par_line.setData(self.time_axis, data.avg_da_par)
-                    self.avg_da_perp_line.setData(self.time_axis, data.avg_da_perp)
-                    self.avg_da_cd_line.setData(self.time_axis, data.avg_da_cd)
+        traces : PlotData or None
+            The data whose three live data channels should be displayed.
+        da : PlotData or None
+            The data whose dA signals should be displayed.
+
+        Notes
+        -----
+        This is called by the render scheduler, which limits how often the plots
+        are redrawn. Plots on hidden tabs are redrawn with the newest data once
+        their tab is shown.
+        """
+        with log_action("update_plots", level="debug"), self.timings.time("render"):
+            if traces is not None:
+                self._latest_traces = traces
+            if da is not None:
+                self._latest_da = da
+            self.refresh_visible_plots()
+            dropped = self.render_scheduler.dropped_frames
+            if dropped:
+                self.dropped_frames_label.setText(f"Skipped frames: {dropped}")
+
+    @Slot()
+    def refresh_visible_plots(self):
+        """Redraw the plots on the visible tab that aren't showing the newest data.
+        """
+        tab = self.ui.tabs.currentWidget()
+        if tab is self.ui.live_tab:
+            if self._latest_traces is not self._shown_traces:
+                self._draw_traces(self._latest_traces)
+                self._shown_traces = self._latest_traces
+            if self._latest_da is not self._shown_live_da:
+                self._draw_live_da(self._latest_da)
+                self._shown_live_da = self._latest_da
+        elif tab is self.ui.average_tab:
+            if self._latest_da is not self._shown_avg_da:
+                self._draw_average_da(self._latest_da)
+                self._shown_avg_da = self._latest_da
+        self._release_unused_data()
+
+    def _release_unused_data(self):
+        """Release the buffers of data that isn't shown or waiting to be shown.
+
+        The lines keep referring to the arrays until they get new data, so the
+        buffers can't be released until every plot showing them has been redrawn.
+        """
+        held_traces = [self._latest_traces, self._shown_traces]
+        held_da = [self._latest_da, self._shown_live_da, self._shown_avg_da]
+        for data in self._held_traces:
+            if not any(data is d for d in held_traces):
+                data.release(da=False)
+        for data in self._held_da:
+            if not any(data is d for d in held_da):
+                data.release(traces=False)
+        self._held_traces = _unique(held_traces)
+        self._held_da = _unique(held_da)
+
+    def _draw_traces(self, traces):
+        with log_action("draw_traces", level="debug"):
+            self.live_par_line.setData(self._display_x(traces, "live_par"), traces.par)
+            self.live_perp_line.setData(
+                self._display_x(traces, "live_perp"), traces.perp
+            )
+            self.live_ref_line.setData(self._display_x(traces, "live_ref"), traces.ref)
+
+    def _draw_live_da(self, da):
+        with log_action("draw_live_da", level="debug"):
+            self.live_da_par_line.setData(
+                self._display_x(da, "live_da_par"), da.da_par
+            )
+            self.live_da_perp_line.setData(
+                self._display_x(da, "live_da_perp"), da.da_perp
+            )
+            self.live_da_cd_line.setData(self._display_x(da, "live_da_cd"), da.da_cd)
+
+    def _draw_average_da(self, da):
+        with log_action("draw_average_da", level="debug"):
+            self.avg_da_par_line.setData(
+                self._display_x(da, "avg_da_par"), da.avg_da_par
+            )
+            self.avg_da_perp_line.setData(
+                self._display_x(da, "avg_da_perp"), da.avg_da_perp
+            )
+            self.avg_da_cd_line.setData(
+                self._display_x(da, "avg_da_cd"), da.avg_da_cd
+            )
+            if da.display_bands:
+                for plot, band in (
+                    ("avg_da_par", self.avg_da_par_band),
+                    ("avg_da_perp", self.avg_da_perp_band),
+                    ("avg_da_cd", self.avg_da_cd_band),
+                ):
+                    x = self._display_x(da, plot)
+                    upper_edge, lower_edge = da.display_bands[plot]
+                    band[0].setData(x, upper_edge)
+                    band[1].setData(x, lower_edge)
+            elif da.err_da_par is not None:
+                self._set_error_band(self.avg_da_par_band, da.avg_da_par, da.err_da_par)
+                self._set_error_band(
+                    self.avg_da_perp_band, da.avg_da_perp, da.err_da_perp
+                )
+                self._set_error_band(self.avg_da_cd_band, da.avg_da_cd, da.err_da_cd)
 
     @Slot(int)
     def save_loc_set_state(self, state):
@@ -425,27 +680,6 @@ class MainWindow(QMainWindow):
                 QMessageBox.StandardButton.Ok,
             )
 
-    def _save_would_overwrite(self):
-        """Returns True if the save directory contains *anything*.
-        """
-        for item in Path(self.save_data_dir).iterdir():
-            return True
-        return False
-
-    def _should_overwrite(self):
-        """Asks the user whether data in the save directory should be overwritten.
-        """
-        with start_action(action_type="dialog") as action:
-            reply = QMessageBox.warning(
-                self,
-                "Overwrite?",
-                "The current directory contents will be erased. Continue?",
-                QMessageBox.StandardButton.Ok | QMessageBox.StandardButton.Cancel,
-            )
-            should_overwrite = reply == QMessageBox.StandardButton.Ok
-            action.add_success_fields(overwrite=should_overwrite)
-            return should_overwrite
-
     def _saving_should_proceed(self):
         """Determine whether valid settings have been entered for saving data.
         """
@@ -457,9 +691,6 @@ class MainWindow(QMainWindow):
             if not loc_is_valid:
                 self._tell_save_loc_is_invalid()
                 return False
-            would_overwrite = self._save_would_overwrite()
-            if would_overwrite and (not self._should_overwrite()):
-                return False
             return True
 
     @Slot(int)
@@ -519,3 +750,13 @@ class MainWindow(QMainWindow):
                 self.ui.dark_curr_perp.setEnabled(True)
                 self.ui.dark_curr_ref.setEnabled(True)
                 Message.log(dark_curr="enabled")
+
+
+def _unique(items):
+    """The items that aren't None, without duplicates, compared by identity.
+    """
+    unique = []
+    for item in items:
+        if (item is not None) and not any(item is u for u in unique):
+            unique.append(item)
+    return unique
@@ -0,0 +1,58 @@
+import numpy as np
+from ns_trcd.comp_worker import ComputationWorker
+from ns_trcd.common import UiSettings, Preamble, RawData
+from ns_trcd import common
+from PySide2.QtCore import QMutex
+from pytest import fixture
+
+
+@fixture
+def empty_settings() -> UiSettings:
+    """Return a UiSettings with all default values.
+    """
+    return UiSettings()
+
+
+@fixture
+def preamble() -> Preamble:
+    """Returns a preamble filled with dummy values.
+    """
+    return Preamble(
+        t_res=20e-9,
+        v_scale_par=1.0,
+        v_offset_par=0,
+        v_scale_perp=1.0,
+        v_offset_perp=0,
+        v_scale_ref=1.0,
+        v_offset_ref=0,
+        points=1000)
+
+
+@fixture
+def saving_worker(request, empty_settings, preamble, tmp_path) -> ComputationWorker:
+    """Returns a worker with a preamble that saves up to 1000 measurements.
+
+    Other settings are taken from a dict passed with indirect parametrization.
+    """
+    settings = empty_settings
+    settings.save = True
+    settings.save_loc = str(tmp_path)
+    settings.num_measurements = 1000
+    for name, value in getattr(request, "param", dict()).items():
+        setattr(settings, name, value)
+    worker = ComputationWorker(QMutex(), settings)
+    worker.store_preamble(preamble)
+    yield worker
+    if worker.run_writer is not None:
+        worker.close_run_file()
+    common.SHOULD_STOP = False
+
+
+def feed_pairs(worker, n, rng=None):
+    """Compute `n` measurements, each a shot with pump and a noisy shot without.
+    """
+    if rng is None:
+        rng = np.random.default_rng(0)
+    for _ in range(n):
+        worker.compute_signals(RawData(*np.full((3, 100), 1.0), True))
+        worker.compute_signals(RawData(*rng.uniform(0.5, 1.5, (3, 100)), False))
@@ -0,0 +1,35 @@
+from ns_trcd.buffers import BufferPool, TraceBuffers
+from pytest import fixture
+
+
+@fixture
+def pool() -> BufferPool:
+    return BufferPool(TraceBuffers, 10, 2)
+
+
+def test_preallocates_buffers(pool):
+    assert pool.allocations == 2
+    assert pool.free_count() == 2
+    assert len(pool.acquire().par) == 10
+
+
+def test_released_buffers_are_reused(pool):
+    buffers = pool.acquire()
+    buffers.release()
+    assert pool.acquire() is buffers
+
+
+def test_retained_buffers_are_not_reused(pool):
+    buffers = pool.acquire()
+    buffers.retain()
+    buffers.release()
+    assert pool.free_count() == 1
+    assert pool.acquire() is not buffers
+    buffers.release()
+    assert pool.free_count() == 1
+
+
+def test_grows_instead_of_overwriting(pool):
+    held = [pool.acquire() for _ in range(3)]
+    assert len({id(b) for b in held}) == 3
+    assert pool.allocations == 3
@@ -1,16 +1,28 @@
 import numpy as np
-from ns_trcd.comp_worker import ComputationWorker, MeasurementData, ComputationSignals
-from ns_trcd.common import UiSettings, Preamble, RawData
+from dataclasses import asdict
+from ns_trcd.comp_worker import (
+    DA_POOL_SIZE,
+    DISPLAY_SIGNALS,
+    TRACE_POOL_SIZE,
+    ComputationWorker,
+    MeasurementData,
+    ComputationSignals,
+    load_da,
+)
+from ns_trcd.common import Preamble, RawData
+from ns_trcd.shot_queue import ShotQueue
+from ns_trcd.storage import (
+    PREAMBLES_FILE_NAME,
+    RUN_FILE_NAME,
+    BackgroundWriter,
+    RunReader,
+    open_run,
+    read_preambles,
+)
 from ns_trcd import common
 from PySide2.QtCore import QMutex
-from pytest import fixture
-
-
-@fixture
-def empty_settings() -> UiSettings:
-    """Return a UiSettings with all default values.
-    """
-    return UiSettings()
+from pytest import fixture, mark
+from conftest import feed_pairs
 
 
 @fixture
@@ -19,21 +31,6 @@ def empty_worker(empty_settings) -> ComputationWorker:
     return ComputationWorker(mutex, empty_settings)
 
 
-@fixture
-def preamble() -> Preamble:
-    """Returns a preamble filled with dummy values.
-    """
-    return Preamble(
-        t_res=20e-9,
-        v_scale_par=1.0,
-        v_offset_par=0,
-        v_scale_perp=1.0,
-        v_offset_perp=0,
-        v_scale_ref=1.0,
-        v_offset_ref=0,
-        points=1000)
-
-
 @fixture
 def preambled_worker(empty_worker, preamble) -> ComputationWorker:
     empty_worker.store_preamble(preamble)
@@ -48,6 +45,14 @@ def measurement_data() -> MeasurementData:
     return MeasurementData(par, perp, ref)
 
 
+def collect_frames(worker, received):
+    """Take each frame the worker publishes, like the GUI would.
+    """
+    worker.signals.frame_ready.connect(
+        lambda sequence: received.append(worker.frames.take()[0])
+    )
+
+
 @fixture
 def raw_data_with_pump() -> RawData:
     return RawData(
@@ -91,6 +96,15 @@ def test_stores_preamble(empty_worker, preamble):
     assert empty_worker.points == preamble.points
 
 
+def test_pools_kept_when_only_scale_changes(empty_worker, preamble):
+    empty_worker.store_preamble(preamble)
+    pool = empty_worker._trace_pool
+    empty_worker.store_preamble(Preamble(**{**asdict(preamble), "v_scale_par": 2.0}))
+    assert empty_worker._trace_pool is pool
+    empty_worker.store_preamble(Preamble(**{**asdict(preamble), "points": 500}))
+    assert empty_worker._trace_pool.points == 500
+
+
 def test_emits_time_axis_signal(qtbot, empty_worker, preamble):
     """Ensure that the worker emits the time_axis signal when the preamble is set.
     """
@@ -172,9 +186,9 @@ def test_increases_count(preambled_worker, raw_data_without_pump, raw_data_with_
 
 
 def test_new_data_signal_emitted(qtbot, preambled_worker, raw_data_without_pump):
-    """Ensure that the new_data signal is emitted when signals are computed.
+    """Ensure that the frame_ready signal is emitted when signals are computed.
     """
-    with qtbot.waitSignal(preambled_worker.signals.new_data, timeout=1000):
+    with qtbot.waitSignal(preambled_worker.signals.frame_ready, timeout=1000):
         preambled_worker.compute_signals(raw_data_without_pump)
 
 
@@ -196,3 +210,429 @@ def test_sets_should_stop_when_done(preambled_worker, raw_data_with_pump, raw_da
     preambled_worker.compute_signals(raw_data_without_pump)
     assert common.SHOULD_STOP
     common.SHOULD_STOP = False
+
+
+@mark.parametrize(
+    "saving_worker",
+    [
+        dict(num_measurements=2, preallocate_run_file=preallocate)
+        for preallocate in (False, True)
+    ],
+    indirect=True,
+)
+def test_ignores_shots_after_last_measurement(saving_worker):
+    """Ensure that shots still queued when the run stops aren't computed or saved.
+    """
+    worker = saving_worker
+    feed_pairs(worker, 3)
+    assert worker.count == 2
+    worker.close_run_file()
+    assert len(RunReader(worker.save_dir / RUN_FILE_NAME)) == 2
+
+
+def test_compute_da_matches_reference(preambled_worker):
+    rng = np.random.default_rng(0)
+    preambled_worker.with_pump = MeasurementData(*rng.uniform(0.1, 1.0, (3, 100)))
+    preambled_worker.without_pump = MeasurementData(*rng.uniform(0.1, 1.0, (3, 100)))
+    expected = preambled_worker.compute_da_reference()
+    actual = preambled_worker.compute_da()
+    for e, a in zip(expected, actual):
+        np.testing.assert_allclose(a, e, rtol=1e-10, atol=1e-12)
+    assert preambled_worker.invalid_points == 0
+
+
+def test_buffers_reused_after_release(
+    preambled_worker, raw_data_with_pump, raw_data_without_pump
+):
+    """Ensure that trace buffers are only reused once the receiver releases them.
+    """
+    preambled_worker.max_measurements = 1000
+    received = []
+    collect_frames(preambled_worker, received)
+    preambled_worker.compute_signals(raw_data_with_pump)
+    preambled_worker.compute_signals(raw_data_without_pump)
+    first = received[-1]
+    preambled_worker.compute_signals(raw_data_with_pump)
+    assert received[-1].par is not first.par
+    for plot_data in received:
+        plot_data.release()
+    allocations = preambled_worker._trace_pool.allocations
+    for _ in range(10):
+        preambled_worker.compute_signals(raw_data_without_pump)
+        received[-1].release()
+    assert preambled_worker._trace_pool.allocations == allocations
+
+
+def test_da_pool_grows_to_cover_every_holder(
+    preambled_worker, raw_data_with_pump, raw_data_without_pump
+):
+    """Ensure that the dA pool stops growing once it covers the GUI holding three
+    sets while another is waiting to be taken.
+    """
+    preambled_worker.max_measurements = 1000
+    shown = []
+    for _ in range(3):
+        preambled_worker.compute_signals(raw_data_with_pump)
+        preambled_worker.compute_signals(raw_data_without_pump)
+        shown.append(preambled_worker.frames.take()[1])
+    for _ in range(2):
+        preambled_worker.compute_signals(raw_data_with_pump)
+        preambled_worker.compute_signals(raw_data_without_pump)
+    allocations = preambled_worker._da_pool.allocations
+    for _ in range(5):
+        preambled_worker.compute_signals(raw_data_with_pump)
+        preambled_worker.compute_signals(raw_data_without_pump)
+    assert preambled_worker._da_pool.allocations == allocations == 5
+
+
+def test_decimated_display_only_uses_preallocated_buffers(
+    preambled_worker, raw_data_with_pump, raw_data_without_pump
+):
+    received = []
+    collect_frames(preambled_worker, received)
+    preambled_worker.max_measurements = 1000
+    for plot in DISPLAY_SIGNALS:
+        preambled_worker.set_display_range(plot, 10, np.nan, np.nan)
+    for _ in range(5):
+        preambled_worker.compute_signals(raw_data_with_pump)
+        preambled_worker.compute_signals(raw_data_without_pump)
+    assert preambled_worker._trace_pool.allocations == TRACE_POOL_SIZE
+    assert preambled_worker._da_pool.allocations == DA_POOL_SIZE
+
+
+def test_scales_traces_in_place(preambled_worker, raw_data_without_pump):
+    preambled_worker.v_scale_par = 2.0
+    preambled_worker.v_offset_par = 0.5
+    preambled_worker.compute_signals(raw_data_without_pump)
+    np.testing.assert_allclose(preambled_worker.without_pump.par, 2.5)
+    np.testing.assert_allclose(raw_data_without_pump.par, 1.0)
+
+
+def test_compute_da_masks_invalid_points(preambled_worker):
+    with_pump = MeasurementData(np.full(4, 1.0), np.full(4, 1.0), np.full(4, 1.0))
+    without_pump = MeasurementData(np.full(4, 1.0), np.full(4, 1.0), np.full(4, 1.0))
+    with_pump.perp[:] = 2.0
+    with_pump.ref[1] = 0.0
+    without_pump.par[2] = -1.0
+    preambled_worker.with_pump = with_pump
+    preambled_worker.without_pump = without_pump
+    da_par, da_perp, da_cd = preambled_worker.compute_da()
+    assert preambled_worker.invalid_points == 2
+    for signal in (da_par, da_perp, da_cd):
+        assert np.all(np.isfinite(signal))
+        assert signal[2] == 0.0
+    assert da_par[1] == 0.0
+    assert da_perp[1] == 0.0
+    # CD doesn't depend on the reference
+    assert da_cd[1] == da_cd[0] != 0.0
+
+
+def test_invalid_points_left_out_of_averages(preambled_worker):
+    preambled_worker.max_measurements = 1000
+    rng = np.random.default_rng(0)
+    for i in range(4):
+        with_pump = RawData(*rng.uniform(0.5, 1.5, (3, 100)), True)
+        if i == 0:
+            with_pump.ref[10] = 0.0
+        preambled_worker.compute_signals(with_pump)
+        preambled_worker.compute_signals(
+            RawData(*rng.uniform(0.5, 1.5, (3, 100)), False)
+        )
+    assert preambled_worker.stats_da_par.counts[10] == 3
+    assert preambled_worker.stats_da_par.counts[11] == 4
+    assert preambled_worker.stats_da_cd.counts[10] == 4
+
+
+def test_averages_with_standard_error(preambled_worker, raw_data_with_pump):
+    """Ensure that the averages and their errors are sent with the dA signals.
+    """
+    received = []
+    collect_frames(preambled_worker, received)
+    preambled_worker.max_measurements = 1000
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        preambled_worker.compute_signals(raw_data_with_pump)
+        preambled_worker.compute_signals(
+            RawData(*rng.uniform(0.5, 1.5, (3, 100)), has_pump=False)
+        )
+    assert preambled_worker.average_count == 5
+    plot_data = received[-1]
+    assert plot_data.err_da_par is not None
+    assert np.all(plot_data.err_da_par > 0)
+    assert plot_data.avg_da_par is not preambled_worker.avg_da_par
+    np.testing.assert_allclose(plot_data.avg_da_par, preambled_worker.avg_da_par)
+
+
+@mark.parametrize(
+    "saving_worker",
+    [dict(target_cd_error=1.0, convergence_min_measurements=3)],
+    indirect=True,
+)
+def test_stops_when_converged(saving_worker):
+    """Ensure that a run stops early once the CD error is below the target.
+    """
+    worker = saving_worker
+    rng = np.random.default_rng(0)
+    while not common.SHOULD_STOP:
+        feed_pairs(worker, 1, rng)
+    assert worker.count == 3
+    assert worker.converged
+    worker.close_run_file()
+    run = RunReader(worker.save_dir / RUN_FILE_NAME)
+    assert run.metadata["convergence"]["converged"]
+    assert run.metadata["convergence"]["measurements"] == 3
+
+
+@mark.parametrize(
+    "window, points", [((1e-6, 1.0), (50, 1000)), ((3e-5, 4e-5), (None, None))]
+)
+def test_cd_error_window_clipped_to_trace(empty_settings, preamble, window, points):
+    """Ensure that the CD error window never selects points outside of the trace.
+    """
+    settings = empty_settings
+    settings.target_cd_error = 1.0
+    settings.cd_error_window = window
+    worker = ComputationWorker(QMutex(), settings)
+    worker.store_preamble(preamble)
+    assert worker._cd_error_points == points
+
+
+@mark.parametrize("saving_worker", [dict(target_cd_error=1e-12)], indirect=True)
+def test_saves_convergence_when_stopped(saving_worker):
+    """Ensure that a run stopped before it converged still records its CD error.
+    """
+    worker = saving_worker
+    feed_pairs(worker, 3)
+    worker.close_run_file()
+    convergence = RunReader(worker.save_dir / RUN_FILE_NAME).metadata["convergence"]
+    assert not convergence["converged"]
+    assert convergence["measurements"] == 3
+    assert convergence["cd_error"] > 1e-12
+
+
+def test_saves_run_file(saving_worker, preamble):
+    worker = saving_worker
+    feed_pairs(worker, 3)
+    worker.run_writer.flush()
+    assert len(RunReader(worker.save_dir / RUN_FILE_NAME)) == 3
+    worker.close_run_file()
+    run = RunReader(worker.save_dir / RUN_FILE_NAME)
+    assert len(run) == 3
+    assert run["da_cd"].shape == (3, 100)
+    assert run.metadata["settings"]["num_measurements"] == 1000
+    assert read_preambles(run)[0]["points"] == preamble.points
+    assert sorted(worker.save_dir.iterdir()) == [
+        worker.save_dir / RUN_FILE_NAME,
+        worker.save_dir / PREAMBLES_FILE_NAME,
+    ]
+
+
+def test_many_preambles_saved(saving_worker, preamble):
+    """Ensure that a run can record more preambles than fit in the file header.
+    """
+    worker = saving_worker
+    feed_pairs(worker, 1)
+    for _ in range(500):
+        worker.store_preamble(preamble)
+    worker.close_run_file()
+    preambles = read_preambles(RunReader(worker.save_dir / RUN_FILE_NAME))
+    assert len(preambles) == 501
+    assert preambles[-1]["from_measurement"] == 2
+
+
+def test_convergence_not_checked_without_target(preambled_worker, raw_data_with_pump):
+    preambled_worker.max_measurements = 1000
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        preambled_worker.compute_signals(raw_data_with_pump)
+        preambled_worker.compute_signals(
+            RawData(*rng.uniform(0.5, 1.5, (3, 100)), False)
+        )
+    assert not preambled_worker.converged
+    assert not common.SHOULD_STOP
+
+
+def test_saving_holds_buffers_until_written(saving_worker):
+    worker = saving_worker
+    received = []
+    collect_frames(worker, received)
+    feed_pairs(worker, 1)
+    for plot_data in received:
+        plot_data.release()
+    worker.run_writer.flush()
+    assert worker._trace_pool.free_count() == worker._trace_pool.allocations
+    assert worker._da_pool.free_count() == worker._da_pool.allocations
+    worker.close_run_file()
+    assert worker.run_writer is None
+
+
+@mark.parametrize(
+    "saving_worker",
+    [
+        dict(compress_run_file=compress, save_raw_codes=True, dark_curr_par=0.5)
+        for compress in (False, True)
+    ],
+    indirect=True,
+)
+def test_raw_codes_reconstruct_da(saving_worker, preamble):
+    """Ensure that dA computed from saved codes matches the dA computed live.
+    """
+    worker = saving_worker
+    received = []
+    collect_frames(worker, received)
+    rng = np.random.default_rng(0)
+    for i in range(4):
+        if i == 2:
+            preamble.v_scale_par = 0.01
+            worker.store_preamble(preamble)
+        for has_pump in (True, False):
+            codes = rng.integers(100, 120, (3, 100)).astype(np.int8)
+            worker.compute_signals(RawData(*codes, has_pump))
+    worker.close_run_file()
+    live = [d.da_cd for d in received if d.da_cd is not None]
+    run = open_run(worker.save_dir / RUN_FILE_NAME)
+    assert run["with_pump_par"].dtype == np.int8
+    da_par, da_perp, da_cd = load_da(run)
+    np.testing.assert_allclose(da_cd, live)
+    np.testing.assert_allclose(load_da(run, 3)[2], live[3])
+
+
+@mark.parametrize(
+    "saving_worker",
+    [
+        dict(compress_run_file=compress, preallocate_run_file=preallocate)
+        for compress, preallocate in [(False, False), (False, True), (True, False)]
+    ],
+    indirect=True,
+)
+def test_every_format_written_in_background(saving_worker):
+    """Ensure that saving never writes to disk on the computation thread.
+    """
+    worker = saving_worker
+    reports = []
+    worker.signals.writer_queue.connect(lambda *report: reports.append(report))
+    feed_pairs(worker, 1)
+    assert isinstance(worker.run_writer, BackgroundWriter)
+    assert len(reports) == 1
+    worker.close_run_file()
+    assert len(open_run(worker.save_dir / RUN_FILE_NAME)) == 1
+
+
+def test_each_run_saved_to_new_directory(empty_settings, tmp_path):
+    settings = empty_settings
+    settings.save = True
+    settings.save_loc = str(tmp_path)
+    (tmp_path / "notes.txt").write_text("keep me")
+    first = ComputationWorker(QMutex(), settings)
+    settings.keep_runs = 1
+    second = ComputationWorker(QMutex(), settings)
+    second._cleanup_thread.join()
+    assert first.save_dir != second.save_dir
+    assert not first.save_dir.exists()
+    assert second.save_dir.exists()
+    assert (tmp_path / "notes.txt").exists()
+
+
+def test_display_decimation(preambled_worker, raw_data_with_pump):
+    received = []
+    collect_frames(preambled_worker, received)
+    preambled_worker.max_measurements = 1000
+    preambled_worker.set_display_range("live_par", 10, np.nan, np.nan)
+    preambled_worker.set_display_range("avg_da_cd", 5, 0.0, 40 * 20e-9)
+    preambled_worker.compute_signals(raw_data_with_pump)
+    preambled_worker.compute_signals(
+        RawData(*np.random.default_rng(0).uniform(0.5, 1.5, (3, 100)), False)
+    )
+    data = received[-1]
+    assert data.trace_buffers is None
+    assert len(data.par) == 20
+    assert len(data.display_time["live_par"]) == 20
+    upper, lower = data.display_bands["avg_da_cd"]
+    assert len(data.avg_da_cd) == len(upper) == len(lower)
+    assert np.all(upper >= lower)
+    assert preambled_worker._trace_pool.free_count() == TRACE_POOL_SIZE
+
+
+def test_zooming_redraws_averages(preambled_worker, raw_data_with_pump):
+    """Ensure that a new range for an average plot is shown without a new shot.
+    """
+    received = []
+    collect_frames(preambled_worker, received)
+    preambled_worker.max_measurements = 1000
+    preambled_worker.set_display_range("avg_da_cd", 10, np.nan, np.nan)
+    rng = np.random.default_rng(0)
+    for _ in range(2):
+        preambled_worker.compute_signals(raw_data_with_pump)
+        preambled_worker.compute_signals(
+            RawData(*rng.uniform(0.5, 1.5, (3, 100)), False)
+        )
+    last = received[-1]
+    preambled_worker.set_display_range("avg_da_cd", 10, 0.0, 9 * 20e-9)
+    zoomed = received[-1]
+    assert zoomed is not last
+    # Every visible point is shown, rather than an envelope of the whole trace
+    assert np.isin(preambled_worker.avg_da_cd[:10], zoomed.avg_da_cd).all()
+    assert not np.isin(preambled_worker.avg_da_cd[:10], last.avg_da_cd).all()
+    assert zoomed.da_cd is last.da_cd
+    preambled_worker.set_display_range("avg_da_cd", 10, 0.0, 9 * 20e-9)
+    assert received[-1] is zoomed
+
+
+def test_processes_queued_shots_in_order(
+    empty_worker, preamble, raw_data_with_pump, raw_data_without_pump
+):
+    """Ensure that preambles queued with the shots apply to the shots after them.
+    """
+    shots = ShotQueue(4)
+    empty_worker.attach(shots)
+    shots.put_preamble(preamble)
+    shots.put(raw_data_with_pump)
+    scaled = Preamble(**{**asdict(preamble), "v_scale_par": 2.0})
+    shots.put_preamble(scaled)
+    shots.put(raw_data_without_pump)
+    received = []
+    collect_frames(empty_worker, received)
+    queues = []
+    empty_worker.signals.shot_queue.connect(lambda *args: queues.append(args))
+    for _ in range(4):
+        empty_worker.process_shots()
+    np.testing.assert_allclose(received[0].par, 1.0)
+    np.testing.assert_allclose(received[1].par, 2.0)
+    assert empty_worker.count == 1
+    assert queues == [(1, 0), (0, 0)]
+
+
+def test_dropped_pairs_never_split(preambled_worker):
+    """Ensure that a pump shot held by the worker is paired with the shot after it.
+    """
+    preambled_worker.max_measurements = 1000
+    shots = ShotQueue(3, "drop_pairs")
+    preambled_worker.attach(shots)
+    shot = {
+        name: RawData(*np.full((3, 100), value), has_pump=name.startswith("p"))
+        for value, name in enumerate(("p1", "n1", "p2", "n2", "p3"), start=1)
+    }
+    received = []
+    collect_frames(preambled_worker, received)
+    shots.put(shot["p1"])
+    preambled_worker.process_shots()
+    assert preambled_worker.with_pump is not None
+    for name in ("n1", "p2", "n2", "p3"):
+        shots.put(shot[name])
+    preambled_worker.process_shots()
+    assert preambled_worker.count == 1
+    np.testing.assert_allclose(received[-1].par, 2.0)
+    preambled_worker.process_shots()
+    np.testing.assert_allclose(preambled_worker.with_pump.par, 5.0)
+    assert shots.depth() == 0
+
+
+def test_records_stage_timings(
+    preambled_worker, raw_data_with_pump, raw_data_without_pump
+):
+    preambled_worker.compute_signals(raw_data_with_pump)
+    preambled_worker.compute_signals(raw_data_without_pump)
+    summary = preambled_worker.timings.summary()
+    assert summary["scale"]["count"] == 2
+    assert summary["compute_da"]["count"] == 1
+    assert summary["update_averages"]["count"] == 1
@@ -0,0 +1,47 @@
+import numpy as np
+from ns_trcd.decimate import (
+    band_envelope,
+    envelope_bins,
+    envelope_time,
+    minmax_envelope,
+)
+
+
+def test_envelope_keeps_extremes():
+    y = np.sin(np.linspace(0, 20, 100_000))
+    y[12_345] = 5.0
+    bins = envelope_bins(len(y), 100)
+    assert len(bins) == 100
+    envelope = minmax_envelope(y, bins)
+    assert len(envelope) == 200
+    assert envelope.max() == 5.0
+    assert envelope.min() == y.min()
+
+
+def test_visible_range_gets_most_bins():
+    bins = envelope_bins(100_000, 100, 40_000, 50_000, outside_bins=10)
+    assert bins[0] == 0
+    assert np.count_nonzero((bins >= 40_000) & (bins < 50_000)) == 100
+    assert len(bins) == 120
+
+
+def test_short_range_not_decimated():
+    bins = envelope_bins(1_000, 100, 500, 550, outside_bins=10)
+    np.testing.assert_array_equal(bins[10:60], np.arange(500, 550))
+    assert bins[-1] < 1_000
+
+
+def test_range_past_end_of_signal():
+    bins = envelope_bins(1_000, 100, 2_000, 3_000)
+    assert bins.max() < 1_000
+    assert len(minmax_envelope(np.ones(1_000), bins)) == 2 * len(bins)
+
+
+def test_band_envelope():
+    avg = np.zeros(10)
+    err = np.arange(10.0)
+    bins = np.array([0, 5])
+    upper, lower = band_envelope(avg, err, bins, np.empty(10))
+    np.testing.assert_array_equal(upper, [4, 4, 9, 9])
+    np.testing.assert_array_equal(lower, [-4, -4, -9, -9])
+    np.testing.assert_array_equal(envelope_time(bins, 2.0), [0, 0, 10, 10])
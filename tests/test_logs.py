@@ -0,0 +1,79 @@
+import json
+from ns_trcd import logs
+from ns_trcd.logs import SKIPPED_ACTION, AsyncFileSink, configure_logging, log_action
+from pytest import fixture
+from threading import Thread
+
+
+@fixture
+def started(monkeypatch):
+    """Record the actions that are started instead of logging them.
+    """
+    started = []
+    monkeypatch.setattr(
+        logs, "start_action", lambda **fields: started.append(fields) or SKIPPED_ACTION
+    )
+    yield started
+    configure_logging(None)
+
+
+def test_sink_writes_messages_in_order(tmp_path):
+    path = tmp_path / "logs" / "log.txt"
+    sink = AsyncFileSink(path)
+    for i in range(100):
+        sink({"message_type": "shot", "index": i})
+    sink.close()
+    lines = path.read_text().splitlines()
+    assert [json.loads(line)["index"] for line in lines] == list(range(100))
+
+
+def test_sink_drops_messages_instead_of_blocking(tmp_path):
+    sink = AsyncFileSink(tmp_path / "log.txt", max_queued=1)
+    sink._queue.put(None)
+    sink._thread.join()
+    sink({"message_type": "first"})
+    sink({"message_type": "second"})
+    assert sink.dropped == 1
+
+
+def test_actions_below_level_are_skipped(started):
+    configure_logging(None, level="info")
+    assert log_action("update_plots", level="debug") is SKIPPED_ACTION
+    log_action("start_collecting")
+    assert started == [{"action_type": "start_collecting"}]
+
+
+def test_actions_are_sampled(started):
+    configure_logging(None, level="debug", sample_rates={"update_plots": 0.25})
+    for _ in range(8):
+        with log_action("update_plots", level="debug"):
+            pass
+    assert len(started) == 2
+    assert started[0]["sampled_every"] == 4
+
+
+def test_zero_rate_disables_action(started):
+    configure_logging(None, level="debug", sample_rates={"draw_traces": 0})
+    assert log_action("draw_traces", level="debug") is SKIPPED_ACTION
+    assert started == []
+
+
+def test_off_writes_nothing(tmp_path):
+    assert configure_logging(tmp_path / "log.txt", level="off") is None
+    assert not (tmp_path / "log.txt").exists()
+
+
+def test_sampling_counts_every_thread(started):
+    configure_logging(None, level="debug", sample_rates={"update_plots": 0.5})
+    threads = [Thread(target=_log_many, args=(1_000,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert logs._sample_counts["update_plots"] == 4_000
+    assert len(started) == 2_000
+
+
+def _log_many(n):
+    for _ in range(n):
+        log_action("update_plots", level="debug")
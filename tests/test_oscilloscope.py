@@ -0,0 +1,263 @@
+import numpy as np
+from ns_trcd import oscilloscope
+from ns_trcd.oscilloscope import Oscilloscope
+from pytest import fixture
+
+
+class FakeResource:
+    """Records the commands sent to it and replies to queries with canned values.
+    """
+
+    def __init__(self):
+        self.timeout = None
+        self.writes = []
+        self.queries = []
+        self.replies = {}
+        self.binary_calls = []
+        self.ascii_calls = []
+
+    def write(self, cmd):
+        self.writes.append(cmd)
+
+    def query(self, cmd):
+        self.queries.append(cmd)
+        return self.replies[cmd]
+
+    def query_ascii_values(self, cmd, container=list, **kwargs):
+        self.ascii_calls.append(cmd)
+        return container([1.0, 2.0, 3.0])
+
+    def query_binary_values(
+        self, cmd, datatype="f", is_big_endian=False, container=list
+    ):
+        self.binary_calls.append((cmd, datatype, is_big_endian))
+        return container([1, 2, 3])
+
+    def close(self):
+        pass
+
+
+class FakeResourceManager:
+    def __init__(self, resource):
+        self._resource = resource
+
+    def open_resource(self, name):
+        return self._resource
+
+
+@fixture
+def resource() -> FakeResource:
+    return FakeResource()
+
+
+@fixture
+def scope(monkeypatch, resource) -> Oscilloscope:
+    monkeypatch.setattr(
+        oscilloscope.visa, "ResourceManager", lambda: FakeResourceManager(resource)
+    )
+    return Oscilloscope("fake")
+
+
+def test_binary_transfer_is_default(scope, resource):
+    resource.replies["wfmoutpre:byt_nr?"] = "2"
+    scope.set_waveform_encoding()
+    assert resource.writes[-1] == "data:encdg sribinary"
+    curve = scope.get_curve()
+    assert isinstance(curve, np.ndarray)
+    assert resource.binary_calls == [("curve?", "h", False)]
+
+
+def test_byte_width_queried_once(scope, resource):
+    resource.replies["wfmoutpre:byt_nr?"] = "1"
+    scope.set_waveform_encoding()
+    scope.get_curve()
+    scope.get_curve()
+    assert resource.queries.count("wfmoutpre:byt_nr?") == 1
+    assert resource.binary_calls[-1] == ("curve?", "b", False)
+
+
+def test_byte_width_requeried_after_width_change(scope, resource):
+    resource.replies["wfmoutpre:byt_nr?"] = "1"
+    scope.set_waveform_encoding()
+    scope.get_curve()
+    resource.replies["wfmoutpre:byt_nr?"] = "2"
+    scope.set_waveform_byte_width(2)
+    scope.get_curve()
+    assert resource.binary_calls[-1] == ("curve?", "h", False)
+
+
+def test_ascii_fallback(scope, resource):
+    scope.binary_transfer = False
+    scope.set_waveform_encoding()
+    assert resource.writes[-1] == "data:encdg ascii"
+    curve = scope.get_curve()
+    assert isinstance(curve, np.ndarray)
+    assert resource.ascii_calls == ["curve?"]
+    assert resource.binary_calls == []
+
+
+def test_split_binary_blocks():
+    first = np.array([1, -2, 3], dtype="<i2")
+    second = np.array([4, 5, -6], dtype="<i2")
+    raw = b"#16" + first.tobytes() + b";#16" + second.tobytes() + b"\n"
+    curves = oscilloscope.split_binary_blocks(raw, 2, np.dtype("<i2"))
+    np.testing.assert_array_equal(curves[0], first)
+    np.testing.assert_array_equal(curves[1], second)
+    assert curves[0].base is not None
+
+
+def test_get_curves_single_transaction(scope, resource):
+    resource.replies["wfmoutpre:byt_nr?"] = "1"
+    scope.set_waveform_encoding()
+    blocks = [np.arange(4, dtype="i1") * (i + 1) for i in range(3)]
+    raw = b";".join(b"#14" + b.tobytes() for b in blocks) + b"\n"
+    resource.read_raw = lambda: raw
+    par, perp, ref = scope.get_curves([1, 2, 3])
+    np.testing.assert_array_equal(ref, blocks[2])
+    assert resource.writes.count("data:source ch1, ch2, ch3") == 1
+    scope.get_curves([1, 2, 3])
+    assert resource.writes.count("data:source ch1, ch2, ch3") == 1
+
+
+def test_trigger_waiter_reports_polls(scope, resource):
+    states = iter(["armed", "armed", "ready"])
+    scope.get_trigger_state = lambda: next(states)
+    wait = scope.trigger_waiter.wait_for("ready")
+    assert wait.polls == 3
+    assert wait.wait_time > 0
+
+
+def test_trigger_waiter_backs_off(scope, resource, monkeypatch):
+    intervals = []
+    monkeypatch.setattr(oscilloscope, "sleep", intervals.append)
+    states = iter(["armed"] * 10 + ["ready"])
+    scope.get_trigger_state = lambda: next(states)
+    scope.trigger_waiter.wait_for("ready")
+    assert intervals[0] == scope.trigger_waiter.min_interval
+    assert intervals[1] > intervals[0]
+    assert max(intervals) == scope.trigger_waiter.max_interval
+
+
+def test_trigger_waiter_can_be_stopped(scope, resource):
+    scope.get_trigger_state = lambda: "armed"
+    assert scope.trigger_waiter.wait_for("ready", should_stop=lambda: True) is None
+
+
+def test_single_acquisition_waits_on_opc(scope, resource):
+    resource.replies["*OPC?"] = "1"
+    scope.set_single_acquisition_mode()
+    wait = scope.wait_until_triggered()
+    assert wait.polls == 1
+    assert resource.queries == ["*OPC?"]
+
+
+def test_preamble_is_cached(scope, resource):
+    resource.replies["wfmoutpre:xincr?;ymult?;yzero?;nr_pt?"] = "4E-9;1.5E-5;0.1;1000\n"
+    first = scope.get_channel_preamble(1)
+    second = scope.get_channel_preamble(1)
+    assert first is second
+    assert first.points == 1000
+    assert first.v_offset == 0.1
+    assert len(resource.queries) == 1
+
+
+def test_setters_invalidate_preamble(scope, resource):
+    resource.replies["wfmoutpre:xincr?;ymult?;yzero?;nr_pt?"] = "4E-9;1.5E-5;0.1;1000"
+    scope.get_channel_preamble(1)
+    scope.get_channel_preamble(2)
+    scope.set_vertical_scale(2, 0.5)
+    scope.get_channel_preamble(1)
+    scope.get_channel_preamble(2)
+    assert len(resource.queries) == 3
+    scope.set_waveform_stop_point(500)
+    scope.get_channel_preamble(1)
+    assert len(resource.queries) == 4
+
+
+def test_detects_front_panel_changes(scope, resource):
+    query = "ch1:scale?;:ch1:offset?;:ch2:scale?;:ch2:offset?"
+    resource.replies["wfmoutpre:xincr?;ymult?;yzero?;nr_pt?"] = "4E-9;1.5E-5;0.1;1000"
+    resource.replies[query] = "1.0;0.0;1.0;0.0"
+    assert not scope.vertical_settings_changed([1, 2])
+    preamble = scope.get_channel_preamble(2)
+    assert not scope.vertical_settings_changed([1, 2])
+    assert scope.get_channel_preamble(2) is preamble
+    resource.replies[query] = "1.0;0.0;0.5;0.0"
+    assert scope.vertical_settings_changed([1, 2])
+    assert scope.get_channel_preamble(2) is not preamble
+
+
+def test_batch_joins_commands(scope, resource):
+    with scope.batch():
+        scope.set_hi_res_mode()
+        scope.turn_off_all_measurements()
+        assert resource.writes == []
+    assert len(resource.writes) == 1
+    assert resource.writes[0].startswith(":acquire:mode hires;:measurement:meas1")
+    assert resource.writes[0].count(";") == 8
+
+
+def test_batch_splits_long_messages(scope, resource):
+    scope.max_batch_length = 100
+    scope.turn_off_all_measurements()
+    assert len(resource.writes) > 1
+    assert all(len(w) <= 100 for w in resource.writes)
+    assert sum(w.count("state off") for w in resource.writes) == 8
+
+
+def test_batch_flushes_before_query(scope, resource):
+    resource.replies["wfmoutpre:nr_pt?"] = "1000"
+    with scope.batch():
+        scope.set_waveform_start_point(1)
+        scope.get_waveform_length()
+        scope.set_waveform_stop_point(1000)
+    assert resource.writes == [":data:start 1", ":data:stop 1000"]
+
+
+def test_batch_opc_barrier(scope, resource):
+    resource.replies["*OPC?"] = "1"
+    with scope.batch(wait=True):
+        scope.set_hi_res_mode()
+    assert resource.queries == ["*OPC?"]
+
+
+def test_redundant_commands_dropped(scope, resource):
+    scope.set_hi_res_mode()
+    scope.set_hi_res_mode()
+    scope.set_waveform_stop_point(1000)
+    scope.set_waveform_stop_point(2000)
+    assert resource.writes == ["acquire:mode hires", "data:stop 1000", "data:stop 2000"]
+
+
+def test_actions_never_dropped(scope, resource):
+    scope.acquisition_start()
+    scope.acquisition_start()
+    assert resource.writes == ["acquire:state run", "acquire:state run"]
+
+
+def test_dropped_setter_keeps_preamble(scope, resource):
+    resource.replies["wfmoutpre:xincr?;ymult?;yzero?;nr_pt?"] = "4E-9;1.5E-5;0.1;1000"
+    scope.set_vertical_scale(1, 0.5)
+    preamble = scope.get_channel_preamble(1)
+    scope.set_vertical_scale(1, 0.5)
+    assert scope.get_channel_preamble(1) is preamble
+
+
+def test_parse_settings_resolves_relative_headers():
+    reply = ':ACQUIRE:STOPAFTER RUNSTOP;MODE HIRES;:CH1:SCALE 5.0E-1;LABEL "a;b"\n'
+    settings = oscilloscope.parse_settings(reply)
+    assert settings["acquire:mode"] == "hires"
+    assert settings["acquire:stopafter"] == "runstop"
+    assert settings["ch1:scale"] == repr(0.5)
+    assert settings["ch1:label"] == '"a;b"'
+
+
+def test_resync_settings(scope, resource):
+    resource.replies["*LRN?"] = ":ACQUIRE:MODE HIRES;:SELECT:CH1 1;:CH1:SCALE 5.0E-1"
+    scope.resync_settings()
+    resource.writes.clear()
+    scope.set_hi_res_mode()
+    scope.set_channel_on(1)
+    scope.set_vertical_scale(1, 0.5)
+    scope.set_vertical_scale(1, 0.2)
+    assert resource.writes == ["ch1:scale 2.0000E-01"]
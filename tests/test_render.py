@@ -0,0 +1,99 @@
+import numpy as np
+from ns_trcd.buffers import FrameExchange
+from ns_trcd.common import PlotData
+from ns_trcd.render import RenderScheduler
+
+
+class Held:
+    """Counts the references to a set of buffers like a pool would.
+    """
+
+    def __init__(self):
+        self.refs = 1
+
+    def release(self):
+        self.refs -= 1
+
+
+def plot_data(with_da):
+    trace = np.zeros(10)
+    da = trace if with_da else None
+    return PlotData(
+        trace,
+        trace,
+        trace,
+        da,
+        da,
+        da,
+        da,
+        da,
+        da,
+        trace_buffers=Held(),
+        da_buffers=Held() if with_da else None,
+    )
+
+
+def scheduler_with_frames(render):
+    scheduler = RenderScheduler(render)
+    frames = FrameExchange()
+    scheduler.attach(frames)
+    return scheduler, frames
+
+
+def test_exchange_keeps_latest_data():
+    frames = FrameExchange()
+    first = plot_data(with_da=True)
+    second = plot_data(with_da=False)
+    third = plot_data(with_da=False)
+    for data in (first, second, third):
+        frames.publish(data)
+    assert frames.take() == (third, first)
+    assert frames.dropped == 2
+    assert first.trace_buffers is None
+    assert first.da_buffers.refs == 1
+    assert second.trace_buffers is None
+    assert frames.take() == (None, None)
+
+
+def test_exchange_notifies_once_until_taken():
+    frames = FrameExchange()
+    assert frames.publish(plot_data(with_da=True))
+    assert not frames.publish(plot_data(with_da=False))
+    frames.take()
+    assert frames.publish(plot_data(with_da=False))
+    assert frames.sequence == 3
+
+
+def test_only_latest_data_rendered():
+    rendered = []
+    scheduler, frames = scheduler_with_frames(
+        lambda traces, da: rendered.append((traces, da))
+    )
+    first = plot_data(with_da=True)
+    third = plot_data(with_da=False)
+    for data in (first, plot_data(with_da=False), third):
+        frames.publish(data)
+    scheduler.render_pending()
+    assert rendered == [(third, first)]
+    assert scheduler.dropped_frames == 2
+
+
+def test_renders_nothing_without_new_data():
+    rendered = []
+    scheduler, frames = scheduler_with_frames(
+        lambda traces, da: rendered.append((traces, da))
+    )
+    frames.publish(plot_data(with_da=True))
+    scheduler.render_pending()
+    scheduler.render_pending()
+    assert len(rendered) == 1
+    assert scheduler.rendered_frames == 1
+
+
+def test_clear_releases_pending_data():
+    scheduler, frames = scheduler_with_frames(lambda traces, da: None)
+    data = plot_data(with_da=True)
+    buffers = (data.trace_buffers, data.da_buffers)
+    frames.publish(data)
+    scheduler.clear()
+    assert [b.refs for b in buffers] == [0, 0]
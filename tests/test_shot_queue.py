@@ -0,0 +1,93 @@
+from threading import Thread
+from time import sleep
+from ns_trcd.shot_queue import ShotQueue
+from pytest import raises
+
+
+def drain(queue):
+    items = []
+    while True:
+        item, _ = queue.get()
+        if item is None:
+            return items
+        items.append(item)
+
+
+def test_notifies_once_until_emptied():
+    queue = ShotQueue(4)
+    assert queue.put(1)
+    assert not queue.put(2)
+    assert queue.get() == (1, True)
+    assert not queue.put(3)
+    assert queue.get() == (2, True)
+    assert queue.get() == (3, False)
+    assert queue.put(4)
+
+
+def test_drop_oldest():
+    queue = ShotQueue(3, "drop_oldest")
+    for shot in range(5):
+        queue.put(shot)
+    assert queue.depth() == 3
+    assert queue.dropped == 2
+    assert drain(queue) == [2, 3, 4]
+
+
+def test_drop_pairs_keeps_preambles():
+    queue = ShotQueue(4, "drop_pairs")
+    queue.put(0)
+    queue.put_preamble("preamble")
+    for shot in range(1, 5):
+        queue.put(shot)
+    assert queue.dropped == 2
+    assert queue.max_depth == 4
+    assert drain(queue) == ["preamble", 2, 3, 4]
+
+
+def test_drop_pairs_keeps_partner_of_held_shot():
+    queue = ShotQueue(3, "drop_pairs")
+    queue.put("p1")
+    assert queue.get() == ("p1", False)
+    for shot in ("n1", "p2", "n2", "p3"):
+        queue.put(shot)
+    assert drain(queue) == ["n1", "p3"]
+    assert queue.dropped == 2
+
+
+def test_drop_pairs_discards_shot_that_completes_pair():
+    queue = ShotQueue(2, "drop_pairs")
+    queue.put("p1")
+    queue.get()
+    queue.put("n1")
+    queue.put("p2")
+    assert not queue.put("n2")
+    assert queue.dropped == 2
+    assert drain(queue) == ["n1"]
+
+
+def test_block_waits_for_space():
+    queue = ShotQueue(1)
+    queue.put(0)
+    putter = Thread(target=queue.put, args=(1,))
+    putter.start()
+    sleep(0.05)
+    assert putter.is_alive()
+    assert queue.get() == (0, False)
+    putter.join(timeout=1)
+    assert not putter.is_alive()
+    assert drain(queue) == [1]
+    assert queue.dropped == 0
+
+
+def test_block_gives_up_when_stopped():
+    queue = ShotQueue(1)
+    queue.put(0)
+    assert not queue.put(1, should_stop=lambda: True)
+    assert drain(queue) == [0]
+
+
+def test_unknown_policy():
+    with raises(ValueError):
+        ShotQueue(4, "drop_newest")
+    with raises(ValueError):
+        ShotQueue(1, "drop_pairs")
@@ -0,0 +1,66 @@
+import numpy as np
+from ns_trcd.common import SimulationSettings
+from ns_trcd.oscilloscope import Oscilloscope
+from ns_trcd.simulation import SimulatedOscilloscope, SimulatedShutter
+from pytest import fixture
+
+
+@fixture
+def sim_settings() -> SimulationSettings:
+    return SimulationSettings(
+        trigger_rate=1_000, record_length=1_000, latency=0, seed=0
+    )
+
+
+@fixture
+def sim_scope(sim_settings) -> Oscilloscope:
+    scope = Oscilloscope(SimulatedOscilloscope(sim_settings))
+    scope.set_hi_res_mode()
+    scope.set_waveform_encoding()
+    scope.set_waveform_byte_width(2)
+    return scope
+
+
+def test_simulated_curves_have_record_length(sim_scope, sim_settings):
+    par, perp, ref = sim_scope.get_curves([1, 2, 3])
+    assert par.dtype == np.int16
+    assert len(par) == len(perp) == len(ref) == sim_settings.record_length
+
+
+def test_simulated_preamble_reconstructs_probe(sim_scope):
+    preamble = sim_scope.get_channel_preamble(3)
+    ref = sim_scope.get_curves([3])[0] * preamble.v_scale + preamble.v_offset
+    assert abs(ref.mean() - 0.5) < 0.01
+
+
+def test_simulated_start_stop_points(sim_scope):
+    sim_scope.set_waveform_start_point(101)
+    sim_scope.set_waveform_stop_point(200)
+    assert sim_scope.get_channel_preamble(1).points == 100
+    assert len(sim_scope.get_curves([1, 2])[1]) == 100
+
+
+def test_simulated_ascii_transfer(sim_scope):
+    sim_scope.binary_transfer = False
+    sim_scope.set_waveform_encoding()
+    par, perp = sim_scope.get_curves([1, 2])
+    assert len(par) == len(perp)
+
+
+def test_simulated_trigger_wait(sim_scope):
+    sim_scope.acquisition_start()
+    wait = sim_scope.trigger_waiter.wait_for("ready")
+    assert wait.polls >= 1
+
+
+def test_simulated_shutter_alternates(sim_scope):
+    shutter = SimulatedShutter(sim_scope._scope.laser)
+    states = {shutter.read(4), shutter.read(4)}
+    assert states == {b"open", b"shut"}
+
+
+def test_new_scope_skips_settings_after_resync(sim_scope):
+    scope = Oscilloscope(sim_scope._scope)
+    scope.resync_settings()
+    assert not scope._write("acquire:mode hires")
+    assert scope._write("acquire:mode sample")
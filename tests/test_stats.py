@@ -0,0 +1,74 @@
+import numpy as np
+from ns_trcd.stats import RunningStats
+from pytest import fixture
+
+
+@fixture
+def samples() -> np.ndarray:
+    return np.random.default_rng(0).normal(1.0, 0.5, (50, 20))
+
+
+def test_matches_numpy(samples):
+    stats = RunningStats(20)
+    for x in samples:
+        stats.update(x)
+    np.testing.assert_allclose(stats.mean, samples.mean(axis=0))
+    np.testing.assert_allclose(stats.variance(), samples.var(axis=0, ddof=1))
+    np.testing.assert_allclose(
+        stats.standard_error(), samples.std(axis=0, ddof=1) / np.sqrt(50)
+    )
+
+
+def test_mean_updated_in_place(samples):
+    stats = RunningStats(20)
+    mean = stats.mean
+    stats.update(samples[0])
+    assert stats.mean is mean
+    np.testing.assert_allclose(mean, samples[0])
+
+
+def test_single_measurement_has_no_variance(samples):
+    stats = RunningStats(20)
+    stats.update(samples[0])
+    assert np.all(stats.standard_error() == 0)
+
+
+def test_reset(samples):
+    stats = RunningStats(20)
+    stats.update(samples[0])
+    stats.reset()
+    stats.update(samples[1])
+    assert stats.count == 1
+    np.testing.assert_allclose(stats.mean, samples[1])
+
+
+def test_window_standard_error(samples):
+    stats = RunningStats(20)
+    assert stats.window_standard_error() == np.inf
+    for x in samples:
+        stats.update(x)
+    variance = samples[:, 5:10].var(axis=0, ddof=1).mean()
+    expected = np.sqrt(variance / len(samples))
+    assert abs(stats.window_standard_error(5, 10) - expected) < 1e-12
+
+
+def test_masked_points_left_out(samples):
+    stats = RunningStats(20)
+    where = np.ones(samples.shape, dtype=bool)
+    where[::3, 4] = False
+    where[:, 7] = False
+    for x, valid in zip(samples, where):
+        stats.update(np.where(valid, x, 0.0), valid)
+    assert stats.count == 50
+    np.testing.assert_array_equal(stats.counts, where.sum(axis=0))
+    kept = samples[where[:, 4], 4]
+    np.testing.assert_allclose(stats.mean[4], kept.mean())
+    np.testing.assert_allclose(stats.variance()[4], kept.var(ddof=1))
+    assert stats.mean[7] == 0
+    assert stats.standard_error()[7] == 0
+    expected = np.sqrt(kept.var(ddof=1) / len(kept))
+    assert abs(stats.window_standard_error(4, 5) - expected) < 1e-12
+    assert stats.window_standard_error(7, 8) == np.inf
+    error = stats.standard_error()
+    expected = np.sqrt((error[6] ** 2 + error[8] ** 2) / 2)
+    assert abs(stats.window_standard_error(6, 9) - expected) < 1e-12
@@ -0,0 +1,284 @@
+import numpy as np
+from ns_trcd.storage import (
+    DATASETS,
+    PREAMBLES_FILE_NAME,
+    BackgroundWriter,
+    CompressedRunReader,
+    CompressedRunWriter,
+    RunReader,
+    RunStore,
+    RunWriter,
+    append_preamble,
+    create_run_dir,
+    list_run_dirs,
+    open_run,
+    read_preambles,
+    remove_old_runs,
+)
+from ns_trcd.timing import StageTimings
+from datetime import datetime, timedelta
+from threading import Event
+from pytest import fixture, mark, raises
+
+
+@fixture
+def run_path(tmp_path):
+    return tmp_path / "run.trcd"
+
+
+def measurement(i, points=10):
+    return {name: np.full(points, i + j) for j, name in enumerate(DATASETS)}
+
+
+def test_round_trip(run_path):
+    writer = RunWriter(run_path, 10, metadata={"sample": "a"})
+    for i in range(5):
+        writer.append(measurement(i))
+    writer.close()
+    run = RunReader(run_path)
+    assert len(run) == 5
+    assert run.metadata == {"sample": "a"}
+    assert run["da_cd"].shape == (5, 10)
+    np.testing.assert_array_equal(run.read("with_pump_perp", slice(1, 3))[:, 0], [2, 3])
+    np.testing.assert_array_equal(run["da_cd"][4], measurement(4)["da_cd"])
+
+
+def test_reads_while_writing(run_path):
+    writer = RunWriter(run_path, 10)
+    run = RunReader(run_path)
+    assert len(run) == 0
+    writer.append(measurement(0))
+    writer.append(measurement(1))
+    run.refresh()
+    assert len(run) == 2
+
+
+def test_metadata_updated_in_place(run_path):
+    writer = RunWriter(run_path, 10, metadata={"sample": "a"})
+    writer.append(measurement(0))
+    writer.update_metadata(converged=True)
+    writer.append(measurement(1))
+    run = RunReader(run_path)
+    assert run.metadata == {"sample": "a", "converged": True}
+    np.testing.assert_array_equal(run["da_par"][:, 0], [6, 7])
+
+
+def test_preambles_saved_next_to_run(run_path):
+    writer = RunWriter(run_path, 10)
+    append_preamble(run_path.parent, {"from_measurement": 1})
+    append_preamble(run_path.parent, {"from_measurement": 5})
+    with open(run_path.parent / PREAMBLES_FILE_NAME, "a") as f:
+        f.write('{"from_meas')
+    writer.close()
+    preambles = read_preambles(RunReader(run_path))
+    assert [p["from_measurement"] for p in preambles] == [1, 5]
+
+
+def test_custom_datasets(run_path):
+    writer = RunWriter(run_path, 4, datasets=[("codes", "<i2")])
+    writer.append({"codes": np.arange(4)})
+    run = RunReader(run_path)
+    assert run["codes"].dtype == np.dtype("<i2")
+
+
+def test_rejects_wrong_length(run_path):
+    writer = RunWriter(run_path, 10)
+    with raises(ValueError):
+        writer.append(measurement(0, points=5))
+
+
+class Held:
+    """Counts retains and releases like a set of pooled buffers.
+    """
+
+    def __init__(self, nbytes=0):
+        self.refs = 0
+        self.nbytes = nbytes
+
+    def retain(self):
+        self.refs += 1
+
+    def release(self):
+        self.refs -= 1
+
+
+def test_background_writer(run_path):
+    writer = BackgroundWriter(RunWriter(run_path, 10))
+    held = Held()
+    for i in range(5):
+        assert writer.submit(measurement(i), [held])
+    writer.update_metadata(done=True)
+    writer.close()
+    assert held.refs == 0
+    run = RunReader(run_path)
+    assert len(run) == 5
+    assert run.metadata["done"]
+
+
+def test_background_writer_times_writes(run_path):
+    timings = StageTimings()
+    writer = BackgroundWriter(RunWriter(run_path, 10), timings=timings)
+    for i in range(3):
+        writer.submit(measurement(i))
+    writer.update_metadata(done=True)
+    writer.close()
+    assert timings.summary()["write"]["count"] == 3
+
+
+def test_background_writer_drops_when_full(run_path):
+    writer = BackgroundWriter(RunWriter(run_path, 10), max_queued=1, policy="drop")
+    blocked = Event()
+    original = writer.writer.append
+    writer.writer.append = lambda arrays: blocked.wait() and original(arrays)
+    held = Held()
+    results = [writer.submit(measurement(i), [held]) for i in range(5)]
+    blocked.set()
+    writer.close()
+    assert not all(results)
+    assert writer.dropped == results.count(False)
+    assert held.refs == 0
+    assert len(RunReader(run_path)) == results.count(True)
+
+
+def test_background_writer_limits_queued_bytes(run_path):
+    writer = BackgroundWriter(
+        RunWriter(run_path, 10), policy="drop", max_queued_bytes=250
+    )
+    blocked = Event()
+    original = writer.writer.append
+    writer.writer.append = lambda arrays: blocked.wait() and original(arrays)
+    held = [Held(nbytes=100) for _ in range(5)]
+    results = [writer.submit(measurement(i), [h]) for i, h in enumerate(held)]
+    assert results == [True, True, False, False, False]
+    assert writer.queued_bytes() == 200
+    blocked.set()
+    writer.close()
+    assert writer.queued_bytes() == 0
+    assert [h.refs for h in held] == [0] * 5
+    assert len(RunReader(run_path)) == 2
+
+
+def test_background_writer_rejects_unknown_policy(run_path):
+    with raises(ValueError):
+        BackgroundWriter(RunWriter(run_path, 10), policy="ignore")
+
+
+def test_run_store_preallocates(run_path):
+    store = RunStore(run_path, 10, capacity=4, metadata={"sample": "a"})
+    size = run_path.stat().st_size
+    store.append(measurement(0))
+    row = store.next_row()
+    row["da_cd"][:] = 3.0
+    store.commit()
+    assert run_path.stat().st_size == size
+    run = RunReader(run_path)
+    assert len(run) == 2
+    np.testing.assert_array_equal(run["da_cd"][1], 3.0)
+    del run
+    store.update_metadata(done=True)
+    store.close()
+    assert run_path.stat().st_size < size
+    run = RunReader(run_path)
+    assert len(run) == 2
+    assert run.metadata == {"sample": "a", "done": True}
+
+
+def test_run_store_full(run_path):
+    store = RunStore(run_path, 10, capacity=1)
+    store.append(measurement(0))
+    with raises(ValueError):
+        store.append(measurement(1))
+
+
+def test_compressed_round_trip(run_path):
+    writer = CompressedRunWriter(
+        run_path, 10, datasets=[("codes", "<i2"), ("volts", "<f8")], chunk_bytes=300
+    )
+    rng = np.random.default_rng(0)
+    codes = rng.integers(-1000, 1000, (7, 10)).astype("<i2")
+    volts = rng.normal(size=(7, 10))
+    for c, v in zip(codes, volts):
+        writer.append({"codes": c, "volts": v})
+    writer.close()
+    run = open_run(run_path)
+    assert isinstance(run, CompressedRunReader)
+    assert len(run) == 7
+    np.testing.assert_array_equal(run["codes"], codes)
+    np.testing.assert_array_equal(run["volts"], volts)
+    np.testing.assert_array_equal(run.read("codes", [6, 0, 4]), codes[[6, 0, 4]])
+    np.testing.assert_array_equal(run.read("codes", 5), codes[5])
+    starts = [start for start, _ in run.iter_chunks()]
+    assert starts == [0, 3, 6]
+    assert run.metadata["compression_stats"]["raw_bytes"] == 7 * 10 * (2 + 8)
+
+
+@mark.parametrize("codec", ["zlib", "bz2", "lzma"])
+def test_large_measurements_compressed_alone(run_path, codec):
+    writer = CompressedRunWriter(
+        run_path,
+        100_000,
+        datasets=[("codes", "<i2")],
+        codec=codec,
+        level=1,
+        chunk_bytes=1_000,
+        max_pending_bytes=1_000,
+    )
+    assert writer.chunk_size == 1
+    codes = np.arange(300_000).reshape(3, 100_000).astype("<i2")
+    for c in codes:
+        writer.append({"codes": c})
+        assert len(writer._pending) <= 2
+    writer.close()
+    run = open_run(run_path)
+    assert [start for start, _ in run.iter_chunks()] == [0, 1, 2]
+    np.testing.assert_array_equal(run["codes"], codes)
+
+
+def test_compression_shrinks_smooth_traces(run_path):
+    writer = CompressedRunWriter(run_path, 1000, datasets=[("codes", "<i2")])
+    trace = (1000 * np.exp(-np.arange(1000) / 200)).astype("<i2")
+    for _ in range(32):
+        writer.append({"codes": trace})
+    writer.close()
+    stats = writer.stats()
+    assert stats["ratio"] > 10
+    assert stats["throughput"] > 0
+
+
+def test_compressed_reader_sees_written_chunks(run_path):
+    writer = CompressedRunWriter(run_path, 10, chunk_bytes=1440, workers=1)
+    run = CompressedRunReader(run_path)
+    for i in range(3):
+        writer.append(measurement(i))
+    writer._write_finished(wait=True)
+    run.refresh()
+    assert len(run) == 2
+    writer.close()
+    run.refresh()
+    assert len(run) == 3
+    with raises(ValueError):
+        RunReader(run_path)
+
+
+def test_run_dirs_are_unique_and_ordered(tmp_path):
+    now = datetime(2020, 1, 2, 3, 4, 5)
+    first = create_run_dir(tmp_path, now)
+    second = create_run_dir(tmp_path, now)
+    third = create_run_dir(tmp_path, now + timedelta(seconds=1))
+    (tmp_path / "other").mkdir()
+    assert first.name == "run-20200102-030405"
+    assert second.name == "run-20200102-030405-1"
+    assert list_run_dirs(tmp_path) == [first, second, third]
+
+
+def test_remove_old_runs(tmp_path):
+    now = datetime(2020, 1, 2, 3, 4, 5)
+    runs = [create_run_dir(tmp_path, now + timedelta(minutes=i)) for i in range(4)]
+    (tmp_path / "other").mkdir()
+    removed = remove_old_runs(tmp_path, keep_runs=2, exclude=[runs[0]])
+    assert removed == [runs[1]]
+    assert list_run_dirs(tmp_path) == [runs[0], runs[2], runs[3]]
+    later = datetime.now() + timedelta(days=2)
+    removed = remove_old_runs(tmp_path, max_age_days=1, exclude=[runs[3]], now=later)
+    assert removed == [runs[0], runs[2]]
+    assert (tmp_path / "other").exists()
@@ -0,0 +1,53 @@
+import json
+import numpy as np
+from ns_trcd.timing import HISTOGRAM_EDGES, LatencyHistogram, StageTimings
+
+
+def test_histogram_statistics():
+    histogram = LatencyHistogram()
+    for ms in range(1, 101):
+        histogram.add(ms * 1e-3)
+    summary = histogram.summary()
+    assert summary["count"] == 100
+    assert np.isclose(summary["mean"], 50.5e-3)
+    assert summary["min"] == 1e-3
+    assert summary["max"] == 0.1
+    # Percentiles are only known to within a bin, a factor of 10**0.1
+    assert 50e-3 <= summary["p50"] <= 50e-3 * 10 ** 0.1
+    assert summary["p99"] <= summary["max"]
+
+
+def test_histogram_overflow():
+    histogram = LatencyHistogram()
+    histogram.add(1e-9)
+    histogram.add(1e3)
+    assert histogram.counts[0] == 1
+    assert histogram.counts[-1] == 1
+    assert histogram.percentile(100) == 1e3
+
+
+def test_empty_histogram():
+    histogram = LatencyHistogram()
+    assert np.isnan(histogram.percentile(50))
+    assert histogram.summary() == {"count": 0}
+
+
+def test_stages_in_pipeline_order():
+    timings = StageTimings()
+    timings.record("render", 1e-3)
+    timings.record("custom", 1e-3)
+    with timings.time("transfer"):
+        pass
+    assert timings.stages() == ["transfer", "render", "custom"]
+    assert timings.summary()["transfer"]["count"] == 1
+
+
+def test_export(tmp_path):
+    timings = StageTimings()
+    timings.record("compute_da", 2e-3)
+    timings.export(tmp_path / "timings.json")
+    exported = json.loads((tmp_path / "timings.json").read_text())
+    assert len(exported["edges"]) == len(HISTOGRAM_EDGES)
+    stage = exported["stages"]["compute_da"]
+    assert sum(stage["counts"]) == 1
+    assert stage["max"] == 2e-3